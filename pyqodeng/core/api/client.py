@@ -4,15 +4,21 @@ user throught the backend manager (
 :class:`pyqode.core.managers.BackendManager`)
 
 """
-import locale
 import json
+import locale
 import logging
+import os
+import signal
 import socket
-import struct
 import sys
+import time
 import uuid
 from weakref import ref
-from qtpy import QtCore, QtNetwork
+from qtpy import QtCore, QtGui, QtNetwork
+
+from pyqodeng.core.backend.metrics import Metrics
+from pyqodeng.core.backend.protocol import Framing, FrameReader
+from pyqodeng.core.backend.server import PRIORITY_NORMAL
 
 
 def _logger():
@@ -160,81 +166,700 @@ else:
             return self._obj is not None and self._obj() is None
 
 
-class JsonTcpClient(QtNetwork.QTcpSocket):
+def _callback_ref(on_receive):
+    """
+    Returns a weak reference to the ``on_receive`` callback (or None if there
+    is no callback).
     """
-    A json tcp client socket used to start and communicate with the pyqode
-    backend.
+    if on_receive is None:
+        return None
+    try:
+        return WeakMethod(on_receive)
+    except TypeError:
+        # unbound method (i.e. free function)
+        return ref(on_receive)
 
-    It uses a simple message protocol. A message is made up of two parts.
-    parts:
-      - header: contains the length of the payload. (4bytes)
-      - payload: data as a json string.
 
+class DocumentTracker(QtCore.QObject):
     """
-    #: Internal signal emitted when the backend request finished and the
-    #: socket can be removed from the list of sockets maintained by the
-    #: backend manager
-    finished = QtCore.Signal(QtNetwork.QTcpSocket)
+    Tracks the changes made to a QTextDocument so that the document can be
+    synchronised incrementally with the backend: the full text is sent once,
+    then only the changes are sent (see
+    :class:`pyqode.core.backend.documents.DocumentStore`).
 
-    def __init__(self, parent, port, worker_class_or_function, args,
-                 on_receive=None):
-        super(JsonTcpClient, self).__init__(parent)
-        self._port = port
-        self._worker = worker_class_or_function
-        self._args = args
-        self._header_complete = False
-        self._header_buf = bytes()
-        self._to_read = 0
-        self._data_buf = bytes()
-        if on_receive:
+    Each change increments the document version. The tracker keeps a limited
+    history of changes, a client that is too far behind has to send the full
+    text again.
+
+    Qt counts the positions in UTF-16 code units while the server counts
+    code points, the changes are converted when the document contains
+    characters outside the BMP (e.g. emojis).
+    """
+    #: Maximum number of changes kept in the history.
+    MAX_CHANGES = 1000
+
+    def __init__(self, document, path=None):
+        super(DocumentTracker, self).__init__(document)
+        #: Unique document id.
+        self.id = str(uuid.uuid4())
+        #: Document version
+        self.version = 0
+        #: Path of the document
+        self.path = path
+        self.document = document
+        self._length = document.characterCount() - 1
+        #: length of the text in code points
+        self._text_length = 0
+        #: True if the text contains characters outside the BMP, the Qt
+        #: positions must then be converted to code points
+        self._astral = False
+        self._update_text_length(self.text())
+        #: list of (version, position, chars removed, text added)
+        self._changes = []
+        #: oldest version that can be updated with the changes history
+        self._base_version = 0
+        document.contentsChange.connect(self._on_contents_change)
+
+    def text(self):
+        """ Returns the full document text """
+        return self.document.toPlainText()
+
+    def changes_since(self, version):
+        """
+        Returns the list of changes made since ``version``, None if the
+        history does not go back that far.
+
+        :returns: list of [position, chars removed, text added]
+        """
+        if version < self._base_version or version > self.version:
+            return None
+        return [[pos, removed, added]
+                for ver, pos, removed, added in self._changes
+                if ver > version]
+
+    def _reset_history(self):
+        self._changes[:] = []
+        self._base_version = self.version
+
+    def _update_text_length(self, text):
+        self._text_length = len(text)
+        # each character outside the BMP is a surrogate pair for Qt
+        self._astral = len(text) != self._length
+
+    def _converted_change(self, position, added):
+        """
+        Converts a change to code points: returns the position, the number
+        of chars removed and the text added.
+        """
+        text = self.text()
+        # a code point index is never greater than the UTF-16 index
+        data = text[:position + added].encode('utf-16-le')
+        position_cp = len(data[:2 * position].decode('utf-16-le'))
+        added_text = data[2 * position:].decode('utf-16-le')
+        removed = self._text_length - len(text) + len(added_text)
+        self._update_text_length(text)
+        return position_cp, removed, added_text
+
+    def _on_contents_change(self, position, removed, added):
+        document = self.document
+        length = document.characterCount() - 1
+        # QTextDocument includes the implicit last paragraph separator in
+        # the counts when the whole document is replaced.
+        removed = max(0, min(removed, self._length - position))
+        added = max(0, min(added, length - position))
+        self.version += 1
+        if self._length - removed + added != length:
+            # inconsistent notification, the full text must be sent again
+            _logger().debug('inconsistent document change, resetting history')
+            self._length = length
+            self._update_text_length(self.text())
+            self._reset_history()
+            return
+        self._length = length
+        if self._astral:
             try:
-                self._callback = WeakMethod(on_receive)
-            except TypeError:
-                # unbound method (i.e. free function)
-                self._callback = ref(on_receive)
+                position, removed, text = self._converted_change(
+                    position, added)
+            except UnicodeDecodeError:
+                # the change splits a surrogate pair
+                _logger().debug('change inside a surrogate pair, resetting '
+                                'history')
+                self._update_text_length(self.text())
+                self._reset_history()
+                return
         else:
-            self._callback = None
+            if added:
+                cursor = QtGui.QTextCursor(document)
+                cursor.setPosition(position)
+                cursor.setPosition(position + added,
+                                   QtGui.QTextCursor.KeepAnchor)
+                # same mapping as QTextDocument.toPlainText
+                text = cursor.selectedText().replace(
+                    '\u2029', '\n').replace('\u2028', '\n').replace(
+                    '\xa0', ' ')
+            else:
+                text = ''
+            # the text before the change has no surrogate pairs, only the
+            # added text may have some
+            self._text_length += len(text) - removed
+            self._astral = len(text) != added
+        self._changes.append((self.version, position, removed, text))
+        if len(self._changes) > self.MAX_CHANGES:
+            self._base_version = self._changes.pop(0)[0]
+
+
+class _JsonClientMixin(object):
+    """
+    Implements the client side of the backend protocol, independently of the
+    transport (see :class:`JsonTcpClient`, :class:`JsonLocalClient` and
+    :class:`JsonPipeClient`).
+
+    The connection is long-lived: the client connects once to the backend
+    process and all the requests are multiplexed over the same connection.
+    Requests are pipelined (they are written as soon as they are made,
+    without waiting for the previous results) and each response is routed to
+    the request callback using the ``request_id`` echoed back by the server,
+    responses can thus arrive in any order.
+
+    It uses a simple message protocol. A message is made up of two parts:
+      - header: contains the length of the payload. (4bytes)
+      - payload: data as a json string.
+
+    Once connected, the client negotiates a more compact framing with the
+    server (see :mod:`pyqode.core.backend.protocol`): the payloads are
+    serialised with marshal if the backend runs the same python version
+    and the large payloads are compressed. The messages sent before the end
+    of the negotiation are queued.
+    """
+    #: Encodings proposed to the server, by order of preference. Remove
+    #: ``'marshal'`` to always use json.
+    ENCODINGS = ('marshal', 'json')
+    #: Whether the large payloads may be compressed.
+    COMPRESSION = True
+    #: Delay (in ms) after which a keepalive message is sent if nothing else
+    #: has been sent, it must be lower than the server heartbeat delay.
+    KEEPALIVE_INTERVAL = 15000
+    #: Delay (in ms) after which the client starts polling the server if the
+    #: backend process has not reported that it is ready.
+    READY_TIMEOUT = 2000
+
+    def _setup_client(self):
+        self._framing = Framing()
+        self._reader = FrameReader(self._framing)
+        #: True once the framing has been negotiated with the server
+        self._negotiated = False
+        #: requests waiting for their results: request_id -> callback ref
+        self._pending = {}
+        #: callbacks of the streamed requests: request_id -> callback ref
+        self._chunk_callbacks = {}
+        #: group of the pending requests: request_id -> group
+        self._groups = {}
+        #: version of the documents known by the server: doc id -> version
+        self._documents = {}
+        #: requests that refer to a document, kept in case the request has
+        #: to be sent again: request_id -> request
+        self._document_requests = {}
+        #: messages sent before the framing has been negotiated
+        self._queue = []
+        #: send time of the pending requests: request_id -> (worker, time)
+        self._sent_at = {}
+        #: deadlines of the pending requests: request_id -> (timer,
+        #: on_timeout callback ref)
+        self._deadlines = {}
+        self._bytes_sent = 0
+        self._bytes_received = 0
+        #: client side metrics: per worker ``calls``, ``cancelled``,
+        #: ``timeouts``, ``fallbacks`` (requests run in process by the
+        #: backend manager), ``response_bytes`` and ``round_trip`` latency
+        #: histogram (see
+        #: :class:`pyqode.core.backend.metrics.Metrics`).
+        self.metrics = Metrics()
+        self.metrics.gauges.update({
+            'in_flight': lambda: len(self._pending),
+            'bytes_sent': lambda: self._bytes_sent,
+            'bytes_received': lambda: self._bytes_received})
         self.is_connected = False
         self._closed = False
-        self.connected.connect(self._on_connected)
-        self.error.connect(self._on_error)
-        self.disconnected.connect(self._on_disconnected)
-        self.readyRead.connect(self._on_ready_read)
-        self._connect()
+        # keeps the server alive, one single timer per connection whatever
+        # the number of editors sharing it.
+        self._keepalive_timer = QtCore.QTimer(self)
+        self._keepalive_timer.setInterval(self.KEEPALIVE_INTERVAL)
+        self._keepalive_timer.timeout.connect(self._send_keepalive)
 
-    def close(self):
+    @property
+    def closed(self):
+        """
+        True if the client has been closed (explicitly or because the
+        backend went away). A closed client cannot be used anymore.
+        """
+        return self._closed
+
+    @property
+    def pending_requests(self):
+        """
+        Returns the number of requests that are still waiting for results.
+        """
+        return len(self._pending)
+
+    def is_pending(self, request_id):
+        """
+        Tells whether a request is still waiting for its results.
+
+        :param request_id: the request id.
+        """
+        return request_id in self._pending
+
+    def _close_client(self):
         self._closed = True  # fix issue with QTimer.singleShot
-        super(JsonTcpClient, self).close()
-        self._callback = None
+        self._pending.clear()
+        self._sent_at.clear()
+        self._stop_deadlines()
+        self._chunk_callbacks.clear()
+        self._groups.clear()
+        self._document_requests.clear()
+        self._queue[:] = []
+        self._keepalive_timer.stop()
 
-    def _send_request(self):
+    def request(self, worker_class_or_function, args, on_receive=None,
+                priority=PRIORITY_NORMAL, group=None, document=None,
+                document_key='code', cache=False, on_chunk=None,
+                profile=False, timeout=None, on_timeout=None):
         """
-        Sends the request to the backend.
+        Requests some work to be done by the backend.
+
+        :param worker_class_or_function: Worker class or function
+        :param args: worker args, any Json serializable objects
+        :param on_receive: an optional callback executed when we receive the
+            worker's results.
+        :param priority: request priority, see
+            :attr:`pyqode.core.backend.PRIORITY_INTERACTIVE`.
+        :param group: optional request group, the new request cancels the
+            pending requests of the same group.
+        :param document: optional :class:`DocumentTracker`, the document is
+            synchronised with the backend and its text is passed to the
+            worker using the ``document_key`` key of the request data.
+        :param document_key: see ``document``.
+        :param cache: True to let the backend answer with the cached results
+            of an identical request (same worker, document content and args).
+        :param on_chunk: optional callback executed with each chunk of items
+            produced by a generator worker, as soon as they are available.
+            ``on_receive`` is then called with an empty list once all the
+            chunks have been delivered. Workers that are not generators
+            deliver their results to ``on_receive`` as usual.
+        :param profile: True to run the worker under the backend profiler
+            (see :mod:`pyqode.core.backend.profiler`).
+        :param timeout: optional deadline (in milliseconds): if the results
+            have not been received in time, the request is cancelled and
+            ``on_timeout`` is called (without arguments). The deadline of a
+            streamed request is re-armed each time a chunk is received.
+        :param on_timeout: see ``timeout``.
+        :returns: The id of the request.
+        """
+        request_id = self._register_request(
+            worker_class_or_function, args, on_receive, priority, group,
+            document, document_key, cache, on_chunk, profile)
+        if timeout is not None:
+            self._start_deadline(request_id, timeout, on_timeout)
+        self._send_request(request_id, worker_class_or_function, args,
+                           priority, group, document, document_key, cache,
+                           on_chunk is not None, profile)
+        return request_id
+
+    def request_batch(self, requests, document=None, document_key='code',
+                      cache=False):
         """
-        if isinstance(self._worker, str):
-            classname = self._worker
+        Sends several requests at once, in one single message. All the
+        requests of the batch run on the same document snapshot.
+
+        :param requests: list of (worker_class_or_function, args, on_receive,
+            priority, group) tuples, see :meth:`request`.
+        :param document: optional :class:`DocumentTracker`, the document is
+            synchronised once and its text is passed to all the workers of the
+            batch.
+        :param document_key: see :meth:`request`.
+        :param cache: see :meth:`request`.
+        :returns: The list of request ids, in the order of ``requests``.
+        """
+        request_ids = []
+        batch = {'type': 'batch', 'requests': []}
+        for worker, args, on_receive, priority, group in requests:
+            request_id = self._register_request(
+                worker, args, on_receive, priority, group, document,
+                document_key, cache)
+            request_ids.append(request_id)
+            batch['requests'].append(self._make_request(
+                request_id, worker, args, priority, group, cache))
+        if document is not None:
+            self.sync_document(document)
+            batch['document'] = {'id': document.id,
+                                 'version': document.version,
+                                 'key': document_key}
+        self.send(batch)
+        return request_ids
+
+    def _register_request(self, worker, args, on_receive, priority, group,
+                          document, document_key, cache, on_chunk=None,
+                          profile=False):
+        """
+        Registers a new request and returns its id.
+        """
+        request_id = str(uuid.uuid4())
+        if group is not None:
+            # the results of the superseded requests must not be used
+            for pending_id, pending_group in list(self._groups.items()):
+                if pending_group == group:
+                    self._pending.pop(pending_id, None)
+                    self._forget_sent(pending_id, cancelled=True)
+                    self._chunk_callbacks.pop(pending_id, None)
+                    self._document_requests.pop(pending_id, None)
+                    self._groups.pop(pending_id)
+            self._groups[request_id] = group
+        self._pending[request_id] = _callback_ref(on_receive)
+        worker_name = self._worker_name(worker)
+        self._sent_at[request_id] = (worker_name, time.monotonic())
+        self.metrics.increment(worker_name, 'calls')
+        if on_chunk is not None:
+            self._chunk_callbacks[request_id] = _callback_ref(on_chunk)
+        if document is not None:
+            self._document_requests[request_id] = (
+                worker, args, priority, group, document, document_key, cache,
+                on_chunk is not None, profile)
+        return request_id
+
+    def sync_document(self, document):
+        """
+        Sends the changes made to a document since the last synchronisation
+        (or the full text if the server does not know the document yet).
+
+        :param document: :class:`DocumentTracker`
+        """
+        known_version = self._documents.get(document.id)
+        if known_version == document.version:
+            return
+        changes = None
+        if known_version is not None:
+            changes = document.changes_since(known_version)
+        if changes is None:
+            self.send({'type': 'document', 'id': document.id,
+                       'path': document.path, 'version': document.version,
+                       'text': document.text()})
         else:
-            classname = '%s.%s' % (self._worker.__module__,
-                                   self._worker.__name__)
-        self.request_id = str(uuid.uuid4())
-        self.send({'request_id': self.request_id, 'worker': classname,
-                   'data': self._args})
+            self.send({'type': 'document', 'id': document.id,
+                       'path': document.path, 'base_version': known_version,
+                       'version': document.version, 'changes': changes})
+        self._documents[document.id] = document.version
+
+    def close_document(self, document):
+        """
+        Tells the server that a document is not used anymore.
+
+        :param document: :class:`DocumentTracker`
+        """
+        if self._documents.pop(document.id, None) is not None:
+            self.send({'type': 'document', 'id': document.id, 'close': True})
+
+    def cancel(self, request_id):
+        """
+        Cancels a pending request, its callback won't be called.
+
+        :param request_id: id of the request to cancel.
+        """
+        self._groups.pop(request_id, None)
+        self._document_requests.pop(request_id, None)
+        self._chunk_callbacks.pop(request_id, None)
+        try:
+            self._pending.pop(request_id)
+        except KeyError:
+            # results already received
+            return
+        self._forget_sent(request_id, cancelled=True)
+        self.send({'type': 'cancel', 'request_id': request_id})
+
+    def cancel_group(self, group):
+        """
+        Cancels the pending requests of a group.
+
+        :param group: the request group (see :meth:`request`).
+        """
+        for request_id, pending_group in list(self._groups.items()):
+            if pending_group == group:
+                self.cancel(request_id)
+
+    def _forget_sent(self, request_id, cancelled=False):
+        """ Forgets the send time of a request that won't be answered """
+        self._stop_deadline(request_id)
+        sent = self._sent_at.pop(request_id, None)
+        if sent is not None and cancelled:
+            self.metrics.increment(sent[0], 'cancelled')
+
+    def _start_deadline(self, request_id, timeout, on_timeout):
+        """ Starts the deadline timer of a request """
+        timer = QtCore.QTimer(self)
+        timer.setSingleShot(True)
+        timer.timeout.connect(lambda: self._on_deadline(request_id))
+        self._deadlines[request_id] = (timer, _callback_ref(on_timeout))
+        timer.start(int(timeout))
+
+    def _stop_deadline(self, request_id):
+        """
+        Stops the deadline timer of a request, if any, and returns its
+        timeout callback ref.
+        """
+        try:
+            timer, callback = self._deadlines.pop(request_id)
+        except KeyError:
+            return None
+        timer.stop()
+        timer.deleteLater()
+        return callback
+
+    def _stop_deadlines(self):
+        """ Stops all the deadline timers """
+        for request_id in list(self._deadlines):
+            self._stop_deadline(request_id)
+
+    def _on_deadline(self, request_id):
+        """
+        Cancels a request whose results have not been received in time.
+        """
+        callback = self._stop_deadline(request_id)
+        if request_id not in self._pending:
+            return
+        comm('request %s timed out', request_id)
+        self.metrics.increment(self._sent_at[request_id][0], 'timeouts')
+        self.cancel(request_id)
+        if callback and callback():
+            callback()()
+
+    def _send_request(self, request_id, worker, args,
+                      priority=PRIORITY_NORMAL, group=None, document=None,
+                      document_key='code', cache=False, stream=False,
+                      profile=False):
+        """
+        Sends the request to the backend.
+        """
+        request = self._make_request(request_id, worker, args, priority,
+                                     group, cache, stream, profile)
+        if document is not None:
+            self.sync_document(document)
+            request['document'] = {'id': document.id,
+                                   'version': document.version,
+                                   'key': document_key}
+        self.send(request)
+
+    @staticmethod
+    def _make_request(request_id, worker, args, priority=PRIORITY_NORMAL,
+                      group=None, cache=False, stream=False, profile=False):
+        """
+        Makes a request message (without the document handle).
+        """
+        request = {'request_id': request_id,
+                   'worker': _JsonClientMixin._worker_name(worker),
+                   'data': args, 'priority': priority}
+        if group is not None:
+            request['group'] = group
+        if cache:
+            request['cache'] = True
+        if stream:
+            request['stream'] = True
+        if profile:
+            request['profile'] = True
+        return request
+
+    @staticmethod
+    def _worker_name(worker):
+        """ Returns the fully qualified name of a worker """
+        if isinstance(worker, str):
+            return worker
+        return '%s.%s' % (worker.__module__, worker.__name__)
 
     def send(self, obj, encoding='utf-8'):
         """
         Sends a python object to the backend. The object **must be JSON
         serialisable**.
 
+        If the socket is not connected yet (or if the framing has not been
+        negotiated yet), the message is queued and will be sent as soon as
+        the connection is ready.
+
         :param obj: object to send
-        :param encoding: encoding used to encode the json message into a
-            bytes array, this should match CodeEdit.file.encoding.
+        :param encoding: unused, kept for backward compatibility (json
+            payloads are always utf-8 encoded).
         """
         comm('sending request: %r', obj)
-        msg = json.dumps(obj)
-        msg = msg.encode(encoding)
-        header = struct.pack('=I', len(msg))
-        self.write(header)
-        self.write(msg)
+        if self._negotiated:
+            self._write_frame(self._framing.encode(obj))
+            # any message keeps the server alive
+            self._keepalive_timer.start()
+        else:
+            self._queue.append(obj)
+
+    def _send_keepalive(self):
+        if self._negotiated and not self._closed:
+            comm('sending keepalive')
+            self._write_frame(self._framing.encode({'type': 'ping'}))
+
+    def _on_negotiated(self, reply):
+        comm('negotiated framing: %r', reply)
+        self._framing.configure(reply)
+        self._negotiated = True
+        # flush the requests made while we were connecting
+        queue = self._queue[:]
+        self._queue[:] = []
+        for obj in queue:
+            self._write_frame(self._framing.encode(obj))
+        self._keepalive_timer.start()
+
+    def _on_response(self, obj):
+        """
+        Routes a response to the callback of the corresponding request.
+        """
+        if isinstance(obj, dict) and 'chunk' in obj:
+            self._on_chunk(obj)
+            return
+        try:
+            request_id = obj['request_id']
+            results = obj['results']
+        except (KeyError, TypeError):
+            _logger().warning('invalid response: %r', obj)
+            return
+        if 'resync' in obj and request_id in self._document_requests:
+            # the server lost track of the document, send the full text and
+            # the request again.
+            self._documents.pop(obj['resync'], None)
+            self._send_request(request_id,
+                               *self._document_requests.pop(request_id))
+            return
+        self._groups.pop(request_id, None)
+        self._document_requests.pop(request_id, None)
+        self._chunk_callbacks.pop(request_id, None)
+        try:
+            callback = self._pending.pop(request_id)
+        except KeyError:
+            # request cancelled or unknown request
+            comm('dropping response of unknown request %s', request_id)
+            return
+        self._stop_deadline(request_id)
+        worker, sent_at = self._sent_at.pop(request_id)
+        round_trip = time.monotonic() - sent_at
+        self.metrics.observe(worker, 'round_trip', round_trip)
+        self.metrics.increment(worker, 'response_bytes',
+                               self._reader.last_size)
+        # possible callback
+        if obj.get('cancelled', False):
+            comm('request %s has been cancelled', request_id)
+        elif callback and callback():
+            callback()(results)
+        self.finished.emit(request_id)
+        self.request_completed.emit(worker, round_trip)
+
+    def _on_chunk(self, obj):
+        """
+        Routes a chunk of streamed items to the chunk callback of the
+        corresponding request.
+        """
+        callback = self._chunk_callbacks.get(obj.get('request_id'))
+        if callback is None:
+            # request cancelled or superseded
+            return
+        deadline = self._deadlines.get(obj['request_id'])
+        if deadline is not None:
+            # the backend is making progress
+            deadline[0].start()
+        self.metrics.increment(self._sent_at[obj['request_id']][0],
+                               'response_bytes', self._reader.last_size)
+        if callback():
+            callback()(obj['chunk'])
+
+    def _write_frame(self, frame):
+        """ Writes a frame on the transport """
+        self._bytes_sent += len(frame)
+        self.write(frame)
+
+    def _connect_when_ready(self, process):
+        """
+        Connects as soon as the backend process reports that it is ready to
+        accept connections (see :attr:`BackendProcess.server_started`)
+        instead of polling the server. Falls back to polling if the
+        readiness message does not come (e.g. custom server that does not
+        print it).
+        """
+        if getattr(process, 'server_ready', True):
+            self._connect()
+        else:
+            process.server_started.connect(self._connect)
+            QtCore.QTimer.singleShot(self.READY_TIMEOUT, self._connect)
+
+    def _start_negotiation(self):
+        """ Sends the hello message, once the transport is connected """
+        self.is_connected = True
+        # the queued requests will be sent once the server has answered
+        self._write_frame(self._framing.encode(self._framing.hello(
+            self.ENCODINGS, self.COMPRESSION)))
+
+    def _on_transport_closed(self):
+        """ Called when the transport has been closed by the backend """
+        try:
+            was_connected = self.is_connected
+            self.is_connected = False
+            self._keepalive_timer.stop()
+            if was_connected:
+                # the backend went away, the pending requests will never
+                # be answered.
+                self._closed = True
+                self._pending.clear()
+                self._sent_at.clear()
+                self._stop_deadlines()
+                self._chunk_callbacks.clear()
+                self._groups.clear()
+                self._document_requests.clear()
+        except AttributeError:
+            pass
+
+    def _on_data_received(self, data):
+        """ Decodes the received frames """
+        self._bytes_received += len(data)
+        self._reader.feed(data)
+        for obj in self._reader:
+            if isinstance(obj, dict) and obj.get('type') == 'hello':
+                self._on_negotiated(obj)
+            else:
+                comm('response received: %r', obj)
+                self._on_response(obj)
+
+
+class JsonTcpClient(_JsonClientMixin, QtNetwork.QTcpSocket):
+    """
+    A json tcp client socket used to communicate with the pyqode backend.
+
+    See :class:`_JsonClientMixin` for a description of the protocol. The
+    server must be started with the ``tcp`` transport (default).
+
+    The client connects as soon as the backend process reports that it is
+    listening (see :attr:`BackendProcess.server_started`) and falls back to
+    retrying every 100ms if the readiness message does not come.
+    """
+    #: Signal emitted when the results of a request have been received. The
+    #: parameter is the request id.
+    finished = QtCore.Signal(str)
+    #: Signal emitted when the results of a request have been received, with
+    #: the worker name and the round trip time (in seconds). See
+    #: :attr:`metrics`.
+    request_completed = QtCore.Signal(str, float)
+
+    def __init__(self, parent, port):
+        super(JsonTcpClient, self).__init__(parent)
+        self._port = port
+        self._setup_client()
+        self.connected.connect(self._on_connected)
+        self.errorOccurred.connect(self._on_error)
+        self.disconnected.connect(self._on_disconnected)
+        self.readyRead.connect(self._on_ready_read)
+        self._connect_when_ready(parent)
+
+    def close(self):
+        self._close_client()
+        super(JsonTcpClient, self).close()
 
     @staticmethod
     def pick_free_port():
@@ -247,7 +872,8 @@ class JsonTcpClient(QtNetwork.QTcpSocket):
 
     def _connect(self):
         """ Connects our client socket to the backend socket """
-        if self is None:
+        if self is None or self._closed or self.is_connected or \
+                self.state() != QtNetwork.QAbstractSocket.UnconnectedState:
             return
         comm('connecting to 127.0.0.1:%d', self._port)
         address = QtNetwork.QHostAddress('127.0.0.1')
@@ -257,10 +883,10 @@ class JsonTcpClient(QtNetwork.QTcpSocket):
 
     def _on_connected(self):
         comm('connected to backend: %s:%d', self.peerName(), self.peerPort())
-        self.is_connected = True
-        self._send_request()
+        self._start_negotiation()
 
     def _on_error(self, error):
+        error = int(getattr(error, 'value', error))
         if error not in SOCKET_ERROR_STRINGS:  # pragma: no cover
             error = -1
         if error == 1 and self.is_connected or (
@@ -282,62 +908,146 @@ class JsonTcpClient(QtNetwork.QTcpSocket):
             # logger might be None if for some reason qt deletes the socket
             # after python global exit
             pass
+        self._on_transport_closed()
+
+    def _on_ready_read(self):
+        """ Read bytes when ready read """
+        self._on_data_received(bytes(self.readAll()))
+
+
+class JsonLocalClient(_JsonClientMixin, QtNetwork.QLocalSocket):
+    """
+    A json client that connects to the backend through a unix domain socket
+    (server started with the ``unix`` transport).
+
+    Local sockets avoid the TCP overhead and the port allocation race of
+    the tcp transport. The client connects as soon as the backend process
+    reports that it is listening (see :attr:`BackendProcess.server_started`)
+    and falls back to retrying every 100ms if the readiness message does not
+    come.
+    """
+    #: Signal emitted when the results of a request have been received. The
+    #: parameter is the request id.
+    finished = QtCore.Signal(str)
+    #: Signal emitted when the results of a request have been received, with
+    #: the worker name and the round trip time (in seconds). See
+    #: :attr:`metrics`.
+    request_completed = QtCore.Signal(str, float)
+
+    def __init__(self, parent, path):
+        super(JsonLocalClient, self).__init__(parent)
+        self._path = path
+        self._connecting = False
+        self._setup_client()
+        self.connected.connect(self._on_connected)
+        self.errorOccurred.connect(self._on_error)
+        self.disconnected.connect(self._on_disconnected)
+        self.readyRead.connect(self._on_ready_read)
+        self._connect_when_ready(parent)
+
+    def close(self):
+        # a failed connection attempt closes the socket, the client must
+        # stay usable to retry.
+        if not self._connecting:
+            self._close_client()
+        super(JsonLocalClient, self).close()
+
+    def _connect(self):
+        """ Connects to the backend socket """
+        if self is None or self._closed or self.is_connected or \
+                self.state() != QtNetwork.QLocalSocket.UnconnectedState:
+            return
+        comm('connecting to %s', self._path)
+        # the server name is reset after a failed attempt
+        self.setServerName(self._path)
+        self._connecting = True
         try:
-            self.is_connected = False
-        except AttributeError:
-            pass
+            self.connectToServer()
+        finally:
+            self._connecting = False
 
-    def _read_header(self):
-        comm('reading header')
-        self._header_buf += self.read(4)
-        if len(self._header_buf) == 4:
-            self._header_complete = True
-            try:
-                header = struct.unpack('=I', self._header_buf)
-            except TypeError:
-                # pyside
-                header = struct.unpack('=I', self._header_buf.data())
-            self._to_read = header[0]
-            self._header_buf = bytes()
-            comm('header content: %d', self._to_read)
-
-    def _read_payload(self):
-        """ Reads the payload (=data) """
-        comm('reading payload data')
-        comm('remaining bytes to read: %d', self._to_read)
-        data_read = self.read(self._to_read)
-        nb_bytes_read = len(data_read)
-        comm('%d bytes read', nb_bytes_read)
-        self._data_buf += data_read
-        self._to_read -= nb_bytes_read
-        if self._to_read <= 0:
-            try:
-                data = self._data_buf.decode('utf-8')
-            except AttributeError:
-                data = bytes(self._data_buf.data()).decode('utf-8')
-            comm('payload read: %r', data)
-            comm('payload length: %r', len(self._data_buf))
-            comm('decoding payload as json object')
-            obj = json.loads(data)
-            comm('response received: %r', obj)
-            try:
-                results = obj['results']
-            except (KeyError, TypeError):
-                results = None
-            # possible callback
-            if self._callback and self._callback():
-                self._callback()(results)
-            self._header_complete = False
-            self._data_buf = bytes()
-            self.finished.emit(self)
+    def _on_connected(self):
+        comm('connected to backend: %s', self._path)
+        self._start_negotiation()
+
+    def _on_error(self, error):
+        error = int(getattr(error, 'value', error))
+        if not self.is_connected and not self._closed and error in (
+                int(QtNetwork.QLocalSocket.ConnectionRefusedError.value),
+                int(QtNetwork.QLocalSocket.ServerNotFoundError.value)):
+            # the server is not listening yet
+            comm('backend not ready: %s', self.errorString())
+            QtCore.QTimer.singleShot(100, self._connect)
+        elif error == int(
+                QtNetwork.QLocalSocket.PeerClosedError.value) or \
+                self._closed:
+            comm(self.errorString())
+        else:
+            _logger().warning(self.errorString())
+
+    def _on_disconnected(self):
+        comm('disconnected from backend: %s', self._path)
+        self._on_transport_closed()
 
     def _on_ready_read(self):
         """ Read bytes when ready read """
-        while self.bytesAvailable():
-            if not self._header_complete:
-                self._read_header()
-            else:
-                self._read_payload()
+        self._on_data_received(bytes(self.readAll()))
+
+
+class JsonPipeClient(_JsonClientMixin, QtCore.QObject):
+    """
+    A json client that talks to the backend through the standard input and
+    output of the backend process (server started with the ``stdio``
+    transport).
+
+    There is no connection to establish: the frames are written to the
+    process stdin as soon as they are sent (the OS buffers them until the
+    server reads them).
+
+    .. note:: The standard output of the backend process is the data channel,
+        the server redirects its output (e.g. print statements) to stderr.
+    """
+    #: Signal emitted when the results of a request have been received. The
+    #: parameter is the request id.
+    finished = QtCore.Signal(str)
+    #: Signal emitted when the results of a request have been received, with
+    #: the worker name and the round trip time (in seconds). See
+    #: :attr:`metrics`.
+    request_completed = QtCore.Signal(str, float)
+
+    def __init__(self, process):
+        super(JsonPipeClient, self).__init__(process)
+        self._process = process
+        self._setup_client()
+        process.data_channel = True
+        process.readyReadStandardOutput.connect(self._on_ready_read)
+        process.finished.connect(self._on_finished)
+        if process.state() == BackendProcess.Running:
+            self._start_negotiation()
+        else:
+            process.started.connect(self._start_negotiation)
+
+    def close(self):
+        if not self._closed:
+            self._close_client()
+            # the server exits once its stdin has been closed
+            if self._process.state() != BackendProcess.NotRunning:
+                self._process.closeWriteChannel()
+
+    def _write_frame(self, frame):
+        if self._process.state() != BackendProcess.NotRunning:
+            self._bytes_sent += len(frame)
+            self._process.write(frame)
+
+    def _on_finished(self, *args):
+        comm('backend process finished, closing pipe client')
+        self._on_transport_closed()
+
+    def _on_ready_read(self):
+        """ Read bytes when ready read """
+        if self._closed:
+            return
+        self._on_data_received(bytes(self._process.readAllStandardOutput()))
 
 
 class BackendProcess(QtCore.QProcess):
@@ -346,6 +1056,10 @@ class BackendProcess(QtCore.QProcess):
 
     Also logs everything that is written to the process' stdout/stderr.
     """
+    #: Signal emitted when the server reports that it is ready to accept
+    #: connections.
+    server_started = QtCore.Signal()
+
     def __init__(self, parent):
         super(BackendProcess, self).__init__(parent)
         self.started.connect(self._on_process_started)
@@ -358,6 +1072,19 @@ class BackendProcess(QtCore.QProcess):
         self._srv_logger = logging.getLogger('pyqode.backend')
         self._prevent_logs = False
         self._encoding = locale.getpreferredencoding()
+        #: True if stdout is used as the data channel of the client (stdio
+        #: transport), stdout is then left to the client.
+        self.data_channel = False
+        self._server_started = False
+        self._stdout_tail = ''
+
+    @property
+    def server_ready(self):
+        """
+        True once the server has reported that it is ready to accept
+        connections (see :attr:`server_started`).
+        """
+        return self._server_started
 
     def _on_process_started(self):
         """ Logs process started """
@@ -386,15 +1113,25 @@ class BackendProcess(QtCore.QProcess):
 
     def _on_process_stdout_ready(self):
         """ Logs process output """
-        if not self:
+        if not self or self.data_channel:
             return
         o = self.readAllStandardOutput()
         try:
             output = bytes(o).decode(self._encoding)
         except TypeError:
             output = bytes(o.data()).decode(self._encoding)
-        for line in output.splitlines():
-            self._srv_logger.log(1, line)
+        # a line might be split across two reads
+        lines = (self._stdout_tail + output).split('\n')
+        self._stdout_tail = lines.pop()
+        for line in lines:
+            self._on_stdout_line(line.rstrip('\r'))
+
+    def _on_stdout_line(self, line):
+        """ Handles a line written by the backend on its stdout """
+        self._srv_logger.log(1, line)
+        if not self._server_started and line.startswith('started on'):
+            self._server_started = True
+            self.server_started.emit()
 
     def _on_process_stderr_ready(self):
         """ Logs process output (stderr) """
@@ -414,3 +1151,187 @@ class BackendProcess(QtCore.QProcess):
         """ Terminate the process """
         self.running = False
         super(BackendProcess, self).terminate()
+
+
+class BackendZygote(BackendProcess):
+    """
+    A backend process started with the ``--zygote`` option: it loads the
+    server script and the workers once, then forks a new server each time
+    :meth:`fork` is called (see :mod:`pyqode.core.backend.zygote`).
+
+    .. note:: POSIX only.
+    """
+    def __init__(self, parent=None):
+        super(BackendZygote, self).__init__(parent)
+        #: forked processes: address -> ForkedBackendProcess
+        self._forked = {}
+
+    @property
+    def forked(self):
+        """ The forked servers that are still running. """
+        return list(self._forked.values())
+
+    def fork(self, address, transport='tcp', parent=None):
+        """
+        Asks the zygote to fork a new server.
+
+        :param address: tcp port or unix socket path of the new server.
+        :param transport: ``'tcp'`` or ``'unix'``, the forked servers can't
+            use the stdio transport.
+        :param parent: parent of the returned process object.
+        :returns: the :class:`ForkedBackendProcess` of the new server.
+        :raises: ValueError if the transport is not supported.
+        """
+        if transport not in ('tcp', 'unix'):
+            raise ValueError(
+                'cannot fork a server with the %s transport' % transport)
+        process = ForkedBackendProcess(self, address, parent)
+        self._forked[str(address)] = process
+        comm('forking backend %s', address)
+        self.write(('%s\n' % json.dumps(
+            {'port': address, 'transport': transport})).encode('utf-8'))
+        return process
+
+    def _on_stdout_line(self, line):
+        if line.startswith('forked '):
+            _, pid, address = line.split(' ', 2)
+            process = self._forked.get(address)
+            if process is not None:
+                process._on_forked(int(pid))
+        elif line.startswith('failed '):
+            process = self._forked.pop(line.split(' ', 1)[1], None)
+            if process is not None:
+                process._on_exited(-1, error=True)
+        elif line.startswith('exited '):
+            _, pid, code = line.split(' ')
+            for address, process in list(self._forked.items()):
+                if process.processId() == int(pid):
+                    self._forked.pop(address)
+                    process._on_exited(int(code))
+        elif line.startswith('started on '):
+            # "127.0.0.1:<port>" or "unix:<path>", servers that do not
+            # listen on an address (stdio) are not forked by the zygote
+            _, _, address = line[len('started on '):].partition(':')
+            process = self._forked.get(address)
+            if process is not None:
+                process._on_server_started()
+            self._srv_logger.log(1, line)
+        else:
+            super(BackendZygote, self)._on_stdout_line(line)
+
+    def _on_process_finished(self, exit_code):
+        super(BackendZygote, self)._on_process_finished(exit_code)
+        # the exit of the servers that are still running can't be reported
+        # anymore, their state is polled.
+        for process in self._forked.values():
+            process._zygote = None
+        self._forked.clear()
+
+
+class ForkedBackendProcess(QtCore.QObject):
+    """
+    Handle of a server process forked by a :class:`BackendZygote`, it
+    exposes the subset of the :class:`BackendProcess` API used to manage the
+    backend (state, exit code, terminate, kill, readiness).
+
+    The standard output of the forked server is the one of the zygote.
+    """
+    #: Signal emitted when the server process has been forked.
+    started = QtCore.Signal()
+    #: Signal emitted when the server process exits, with its exit code.
+    finished = QtCore.Signal(int)
+    #: Signal emitted if the server process could not be forked.
+    errorOccurred = QtCore.Signal(int)
+    #: Signal emitted when the server reports that it is ready to accept
+    #: connections.
+    server_started = QtCore.Signal()
+
+    def __init__(self, zygote, address, parent=None):
+        super(ForkedBackendProcess, self).__init__(parent)
+        self._zygote = zygote
+        self.address = address
+        self._pid = None
+        self._exit_code = None
+        self._server_started = False
+        self._pending_signal = None
+        self._prevent_logs = False
+        self.data_channel = False
+
+    @property
+    def server_ready(self):
+        """ See :attr:`BackendProcess.server_ready` """
+        return self._server_started
+
+    def processId(self):
+        """ Returns the pid of the server process, 0 if not forked yet """
+        return self._pid or 0
+
+    def state(self):
+        """ Returns the state of the server process (QProcess.ProcessState) """
+        if self._exit_code is not None:
+            return QtCore.QProcess.NotRunning
+        if self._pid is None:
+            return QtCore.QProcess.Starting
+        if self._zygote is None:
+            # the zygote is gone, poll the process
+            try:
+                os.kill(self._pid, 0)
+            except OSError:
+                self._exit_code = 0
+                return QtCore.QProcess.NotRunning
+        return QtCore.QProcess.Running
+
+    def exitCode(self):
+        """ Returns the exit code of the server process """
+        return self._exit_code or 0
+
+    def waitForFinished(self, msecs=30000):
+        """
+        Waits until the server process has exited or ``msecs`` elapsed.
+        """
+        if self.state() != QtCore.QProcess.NotRunning and \
+                self._zygote is not None:
+            self._zygote.waitForReadyRead(msecs)
+            self._zygote._on_process_stdout_ready()
+        return self.state() == QtCore.QProcess.NotRunning
+
+    def terminate(self):
+        """ Terminates the server process (SIGTERM) """
+        self._send_signal(signal.SIGTERM)
+
+    def kill(self):
+        """ Kills the server process (SIGKILL) """
+        self._send_signal(signal.SIGKILL)
+
+    def _send_signal(self, signum):
+        if self._exit_code is not None:
+            return
+        if self._pid is None:
+            # not forked yet
+            self._pending_signal = signum
+            return
+        try:
+            os.kill(self._pid, signum)
+        except OSError:
+            pass
+
+    def _on_forked(self, pid):
+        comm('backend forked: pid=%d', pid)
+        self._pid = pid
+        self.started.emit()
+        if self._pending_signal is not None:
+            self._send_signal(self._pending_signal)
+
+    def _on_server_started(self):
+        if not self._server_started:
+            self._server_started = True
+            self.server_started.emit()
+
+    def _on_exited(self, exit_code, error=False):
+        comm('forked backend %s exited with code %d', self.address,
+             exit_code)
+        self._exit_code = exit_code
+        if error:
+            # QProcess.FailedToStart
+            self.errorOccurred.emit(0)
+        self.finished.emit(exit_code)
@@ -9,7 +9,15 @@ analysis (lint), code completion,...
 Protocol
 --------
 
-We use a worker based json messaging server using the TCP/IP transport.
+We use a worker based json messaging server using the TCP/IP transport by
+default. The server can also listen on a unix domain socket or talk to its
+client through its standard input/output (see the ``--transport`` option of
+:func:`pyqode.core.backend.default_parser` and
+:meth:`pyqode.core.managers.BackendManager.start`). Each client connection is
+served by its own thread, or all of them are served by one asyncio event loop
+with the ``--server asyncio`` option (see
+:class:`pyqode.core.backend.async_server.AsyncJsonServer`, which is only
+imported when that option is used).
 
 We build our own, very simple protocol where each message is made up of two
 parts:
@@ -17,6 +25,19 @@ parts:
   - a header: simply contains the length of the payload
   - a payload: a json formatted string, the content of the message.
 
+Right after connecting, the client sends a 'hello' message to negotiate a
+more compact framing: the header then also contains a flags byte, payloads
+may be serialised with marshal (when the client and the server run the same
+python version, on the unix and stdio transports only) and the large
+payloads are compressed with zlib (see :mod:`pyqode.core.backend.protocol`).
+Clients that don't send a hello message keep using the json framing.
+
+A client opens one single, long-lived connection to the server and sends all
+its requests through it. Requests are pipelined (the client does not wait for
+the results of a request before sending the next one) and the responses might
+come back in any order, they are routed to the right callback using the
+request id.
+
 There are two type of json object: a request and a response.
 
 Request
@@ -27,13 +48,29 @@ For a request, the object will contains the following fields:
   - 'worker': fully qualified name to the worker callable (class or function),
     e.g. 'pyqode.core.backend.workers.echo_worker'
   - 'data': data specific to the chose worker.
+  - 'priority': optional request priority (PRIORITY_INTERACTIVE,
+    PRIORITY_NORMAL or PRIORITY_BACKGROUND), queued requests with a higher
+    priority are run first.
+  - 'group': optional group name, a new request cancels the queued and
+    running requests of the same group (e.g. the previous completion request
+    of an editor).
+  - 'document': optional document handle, used instead of embedding the
+    document text in the request data: {'id': document id, 'version':
+    document version, 'key': name of the data key that will receive the
+    document text}.
+  - 'cache': optional, true to accept the cached results of an identical
+    request when the server runs with a result cache (see the
+    ``--result-cache`` option of :func:`pyqode.core.backend.default_parser`).
+  - 'profile': optional, true to run the worker under the profiler (see
+    :mod:`pyqode.core.backend.profiler`).
 
 E.g::
 
     {
         'request_id': 'a97285af-cc88-48a4-ac69-7459b9c7fa66',
         'worker': 'pyqode.core.backend.workers.echo_worker',
-        'data': ['some code', 0]
+        'data': ['some code', 0],
+        'priority': 1
     }
 
 Response
@@ -50,6 +87,93 @@ E.g::
         'results': ['some code', 0]
     }
 
+If a request has a 'stream' field (set to true) and its worker is a
+generator, the items produced by the worker are sent by chunks, as soon as
+they are available, before the final response (whose results are then
+empty)::
+
+    {
+        'request_id': 'a97285af-cc88-48a4-ac69-7459b9c7fa66',
+        'chunk': [[0, 5], [12, 17]]
+    }
+
+The response of a cancelled request also contains a 'cancelled' field (set
+to True), its results must be ignored.
+
+If the server does not have the document version referred by a request, it
+responds with a 'resync' field (the document id): the client must send the
+full document text and then send the request again.
+
+Document
+++++++++
+
+To avoid sending the full text of a document with each request, the client
+sends the text of a document once and then sends the changes made to it::
+
+    # full text
+    {
+        'type': 'document',
+        'id': '0b3c6e1c-a3ab-4a43-9b33-5a3fe9b8a8a4',
+        'path': '/path/to/file.py',
+        'version': 1,
+        'text': 'some code'
+    }
+
+    # changes: list of [position, chars removed, text added]
+    {
+        'type': 'document',
+        'id': '0b3c6e1c-a3ab-4a43-9b33-5a3fe9b8a8a4',
+        'base_version': 1,
+        'version': 2,
+        'changes': [[5, 4, 'text']]
+    }
+
+    # document closed
+    {
+        'type': 'document',
+        'id': '0b3c6e1c-a3ab-4a43-9b33-5a3fe9b8a8a4',
+        'close': true
+    }
+
+Batch
++++++
+
+Several requests can be sent in one single message. The requests of a batch
+share the same document handle: the document snapshot is resolved once and
+its text is passed to all the workers. Each request is answered with its own
+response::
+
+    {
+        'type': 'batch',
+        'document': {'id': '0b3c6e1c-a3ab-4a43-9b33-5a3fe9b8a8a4',
+                     'version': 2, 'key': 'code'},
+        'requests': [
+            {'request_id': '...', 'worker': '...', 'data': {...}},
+            {'request_id': '...', 'worker': '...', 'data': {...}}
+        ]
+    }
+
+Cancel
+++++++
+
+A client can cancel a request by sending the following object::
+
+    {
+        'type': 'cancel',
+        'request_id': 'a97285af-cc88-48a4-ac69-7459b9c7fa66'
+    }
+
+Keepalive
++++++++++
+
+The server shuts itself down if it does not receive any message during
+60 seconds. When the client has nothing to send, it sends a keepalive
+message (no response is sent back)::
+
+    {
+        'type': 'ping'
+    }
+
 Server script
 -------------
 
@@ -73,9 +197,9 @@ Here is the most simple and basic example of a server script:
         backend.serve_forever()
 
 .. warning:: The user can choose the python interpreter that will run the
-    server. That means that classes and functions that run on the server side (
-    workers) **should fully support python2 syntax** and that pyqode.core
-    should be installed on the target interpreter sys path!!! (even for a
+    server. That means that this interpreter, which runs the classes and
+    functions of the server side (workers), **must be python 3** and that
+    pyqode.core should be installed on the target interpreter sys path!!! (even for a
     virtual env). An alternative is to keep pyqode.core package (and all
     dependencies in a zip archive that you mount on the sys path in your
     server script.
@@ -88,9 +212,19 @@ Here is the most simple and basic example of a server script:
 from .server import JsonServer
 from .server import default_parser
 from .server import serve_forever
+from .server import PRIORITY_BACKGROUND
+from .server import PRIORITY_INTERACTIVE
+from .server import PRIORITY_NORMAL
+from .metrics import stats_worker
+from .profiler import profile_worker
+from .registry import WorkerRegistry
+from .registry import worker_registry
 from .workers import CodeCompletionWorker
 from .workers import DocumentWordsProvider
+from .workers import current_document
+from .workers import document_artifact
 from .workers import echo_worker
+from .workers import is_cancelled
 
 
 class NotConnected(Exception):
@@ -122,9 +256,19 @@ __all__ = [
     'JsonServer',
     'default_parser',
     'serve_forever',
+    'is_cancelled',
+    'PRIORITY_BACKGROUND',
+    'PRIORITY_INTERACTIVE',
+    'PRIORITY_NORMAL',
     'CodeCompletionWorker',
     'DocumentWordsProvider',
     'echo_worker',
+    'stats_worker',
+    'profile_worker',
+    'current_document',
+    'document_artifact',
+    'WorkerRegistry',
+    'worker_registry',
     'NotConnected',
     'NotRunning'
 ]
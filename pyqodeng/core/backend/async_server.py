@@ -0,0 +1,219 @@
+# -*- coding: utf-8 -*-
+"""
+This module contains an asyncio implementation of the json server.
+
+:class:`AsyncJsonServer` speaks the same protocol as
+:class:`pyqode.core.backend.JsonServer` and runs the requests with the same
+engine (request queue, worker slots, documents, result cache), but all the
+client connections are served by one single event loop instead of one
+thread per connection: a server shared by many editors (see
+:class:`pyqode.core.managers.BackendPool`) does not need a thread per
+client, and the heartbeat is a timer of the event loop.
+
+The workers are not coroutines: they still run in the worker slot threads
+(or in the process pool, see the ``--executor`` option), the event loop only
+decodes the messages and writes the responses.
+
+Use the ``--server asyncio`` option of
+:func:`pyqode.core.backend.default_parser` to select it.
+"""
+import asyncio
+import logging
+import os
+import socket
+import threading
+
+from pyqodeng.core.backend.server import ClientConnection
+from pyqodeng.core.backend.server import RequestEngine
+from pyqodeng.core.backend.server import _redirect_stdout
+from pyqodeng.core.backend.server import _remove_stale_socket
+from pyqodeng.core.backend.server import default_parser
+
+
+def _logger():
+    """ Returns the module's logger """
+    return logging.getLogger(__name__)
+
+
+class _AsyncConnection(ClientConnection, asyncio.Protocol):
+    """
+    A client connection served by the event loop.
+
+    The frames are written by the event loop thread: the responses sent by
+    the worker slots are scheduled with ``call_soon_threadsafe``, in the
+    order they have been encoded.
+    """
+    def __init__(self, srv, write_transport=None):
+        self.srv = srv
+        self._transport = None
+        self._write_transport = write_transport
+        self.setup_connection()
+
+    def connection_made(self, transport):
+        self._transport = transport
+        if self._write_transport is None:
+            self._write_transport = transport
+        self.srv._connections.add(self)
+
+    def data_received(self, data):
+        self._reader.feed(data)
+        # the framing may change after each message (hello), the frames
+        # are decoded one at a time
+        for obj in self._reader:
+            self.dispatch(obj)
+
+    def connection_lost(self, exc):
+        _logger().log(1, 'client disconnected')
+        self.srv._connections.discard(self)
+        self.srv.cancel_all(self)
+        if self.srv.transport == 'stdio':
+            # one single client, served until stdin is closed
+            self.srv.shutdown()
+
+    def write(self, frame):
+        try:
+            self.srv.loop.call_soon_threadsafe(self._write_frame, frame)
+        except RuntimeError:
+            # the event loop has been closed, the client is gone
+            pass
+
+    def _write_frame(self, frame):
+        if not self._write_transport.is_closing():
+            self._write_transport.write(frame)
+
+    def close(self):
+        """ Closes the connection transports. """
+        for transport in (self._transport, self._write_transport):
+            if transport is not None:
+                transport.close()
+
+
+class AsyncJsonServer(RequestEngine):
+    """
+    Json server based on an asyncio event loop.
+
+    The server is configured by the same command line args as
+    :class:`pyqode.core.backend.JsonServer` and has the same interface:
+    :meth:`serve_forever`, :meth:`shutdown` (which may be called from any
+    thread) and :meth:`server_close`.
+
+    .. note:: The stdio transport is not supported on Windows (the standard
+        input can't be read by the event loop), use the threaded server.
+    """
+    def __init__(self, args=None):
+        """
+        :param args: Argument parser args. If None, the server will setup and
+            use its own argument parser (using
+            :meth:`pyqode.core.backend.default_parser`)
+        """
+        if not args:
+            args = default_parser().parse_args()
+        self.setup_engine(args)
+        #: the event loop that serves the client connections
+        self.loop = asyncio.new_event_loop()
+        self._connections = set()
+        self._server = None
+        self._heartbeat_handle = None
+        self._loop_thread = None
+        self._serving = threading.Event()
+        self._done = threading.Event()
+        if self.transport == 'stdio':
+            read_fd, write_fd = _redirect_stdout()
+            self._connect_pipes(read_fd, write_fd)
+            print('started on stdio')
+        elif self.transport == 'unix':
+            _remove_stale_socket(args.port)
+            self._server = self.loop.run_until_complete(
+                self.loop.create_unix_server(self._create_connection,
+                                             args.port))
+            # only the current user may connect (marshal framing)
+            os.chmod(args.port, 0o600)
+            print('started on unix:%s' % args.port)
+        else:
+            sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            sock.bind(('127.0.0.1', int(args.port)))
+            self._server = self.loop.run_until_complete(
+                self.loop.create_server(self._create_connection, sock=sock))
+            print('started on 127.0.0.1:%d' % int(args.port))
+        self.start_engine(heartbeat=False)
+
+    def _create_connection(self):
+        return _AsyncConnection(self)
+
+    def _connect_pipes(self, read_fd, write_fd):
+        """ Serves the client through a pair of pipes (stdio transport) """
+        write_transport, _ = self.loop.run_until_complete(
+            self.loop.connect_write_pipe(asyncio.BaseProtocol,
+                                         os.fdopen(write_fd, 'wb', 0)))
+        self.loop.run_until_complete(self.loop.connect_read_pipe(
+            lambda: _AsyncConnection(self, write_transport),
+            os.fdopen(read_fd, 'rb', 0)))
+
+    def serve_forever(self):
+        """
+        Runs the event loop until :meth:`shutdown` is called.
+        """
+        self._loop_thread = threading.current_thread()
+        self._heartbeat_handle = self.loop.call_soon(self._check_heartbeat)
+        self._serving.set()
+        try:
+            self.loop.run_forever()
+        finally:
+            self._serving.clear()
+            self._done.set()
+
+    def _check_heartbeat(self):
+        """
+        Shuts the server down if no message has been received during
+        ``timeout`` seconds, reschedules itself otherwise.
+        """
+        remaining = self.heartbeat_remaining()
+        if remaining <= 0:
+            self.shutdown()
+        else:
+            self._heartbeat_handle = self.loop.call_later(
+                remaining, self._check_heartbeat)
+
+    def shutdown(self):
+        """
+        Stops the event loop. Blocks until :meth:`serve_forever` returns when
+        called from another thread.
+        """
+        self._stopped.set()
+        if self.loop.is_closed():
+            return
+        if threading.current_thread() is self._loop_thread:
+            self.loop.stop()
+            return
+        try:
+            self.loop.call_soon_threadsafe(self.loop.stop)
+        except RuntimeError:
+            # closed in the meantime
+            return
+        if self._serving.is_set():
+            self._done.wait()
+
+    def server_close(self):
+        """
+        Closes the listening socket and the client connections and releases
+        the workers.
+        """
+        if not self.loop.is_closed():
+            if self._heartbeat_handle is not None:
+                self._heartbeat_handle.cancel()
+            if self._server is not None:
+                self._server.close()
+            for connection in list(self._connections):
+                connection.close()
+            if not self.loop.is_running():
+                if self._server is not None:
+                    self.loop.run_until_complete(self._server.wait_closed())
+                # lets the transports call connection_lost
+                self.loop.run_until_complete(asyncio.sleep(0))
+                self.loop.close()
+        if self.transport == 'unix':
+            try:
+                os.remove(self.port)
+            except OSError:
+                pass
+        self.close_engine()
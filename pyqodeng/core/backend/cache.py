@@ -0,0 +1,104 @@
+# -*- coding: utf-8 -*-
+"""
+This module contains the result cache of the server.
+
+The checkers and the outline are requested again each time the editor asks
+for them (e.g. when the editor gets the focus back or when an edit is undone),
+most of the time for a document that has already been analysed. When the
+cache is enabled (see the ``--result-cache`` option of
+:func:`pyqode.core.backend.default_parser`), the results of the requests that
+opt in (``'cache': true``) are memoized: a request with the same worker, the
+same document content and the same arguments is answered without running the
+worker again.
+"""
+import collections
+import hashlib
+import json
+import threading
+
+
+class ResultCache(object):
+    """
+    Thread safe LRU cache of worker results.
+
+    The entries are keyed by a hash of the worker name, of the request data
+    (which contains the document text) and of the document path. The least
+    recently used entries are evicted when the estimated size of the cached
+    results exceeds ``max_size``.
+    """
+    def __init__(self, max_size=32 * 1024 * 1024):
+        #: Maximum size (in bytes) of the cached results.
+        self.max_size = max_size
+        self._lock = threading.Lock()
+        self._entries = collections.OrderedDict()
+        self._size = 0
+        #: number of lookups that returned cached results
+        self.hits = 0
+        #: number of lookups that did not find any results
+        self.misses = 0
+
+    def __len__(self):
+        with self._lock:
+            return len(self._entries)
+
+    def __contains__(self, key):
+        with self._lock:
+            return key in self._entries
+
+    @property
+    def size(self):
+        """ Estimated size (in bytes) of the cached results. """
+        return self._size
+
+    @staticmethod
+    def key(worker, data, path=None):
+        """
+        Computes the cache key of a request.
+
+        :param worker: fully qualified name of the worker.
+        :param data: request data (with the document text).
+        :param path: path of the document, if any.
+        """
+        payload = json.dumps([worker, path, data], sort_keys=True,
+                             default=repr)
+        return hashlib.sha1(payload.encode('utf-8', 'surrogatepass')).digest()
+
+    def get(self, key):
+        """
+        Returns the cached results of a request.
+
+        :returns: a tuple (found, results).
+        """
+        with self._lock:
+            try:
+                results, _ = self._entries[key]
+            except KeyError:
+                self.misses += 1
+                return False, None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return True, results
+
+    def put(self, key, results):
+        """
+        Caches the results of a request. Results larger than the cache are
+        not cached.
+        """
+        size = len(key) + len(json.dumps(results, default=repr))
+        if size > self.max_size:
+            return
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self._size -= previous[1]
+            self._entries[key] = (results, size)
+            self._size += size
+            while self._size > self.max_size:
+                _, (_, evicted_size) = self._entries.popitem(last=False)
+                self._size -= evicted_size
+
+    def clear(self):
+        """ Removes all the entries. """
+        with self._lock:
+            self._entries.clear()
+            self._size = 0
@@ -0,0 +1,141 @@
+# -*- coding: utf-8 -*-
+"""
+This module contains the completion index used by the code completion
+worker to rank the completions on the server side.
+
+Instead of sending all the completions returned by the providers to the
+client (which then filters them for each typed character), the
+:class:`pyqode.core.backend.workers.CodeCompletionWorker` can return the
+best completions for the completion prefix only, when the request data has
+a ``'limit'`` key (see :meth:`CompletionIndex.search`).
+
+The matching completions are ranked in two tiers:
+
+    - the completions that start with the prefix (found with a prefix
+      trie), the completions that match the prefix case, the most frequent
+      completions (optional ``'count'`` key) and the shortest completions
+      first;
+    - the other completions that contain the characters of the prefix in
+      order (subsequence matching), ranked by
+      :func:`pyqode.core.backend.fuzzy.fuzzy_score`, then by count.
+
+.. warning:: This module runs on the server side, it must only depend on the
+    standard library (see :mod:`pyqode.core.backend.workers`).
+"""
+import heapq
+
+from pyqodeng.core.backend.fuzzy import fuzzy_score
+
+
+class _TrieNode(object):
+    __slots__ = ('children', 'items')
+
+    def __init__(self):
+        self.children = {}
+        #: indices of the completions of the subtree
+        self.items = []
+
+
+class CompletionIndex(object):
+    """
+    Index of a list of completions (dicts with a ``'name'`` key, see
+    :class:`pyqode.core.backend.workers.CodeCompletionWorker.Provider`).
+
+    The index is built once per list of completions and can then be searched
+    for each prefix typed by the user.
+    """
+    #: Depth of the prefix trie, longer prefixes are matched by filtering
+    #: the completions found at the maximum depth.
+    MAX_DEPTH = 8
+
+    def __init__(self, completions):
+        """
+        :param completions: list of completion dicts.
+        """
+        self.completions = completions
+        self._names = [completion['name'] for completion in completions]
+        self._counts = [completion.get('count', 0)
+                        for completion in completions]
+        self._lower_names = [name.lower() for name in self._names]
+        self._root = _TrieNode()
+        for i, name in enumerate(self._lower_names):
+            node = self._root
+            node.items.append(i)
+            for char in name[:self.MAX_DEPTH]:
+                try:
+                    node = node.children[char]
+                except KeyError:
+                    node = node.children[char] = _TrieNode()
+                node.items.append(i)
+
+    def __len__(self):
+        return len(self.completions)
+
+    def search(self, prefix, limit=None, offset=0, case_sensitive=False):
+        """
+        Returns the best completions for a prefix.
+
+        :param prefix: the completion prefix, all the completions are
+            returned (in their original order) if it is empty.
+        :param limit: maximum number of completions to return, None to
+            return all the matching completions.
+        :param offset: number of best completions to skip (to get the next
+            completions, once the first ``limit`` ones have been shown).
+        :param case_sensitive: True to match the prefix case.
+        :returns: a tuple (completions, total number of matching
+            completions).
+        """
+        if not prefix:
+            end = len(self.completions) if limit is None else offset + limit
+            return self.completions[offset:end], len(self.completions)
+        names = self._names
+        counts = self._counts
+        first_tier = self._prefix_matches(prefix, case_sensitive)
+        second_tier = self._subsequence_matches(prefix, case_sensitive,
+                                                set(first_tier))
+        total = len(first_tier) + len(second_tier)
+        end = total if limit is None else min(offset + limit, total)
+        ranked = heapq.nsmallest(end, first_tier, key=lambda i: (
+            not names[i].startswith(prefix), -counts[i], len(names[i]),
+            names[i]))
+        if len(ranked) < end:
+            ranked += [item[-1] for item in
+                       heapq.nsmallest(end - len(ranked), second_tier)]
+        return [self.completions[i] for i in ranked[offset:end]], total
+
+    def _prefix_matches(self, prefix, case_sensitive):
+        """ Returns the indices of the completions that start with prefix """
+        node = self._root
+        for char in prefix.lower()[:self.MAX_DEPTH]:
+            try:
+                node = node.children[char]
+            except KeyError:
+                return []
+        items = node.items
+        if case_sensitive:
+            return [i for i in items if self._names[i].startswith(prefix)]
+        if len(prefix) > self.MAX_DEPTH:
+            lower_prefix = prefix.lower()
+            return [i for i in items
+                    if self._lower_names[i].startswith(lower_prefix)]
+        return items
+
+    def _subsequence_matches(self, prefix, case_sensitive, excluded):
+        """
+        Scores the completions that contain the characters of the prefix in
+        order (except the excluded ones), each name is scanned once (in
+        linear time, see :func:`pyqode.core.backend.fuzzy.fuzzy_score`).
+
+        :returns: a list of (-score, -count, len(name), name, index) tuples.
+        """
+        names = self._names
+        counts = self._counts
+        lower_names = self._lower_names
+        matches = []
+        for i, name in enumerate(names):
+            if i in excluded:
+                continue
+            score = fuzzy_score(prefix, name, case_sensitive, lower_names[i])
+            if score is not None:
+                matches.append((-score, -counts[i], len(name), name, i))
+        return matches
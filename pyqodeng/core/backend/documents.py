@@ -0,0 +1,167 @@
+# -*- coding: utf-8 -*-
+"""
+This module contains the document store used by the server to keep a copy of
+the documents opened on the client side.
+
+The client sends the full text of a document only once, then it only sends
+the changes made to the document (text deltas). The requests that need the
+document text only contain a document handle (document id + version), the
+server resolves the text from the store before running the worker.
+"""
+import threading
+
+
+class Document(object):
+    """
+    A versioned copy of a client document.
+    """
+    def __init__(self, doc_id, version, text, path=None):
+        #: Unique id of the document (generated client side)
+        self.id = doc_id
+        #: Version of the document, incremented by the client each time the
+        #: document changes.
+        self.version = version
+        #: Full text of the document.
+        self.text = text
+        #: Path of the document (might be None for new documents).
+        self.path = path
+
+    def apply_changes(self, changes):
+        """
+        Applies a list of changes to the document text.
+
+        The text is rebuilt once: the changes are applied to a gap buffer of
+        slices (of the previous text and of the added texts), a change only
+        moves the slices between the previous change and itself.
+
+        :param changes: list of (position, chars_removed, text_added) tuples,
+            in the order they were made.
+        """
+        # slices (string, start, end) before the gap, in order, and after
+        # the gap, in reverse order
+        before = []
+        after = [(self.text, 0, len(self.text))]
+        gap = 0
+        for position, removed, added in changes:
+            while gap < position and after:
+                string, start, end = after.pop()
+                if gap + end - start > position:
+                    split = start + position - gap
+                    after.append((string, split, end))
+                    end = split
+                before.append((string, start, end))
+                gap += end - start
+            while gap > position:
+                string, start, end = before.pop()
+                if gap - (end - start) < position:
+                    split = end - (gap - position)
+                    before.append((string, start, split))
+                    start = split
+                after.append((string, start, end))
+                gap -= end - start
+            while removed > 0 and after:
+                string, start, end = after.pop()
+                if end - start > removed:
+                    after.append((string, start + removed, end))
+                removed -= end - start
+            if added:
+                before.append((added, 0, len(added)))
+                gap += len(added)
+        after.reverse()
+        self.text = ''.join(string[start:end]
+                            for string, start, end in before + after)
+
+
+class DocumentStore(object):
+    """
+    Thread safe store of the documents synchronised by the clients.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._documents = {}
+
+    def __len__(self):
+        with self._lock:
+            return len(self._documents)
+
+    def __contains__(self, doc_id):
+        with self._lock:
+            return doc_id in self._documents
+
+    def open(self, doc_id, version, text, path=None):
+        """
+        Adds (or replaces) a document.
+
+        :param doc_id: document id
+        :param version: document version
+        :param text: document text
+        :param path: document path
+        """
+        with self._lock:
+            self._documents[doc_id] = Document(doc_id, version, text, path)
+
+    def change(self, doc_id, base_version, version, changes, path=None):
+        """
+        Applies changes to a document.
+
+        :param doc_id: document id
+        :param base_version: the version the changes are based on, must match
+            the version of the stored document.
+        :param version: the new version of the document.
+        :param changes: list of (position, chars_removed, text_added) tuples.
+        :param path: document path (the file might have been renamed).
+
+        :raises: KeyError if the document is unknown or if the stored version
+            does not match ``base_version``.
+        """
+        with self._lock:
+            document = self._documents[doc_id]
+            if document.version != base_version:
+                # out of sync, the client will have to send the full text
+                self._documents.pop(doc_id)
+                raise KeyError(doc_id)
+            document.apply_changes(changes)
+            document.version = version
+            if path is not None:
+                document.path = path
+
+    def close(self, doc_id):
+        """
+        Removes a document from the store.
+        """
+        with self._lock:
+            self._documents.pop(doc_id, None)
+
+    def get(self, doc_id, version=None):
+        """
+        Gets a snapshot of a document (later changes made to the document
+        won't affect the returned snapshot).
+
+        :param doc_id: document id
+        :param version: expected document version, None to get the latest
+            version.
+
+        :raises: KeyError if the document is unknown or if it does not have
+            the expected version.
+        """
+        with self._lock:
+            document = self._documents[doc_id]
+            if version is not None and document.version != version:
+                raise KeyError(doc_id)
+            return Document(document.id, document.version, document.text,
+                            document.path)
+
+    def handle_message(self, message):
+        """
+        Updates the store from a client document message (see the protocol
+        description in :mod:`pyqode.core.backend`).
+        """
+        doc_id = message['id']
+        if message.get('close', False):
+            self.close(doc_id)
+        elif 'text' in message:
+            self.open(doc_id, message['version'], message['text'],
+                      message.get('path'))
+        else:
+            self.change(doc_id, message['base_version'], message['version'],
+                        message['changes'], message.get('path'))
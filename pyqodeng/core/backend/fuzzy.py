@@ -0,0 +1,205 @@
+# -*- coding: utf-8 -*-
+"""
+This module contains the fuzzy matching engine used to filter and rank the
+code completions, on the server side (see
+:mod:`pyqode.core.backend.completion`) and in the completer (see
+:class:`pyqode.core.modes.code_completion.FuzzyCompletionModel`).
+
+The scoring is modelled after fzf: the pattern characters must appear in
+order in the candidate, the shortest matching window is scored, matched
+characters get a bonus at word boundaries (start of the candidate, after a
+delimiter, camel case hump) and when they are consecutive, gaps are
+penalised.
+
+.. warning:: This module is also used on the server side, it must only
+    depend on the standard library (see :mod:`pyqode.core.backend.workers`).
+"""
+
+#: Score of a matched character.
+SCORE_MATCH = 16
+#: Penalty of the first unmatched character of a gap.
+SCORE_GAP_START = -3
+#: Penalty of the next unmatched characters of a gap.
+SCORE_GAP_EXTENSION = -1
+#: Bonus of a character matched at a word boundary.
+BONUS_BOUNDARY = SCORE_MATCH // 2
+#: Bonus of a matched delimiter.
+BONUS_NON_WORD = SCORE_MATCH // 2
+#: Bonus of a character matched at a camel case hump or at the start of a
+#: number.
+BONUS_CAMEL = BONUS_BOUNDARY + SCORE_GAP_EXTENSION
+#: Minimum bonus of a character that follows the previous matched character.
+BONUS_CONSECUTIVE = -(SCORE_GAP_START + SCORE_GAP_EXTENSION)
+#: The bonus of the first pattern character is multiplied by this factor.
+BONUS_FIRST_CHAR_MULTIPLIER = 2
+#: Bonus of a character matched with the same case (case insensitive
+#: matching only).
+BONUS_CASE = 1
+
+_NON_WORD, _LOWER, _UPPER, _NUMBER = range(4)
+
+
+def _char_class(char):
+    if char.islower():
+        return _LOWER
+    if char.isupper():
+        return _UPPER
+    if char.isdigit():
+        return _NUMBER
+    if char.isalpha():
+        return _LOWER
+    return _NON_WORD
+
+
+def _bonus(previous_class, char_class):
+    if char_class == _NON_WORD:
+        return BONUS_NON_WORD
+    if previous_class == _NON_WORD:
+        return BONUS_BOUNDARY
+    if ((previous_class == _LOWER and char_class == _UPPER) or
+            (previous_class != _NUMBER and char_class == _NUMBER)):
+        return BONUS_CAMEL
+    return 0
+
+
+def fuzzy_score(pattern, text, case_sensitive=False, lower_text=None):
+    """
+    Scores a candidate.
+
+    :param pattern: the pattern (e.g. the completion prefix).
+    :param text: the candidate.
+    :param case_sensitive: True to match the characters case.
+    :param lower_text: ``text.lower()``, if already known.
+    :returns: the score (the higher the better), None if the pattern
+        characters do not appear in order in the candidate. The score of
+        the empty pattern is 0.
+    """
+    case_bonus = False
+    if case_sensitive:
+        chars, haystack = pattern, text
+    else:
+        chars = pattern.lower()
+        # the case of the pattern characters can only be compared if they
+        # keep their position when lowered
+        case_bonus = len(chars) == len(pattern)
+        haystack = text.lower() if lower_text is None else lower_text
+        if len(haystack) != len(text):
+            # some characters change length when lowered
+            text = haystack
+    if not chars:
+        return 0
+    # forward scan: end of the first (leftmost) match
+    position = -1
+    for char in chars:
+        position = haystack.find(char, position + 1)
+        if position == -1:
+            return None
+    end = position + 1
+    # backward scan: start of the shortest match that ends there
+    index = len(chars) - 1
+    start = position
+    while index >= 0:
+        if haystack[start] == chars[index]:
+            index -= 1
+            if index < 0:
+                break
+        start -= 1
+    # score of the window
+    score = 0
+    index = 0
+    consecutive = 0
+    first_bonus = 0
+    in_gap = False
+    previous_class = _char_class(text[start - 1]) if start else _NON_WORD
+    for position in range(start, end):
+        char_class = _char_class(text[position])
+        if index < len(chars) and haystack[position] == chars[index]:
+            score += SCORE_MATCH
+            bonus = _bonus(previous_class, char_class)
+            if consecutive == 0:
+                first_bonus = bonus
+            else:
+                if bonus >= BONUS_BOUNDARY and bonus > first_bonus:
+                    first_bonus = bonus
+                bonus = max(bonus, first_bonus, BONUS_CONSECUTIVE)
+            if index == 0:
+                score += bonus * BONUS_FIRST_CHAR_MULTIPLIER
+            else:
+                score += bonus
+            if case_bonus and text[position] == pattern[index]:
+                score += BONUS_CASE
+            in_gap = False
+            consecutive += 1
+            index += 1
+        else:
+            score += SCORE_GAP_EXTENSION if in_gap else SCORE_GAP_START
+            in_gap = True
+            consecutive = 0
+            first_bonus = 0
+        previous_class = char_class
+    return score
+
+
+class FuzzyMatcher(object):
+    """
+    Filters and ranks a list of candidates for a pattern that is refined as
+    the user types.
+
+    The score of each candidate is computed once per pattern and kept in
+    :attr:`scores` (a side array, parallel to the candidates). When the new
+    pattern extends the previous one, only the candidates that matched the
+    previous pattern are scored.
+    """
+    def __init__(self, candidates, case_sensitive=False):
+        """
+        :param candidates: list of strings.
+        :param case_sensitive: True to match the characters case.
+        """
+        self.candidates = list(candidates)
+        self.case_sensitive = case_sensitive
+        self._lower = [candidate.lower() for candidate in self.candidates]
+        #: score of each candidate for the current pattern, None if the
+        #: candidate does not match.
+        self.scores = [0] * len(self.candidates)
+        #: the current pattern
+        self.pattern = ''
+        self._case_sensitive = case_sensitive
+        #: indices of the matching candidates, best first
+        self.matches = list(range(len(self.candidates)))
+
+    def match(self, pattern):
+        """
+        Sets the pattern and returns the indices of the matching candidates,
+        best first (highest score, then shortest candidate, then candidate
+        order).
+
+        :param pattern: the new pattern.
+        """
+        same_case = self._case_sensitive == self.case_sensitive
+        if pattern == self.pattern and same_case:
+            return self.matches
+        if same_case and self.pattern and pattern.startswith(self.pattern):
+            # the candidates that did not match the previous pattern can't
+            # match a longer one
+            indices = self.matches
+        else:
+            indices = range(len(self.candidates))
+        scores = [None] * len(self.candidates)
+        candidates = self.candidates
+        lower = self._lower
+        matches = []
+        for i in indices:
+            score = fuzzy_score(pattern, candidates[i], self.case_sensitive,
+                                lower[i])
+            if score is not None:
+                scores[i] = score
+                matches.append(i)
+        if pattern:
+            matches.sort(key=lambda i: (-scores[i], len(candidates[i]), i))
+        else:
+            matches.sort()
+        self.scores = scores
+        self.pattern = pattern
+        self._case_sensitive = self.case_sensitive
+        self.matches = matches
+        return matches
@@ -0,0 +1,191 @@
+# -*- coding: utf-8 -*-
+"""
+This module contains the metrics of the backend: per worker call counts,
+latency histograms and payload sizes.
+
+The server records, for each worker:
+
+    - ``calls``: number of requests received
+    - ``errors``: number of requests whose worker raised an exception
+    - ``cancelled``: number of cancelled requests
+    - ``cache_hits``: number of requests answered from the result cache
+    - ``request_bytes``/``response_bytes``: size of the frames received
+      and sent
+    - the ``queue`` histogram: time spent in the request queue
+    - the ``execution`` histogram: time spent running the worker
+
+and the ``queued``, ``running`` and ``in_flight`` gauges. The metrics are
+returned by :func:`stats_worker`, e.g. to display them in the status bar::
+
+    editor.backend.send_request(stats_worker, {}, on_receive=show_stats)
+
+The client keeps its own metrics (see
+:attr:`pyqode.core.managers.BackendManager.metrics`), with the
+``round_trip`` histogram: time between sending a request and receiving
+its results.
+"""
+import bisect
+import collections
+import threading
+import time
+
+
+class Histogram(object):
+    """
+    Latency histogram with fixed buckets (in seconds).
+
+    The percentiles are estimated from the buckets: the upper bound of the
+    bucket that contains the percentile is returned (capped by the largest
+    recorded value).
+    """
+    #: upper bounds of the buckets, the last bucket is unbounded
+    BOUNDS = (0.001, 0.002, 0.005, 0.01, 0.02, 0.05, 0.1, 0.2, 0.5, 1, 2, 5,
+              10)
+
+    def __init__(self):
+        self.counts = [0] * (len(self.BOUNDS) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def add(self, value):
+        """ Records a value (in seconds). """
+        self.counts[bisect.bisect_left(self.BOUNDS, value)] += 1
+        self.count += 1
+        self.sum += value
+        self.max = max(self.max, value)
+
+    def percentile(self, percent):
+        """
+        Estimates a percentile.
+
+        :param percent: the percentile, between 0 and 100.
+        :returns: the estimated value (in seconds), 0 if no value has been
+            recorded.
+        """
+        if not self.count:
+            return 0.0
+        rank = percent / 100.0 * self.count
+        seen = 0
+        for bound, count in zip(self.BOUNDS, self.counts):
+            seen += count
+            if count and seen >= rank:
+                return min(bound, self.max)
+        return self.max
+
+    def to_dict(self):
+        """
+        Returns the histogram as a dict (json and marshal serialisable).
+        """
+        return {
+            'count': self.count,
+            'sum': self.sum,
+            'max': self.max,
+            'mean': self.sum / self.count if self.count else 0.0,
+            'p50': self.percentile(50),
+            'p95': self.percentile(95),
+            'p99': self.percentile(99),
+            # the bound of the last bucket is None (unbounded)
+            'buckets': [[bound, count] for bound, count in zip(
+                list(self.BOUNDS) + [None], self.counts)]
+        }
+
+
+class Metrics(object):
+    """
+    Thread safe collection of per worker counters and histograms, plus
+    some gauges (callables evaluated when a snapshot is taken).
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters = collections.defaultdict(collections.Counter)
+        self._histograms = collections.defaultdict(dict)
+        self._start_time = time.time()
+        #: gauges: name -> callable that returns the current value
+        self.gauges = {}
+
+    def increment(self, worker, counter, value=1):
+        """
+        Increments a counter of a worker.
+
+        :param worker: the worker name.
+        :param counter: the counter name, e.g. ``'calls'``.
+        :param value: the increment.
+        """
+        with self._lock:
+            self._counters[worker][counter] += value
+
+    def observe(self, worker, histogram, seconds):
+        """
+        Records a duration in a histogram of a worker.
+
+        :param worker: the worker name.
+        :param histogram: the histogram name, e.g. ``'execution'``.
+        :param seconds: the duration.
+        """
+        with self._lock:
+            try:
+                hist = self._histograms[worker][histogram]
+            except KeyError:
+                hist = self._histograms[worker][histogram] = Histogram()
+            hist.add(seconds)
+
+    def reset(self):
+        """ Clears all the counters and histograms. """
+        with self._lock:
+            self._counters.clear()
+            self._histograms.clear()
+            self._start_time = time.time()
+
+    def snapshot(self):
+        """
+        Returns the current metrics as a dict::
+
+            {
+                'uptime': 12.5,
+                'gauges': {'queued': 0, ...},
+                'totals': {'calls': 10, 'request_bytes': 4096, ...},
+                'workers': {
+                    'pyqode.core.backend.workers.echo_worker': {
+                        'calls': 10, ...,
+                        'queue': {'count': 10, 'p50': 0.001, ...},
+                        'execution': {...}
+                    }
+                }
+            }
+        """
+        gauges = {}
+        for name, gauge in list(self.gauges.items()):
+            gauges[name] = gauge()
+        with self._lock:
+            workers = {}
+            totals = collections.Counter()
+            for worker in set(self._counters) | set(self._histograms):
+                counters = self._counters.get(worker, {})
+                totals.update(counters)
+                stats = dict(counters)
+                for name, hist in self._histograms.get(worker, {}).items():
+                    stats[name] = hist.to_dict()
+                workers[worker] = stats
+            return {'uptime': time.time() - self._start_time,
+                    'gauges': gauges, 'totals': dict(totals),
+                    'workers': workers}
+
+
+#: The metrics of the server
+server_metrics = Metrics()
+
+#: Fully qualified name of :func:`stats_worker`.
+STATS_WORKER = 'pyqodeng.core.backend.metrics.stats_worker'
+
+
+def stats_worker(data):
+    """
+    Returns a snapshot of the server metrics (see :meth:`Metrics.snapshot`).
+
+    The server answers the stats requests as soon as they are received,
+    they are never queued behind the requests they describe.
+
+    :param data: unused.
+    """
+    return server_metrics.snapshot()
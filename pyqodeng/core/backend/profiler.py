@@ -0,0 +1,196 @@
+# -*- coding: utf-8 -*-
+"""
+This module contains the worker profiler of the server.
+
+When the server runs with the ``--profile`` option (see
+:func:`pyqode.core.backend.default_parser`), or for the requests that have a
+``'profile'`` field (set to true), the worker runs under :mod:`cProfile`.
+The statistics are aggregated per worker and can be retrieved with
+:func:`profile_worker`, e.g. to find the hot spots of a checker or of a
+completion provider on a live session::
+
+    editor.backend.request_profile(print_profile)
+
+With the ``--profile-dir`` option, the aggregated statistics of each worker
+are also written to ``<worker name>.prof`` (:mod:`pstats` format, e.g. for
+``python -m pstats`` or snakeviz) each time they are requested and when the
+server shuts down.
+"""
+import logging
+import os
+import pstats
+import threading
+
+try:
+    import cProfile as profile
+except ImportError:
+    import profile
+
+
+def _logger():
+    """ Returns the module's logger """
+    return logging.getLogger(__name__)
+
+
+class _RawStats(object):
+    """ Adapts raw profile statistics to the pstats.Stats constructor """
+    def __init__(self, stats):
+        self.stats = stats
+
+    def create_stats(self):
+        pass
+
+
+def run_profiled(func, *args):
+    """
+    Runs ``func(*args)`` under the profiler.
+
+    The raw statistics are returned instead of being recorded so that this
+    function can run in a child process (process executor).
+
+    :returns: a tuple (results, raw statistics). The statistics are None if
+        the profiler could not be enabled (e.g. another profiler is active).
+    """
+    profiler = profile.Profile()
+    try:
+        profiler.enable()
+    except ValueError:
+        _logger().warning('profiler not available, running %r unprofiled',
+                          func)
+        return func(*args), None
+    try:
+        results = func(*args)
+    finally:
+        profiler.disable()
+    profiler.create_stats()
+    return results, profiler.stats
+
+
+class WorkerProfiler(object):
+    """
+    Thread safe aggregation of the profile statistics of each worker.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        #: worker name -> pstats.Stats
+        self._stats = {}
+        #: worker name -> number of profiled requests
+        self._requests = {}
+        #: directory where the statistics are written, None to not write
+        #: them
+        self.directory = None
+
+    def add(self, worker, raw_stats):
+        """
+        Adds the statistics of a profiled request.
+
+        :param worker: the worker name.
+        :param raw_stats: the raw statistics returned by
+            :func:`run_profiled`.
+        """
+        if raw_stats is None:
+            return
+        stats = pstats.Stats(_RawStats(raw_stats))
+        with self._lock:
+            if worker in self._stats:
+                self._stats[worker].add(stats)
+            else:
+                self._stats[worker] = stats
+            self._requests[worker] = self._requests.get(worker, 0) + 1
+
+    def reset(self):
+        """ Discards all the statistics. """
+        with self._lock:
+            self._stats.clear()
+            self._requests.clear()
+
+    def summary(self, worker=None, limit=30, sort='cumulative'):
+        """
+        Returns the aggregated statistics::
+
+            {
+                'pyqode.core.backend.workers.findall': {
+                    'requests': 12,
+                    'total_time': 0.42,
+                    'functions': [
+                        {'function': 'workers.py:120(findall)',
+                         'calls': 12, 'primitive_calls': 12,
+                         'total_time': 0.01, 'cumulative_time': 0.42},
+                        ...
+                    ]
+                }
+            }
+
+        :param worker: name of the worker, None for all the workers.
+        :param limit: maximum number of functions per worker.
+        :param sort: ``'cumulative'`` or ``'tottime'``.
+        """
+        index = 3 if sort == 'cumulative' else 2
+        summary = {}
+        with self._lock:
+            for name, stats in self._stats.items():
+                if worker is not None and name != worker:
+                    continue
+                functions = sorted(stats.stats.items(),
+                                   key=lambda item: item[1][index],
+                                   reverse=True)[:limit]
+                summary[name] = {
+                    'requests': self._requests[name],
+                    'total_time': stats.total_tt,
+                    'functions': [{
+                        'function': '%s:%d(%s)' % (
+                            os.path.basename(filename), line, function),
+                        'calls': nc, 'primitive_calls': cc,
+                        'total_time': tt, 'cumulative_time': ct
+                    } for (filename, line, function), (cc, nc, tt, ct, _)
+                        in functions]
+                }
+        return summary
+
+    def dump(self):
+        """
+        Writes the statistics of each worker to ``<worker name>.prof`` in
+        :attr:`directory` (nothing is done if the directory is None).
+        """
+        if self.directory is None:
+            return
+        with self._lock:
+            for name, stats in self._stats.items():
+                try:
+                    if not os.path.exists(self.directory):
+                        os.makedirs(self.directory)
+                    stats.dump_stats(os.path.join(
+                        self.directory, '%s.prof' % name))
+                except (OSError, TypeError):
+                    _logger().exception('failed to write the profile of %s',
+                                        name)
+
+
+#: The profiler of the server
+worker_profiler = WorkerProfiler()
+
+#: Fully qualified name of :func:`profile_worker`.
+PROFILE_WORKER = 'pyqodeng.core.backend.profiler.profile_worker'
+
+
+def profile_worker(data):
+    """
+    Returns the aggregated profile statistics of the workers (see
+    :meth:`WorkerProfiler.summary`), the statistics are also written to the
+    profile directory if there is one.
+
+    The server answers the profile requests as soon as they are received,
+    they are never queued.
+
+    :param data: dict with the optional ``'worker'``, ``'limit'`` and
+        ``'sort'`` keys (see :meth:`WorkerProfiler.summary`) and the
+        ``'reset'`` key (True to discard the statistics once returned).
+    """
+    data = data or {}
+    summary = worker_profiler.summary(data.get('worker'),
+                                      data.get('limit', 30),
+                                      data.get('sort', 'cumulative'))
+    worker_profiler.dump()
+    if data.get('reset', False):
+        worker_profiler.reset()
+    return summary
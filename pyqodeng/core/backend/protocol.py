@@ -0,0 +1,239 @@
+# -*- coding: utf-8 -*-
+"""
+This module contains the message framing used by the client and the server.
+
+By default, a frame is made up of a 4 bytes header (the payload length)
+followed by the json payload (utf-8).
+
+When a client connects, it sends a ``hello`` message to negotiate a compact
+framing mode. In this mode, the header contains the payload length and a
+flags byte that tells how the payload has been encoded:
+
+    - FLAG_MARSHAL: the payload has been serialised with ``marshal`` instead
+      of json. Marshal is much faster than json but it is only used if the
+      client and the server run the same python version (the marshal format
+      is version dependent) and if the server allows it: unmarshalling
+      untrusted data is not safe, the server only accepts marshal on the
+      transports that other users can't reach (unix socket, stdio). Only
+      the objects made of json types (dict with str keys, list, str, int,
+      float, bool and None) are marshalled, the other objects (e.g. tuples
+      or int dict keys) are sent as json: the decoded objects are thus the
+      same whatever the encoding (and the transport).
+    - FLAG_COMPRESSED: the payload has been compressed with zlib (only large
+      payloads are compressed).
+"""
+import json
+import marshal
+import struct
+import sys
+import zlib
+
+
+#: Header of the default (json) frames: payload length
+HEADER = struct.Struct('=I')
+#: Header of the negotiated frames: payload length + flags
+COMPACT_HEADER = struct.Struct('=IB')
+
+#: The payload has been compressed with zlib
+FLAG_COMPRESSED = 0x1
+#: The payload has been serialised with marshal
+FLAG_MARSHAL = 0x2
+
+#: Payloads larger than this threshold are compressed (in bytes).
+COMPRESSION_THRESHOLD = 1024 * 1024
+
+_JSON_SCALARS = frozenset([str, int, float, bool, type(None)])
+
+
+def is_json_compatible(obj):
+    """
+    Checks that an object is only made of json types, i.e. that it is
+    decoded the same way whether it is serialised with json or marshal.
+    """
+    stack = [obj]
+    pop = stack.pop
+    extend = stack.extend
+    while stack:
+        value = pop()
+        kind = type(value)
+        if kind in _JSON_SCALARS:
+            continue
+        if kind is list:
+            extend(value)
+        elif kind is dict:
+            for key in value:
+                if type(key) is not str:
+                    return False
+            extend(value.values())
+        else:
+            return False
+    return True
+
+
+class Framing(object):
+    """
+    Encodes and decodes frames, using the default json framing until a
+    compact framing has been negotiated.
+    """
+    def __init__(self):
+        #: True when the compact framing is used
+        self.compact = False
+        #: True to serialise payloads with marshal (compact framing only)
+        self.marshal = False
+        #: Compression threshold, None to disable compression (compact
+        #: framing only)
+        self.compression_threshold = None
+
+    @property
+    def header(self):
+        """ Returns the header struct of the current framing mode """
+        return COMPACT_HEADER if self.compact else HEADER
+
+    def hello(self, encodings=('marshal', 'json'), compression=True):
+        """
+        Returns the hello message a client sends to negotiate the compact
+        framing.
+
+        :param encodings: encodings supported by the client, by order of
+            preference.
+        :param compression: True if the client supports zlib compression.
+        """
+        return {'type': 'hello', 'encodings': list(encodings),
+                'compression': ['zlib'] if compression else [],
+                'python': list(sys.version_info[:2])}
+
+    def negotiate(self, hello, allow_marshal=True):
+        """
+        Chooses the framing mode from a client hello message (server side).
+
+        :param hello: the hello message of the client.
+        :param allow_marshal: False to never use marshal, e.g. if the
+            client might not be trusted.
+        :returns: the reply to send to the client. The reply must be sent
+            using the current framing, then :meth:`configure` must be called
+            with the reply.
+        """
+        encoding = 'json'
+        same_python = list(hello.get('python', [])) == list(
+            sys.version_info[:2])
+        use_marshal = allow_marshal and same_python
+        for name in hello.get('encodings', []):
+            if name == 'json' or (name == 'marshal' and use_marshal):
+                encoding = name
+                break
+        reply = {'type': 'hello', 'encoding': encoding,
+                 'compression': None}
+        if 'zlib' in hello.get('compression', []):
+            reply['compression'] = 'zlib'
+            reply['threshold'] = COMPRESSION_THRESHOLD
+        return reply
+
+    def configure(self, reply):
+        """
+        Switches to the compact framing negotiated in ``reply``.
+        """
+        self.compact = True
+        self.marshal = reply.get('encoding') == 'marshal'
+        if reply.get('compression') == 'zlib':
+            self.compression_threshold = reply.get(
+                'threshold', COMPRESSION_THRESHOLD)
+        else:
+            self.compression_threshold = None
+
+    def encode(self, obj):
+        """
+        Encodes an object into a frame.
+
+        :returns: the frame bytes (header + payload)
+        """
+        if not self.compact:
+            payload = json.dumps(obj).encode('utf-8')
+            return HEADER.pack(len(payload)) + payload
+        flags = 0
+        payload = None
+        if self.marshal and is_json_compatible(obj):
+            payload = marshal.dumps(obj)
+            flags |= FLAG_MARSHAL
+        if payload is None:
+            payload = json.dumps(obj).encode('utf-8')
+        if (self.compression_threshold is not None and
+                len(payload) > self.compression_threshold):
+            payload = zlib.compress(payload, 1)
+            flags |= FLAG_COMPRESSED
+        return COMPACT_HEADER.pack(len(payload), flags) + payload
+
+    def decode(self, payload, flags=0):
+        """
+        Decodes a frame payload.
+
+        :param payload: payload bytes (bytes, bytearray or memoryview)
+        :param flags: frame flags
+        """
+        if flags & FLAG_COMPRESSED:
+            payload = zlib.decompress(payload)
+        if flags & FLAG_MARSHAL:
+            return marshal.loads(payload)
+        return json.loads(bytes(payload).decode('utf-8'))
+
+
+class FrameReader(object):
+    """
+    Accumulates received bytes in a bytearray and decodes the complete
+    frames.
+
+    Usage::
+
+        reader.feed(data)
+        for obj in reader:
+            handle(obj)
+
+    The framing mode is checked before reading each frame, the framing can
+    thus be switched between two frames (e.g. after a hello message).
+    """
+    def __init__(self, framing):
+        self.framing = framing
+        self._buffer = bytearray()
+        #: size (header included) of the last decoded frame
+        self.last_size = 0
+
+    def __len__(self):
+        """ Returns the number of buffered bytes """
+        return len(self._buffer)
+
+    def feed(self, data):
+        """
+        Appends received bytes to the buffer.
+        """
+        self._buffer += data
+
+    def read_frame(self):
+        """
+        Decodes the next complete frame and removes it from the buffer.
+
+        :returns: The decoded object, None if there is no complete frame
+            in the buffer.
+        """
+        header = self.framing.header
+        if len(self._buffer) < header.size:
+            return None
+        values = header.unpack_from(self._buffer)
+        size = values[0]
+        flags = values[1] if len(values) > 1 else 0
+        end = header.size + size
+        if len(self._buffer) < end:
+            return None
+        with memoryview(self._buffer) as view:
+            with view[header.size:end] as payload:
+                obj = self.framing.decode(payload, flags)
+        # removing bytes from the start of a bytearray does not move the
+        # remaining bytes, the buffer is only compacted when it grows
+        del self._buffer[:end]
+        self.last_size = end
+        return obj
+
+    def __iter__(self):
+        while True:
+            obj = self.read_frame()
+            if obj is None:
+                break
+            yield obj
@@ -0,0 +1,304 @@
+# -*- coding: utf-8 -*-
+"""
+This module contains the worker registry used by the server to resolve the
+workers of the requests.
+
+A worker is resolved (imported and, for classes, instantiated) the first time
+it is requested, the same instance is then used for all the subsequent
+requests. Workers can thus keep warm caches between two requests and hold
+per-document state.
+"""
+import inspect
+import logging
+import threading
+import time
+import types
+
+from pyqodeng.core.backend.workers import _thread_data, is_cancelled
+from pyqodeng.core.backend.workers import artifact_cache
+
+
+def _logger():
+    """ Returns the module's logger """
+    return logging.getLogger(__name__)
+
+
+#: Maximum number of items of a streamed chunk.
+CHUNK_SIZE = 1000
+#: Maximum delay (in seconds) between two streamed chunks.
+CHUNK_DELAY = 0.05
+
+
+def import_class(klass):
+    """
+    Imports a class from a fully qualified name string.
+
+    :param klass: class string, e.g.
+        "pyqode.core.backend.workers.CodeCompletionWorker"
+    :return: The corresponding class
+
+    """
+    path = klass.rfind(".")
+    class_name = klass[path + 1: len(klass)]
+    try:
+        module = __import__(klass[0:path], globals(), locals(), [class_name])
+        klass = getattr(module, class_name)
+    except ImportError as e:
+        raise ImportError('%s: %s' % (klass, str(e)))
+    except AttributeError:
+        raise ImportError(klass)
+    else:
+        return klass
+
+
+class WorkerRegistry(object):
+    """
+    Thread safe registry of the worker instances of a server process.
+
+    Workers are registered under their fully qualified name (the name sent by
+    the client in the requests). They are resolved lazily, the first time they
+    are requested, but they can also be preloaded when the server starts (see
+    :meth:`preload` and the ``--preload`` option of
+    :func:`pyqode.core.backend.default_parser`) to avoid paying the import
+    cost on the first request.
+
+    A worker instance may implement the following (optional) lifecycle
+    hooks:
+
+        - ``on_document_closed(document_id)``: called when a client closes a
+          document, the worker should drop the state it keeps for this
+          document (see :func:`pyqode.core.backend.workers.current_document`).
+        - ``shutdown()``: called when the server shuts down.
+
+    .. note:: With the process executor, each process of the pool has its own
+        registry. The lifecycle hooks are only called on the workers of the
+        server process.
+    """
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._workers = {}
+
+    def __contains__(self, name):
+        with self._lock:
+            return name in self._workers
+
+    def __len__(self):
+        with self._lock:
+            return len(self._workers)
+
+    def register(self, worker, name=None):
+        """
+        Registers a worker.
+
+        :param worker: worker class (instantiated once), function or
+            callable instance.
+        :param name: name of the worker, default is the fully qualified name
+            of the worker class or function.
+        :returns: The registered worker instance.
+        """
+        if name is None:
+            klass = worker if inspect.isclass(worker) or inspect.isfunction(
+                worker) else worker.__class__
+            name = '%s.%s' % (klass.__module__, klass.__name__)
+        if inspect.isclass(worker):
+            worker = worker()
+        with self._lock:
+            self._workers[name] = worker
+        return worker
+
+    def get(self, name):
+        """
+        Gets a worker, the worker is imported (and instantiated) if this is
+        the first time it is requested.
+
+        :param name: fully qualified name of the worker class or function.
+        :raises: ImportError if the worker could not be imported.
+        """
+        try:
+            return self._workers[name]
+        except KeyError:
+            with self._lock:
+                if name not in self._workers:
+                    self.register(import_class(name), name)
+                return self._workers[name]
+
+    def preload(self, names):
+        """
+        Resolves a list of workers in advance.
+
+        :param names: fully qualified names of the workers to preload.
+        """
+        for name in names:
+            try:
+                self.get(name)
+            except ImportError:
+                _logger().exception('failed to preload worker %s', name)
+            else:
+                _logger().debug('worker %s preloaded', name)
+
+    def document_closed(self, document_id):
+        """
+        Calls the ``on_document_closed`` hook of the workers and drops the
+        artifacts of the document (see
+        :class:`pyqode.core.backend.workers.ArtifactCache`).
+        """
+        artifact_cache.discard(document_id)
+        self._call_hook('on_document_closed', document_id)
+
+    def shutdown(self):
+        """
+        Calls the ``shutdown`` hook of the workers and clears the registry.
+        """
+        self._call_hook('shutdown')
+        with self._lock:
+            self._workers.clear()
+        artifact_cache.clear()
+
+    def _call_hook(self, hook, *args):
+        with self._lock:
+            workers = list(self._workers.values())
+        for worker in workers:
+            method = getattr(worker, hook, None)
+            if method is None:
+                continue
+            try:
+                method(*args)
+            except Exception:
+                _logger().exception('%s hook of worker %r failed', hook,
+                                    worker)
+
+
+#: The worker registry of the current process.
+worker_registry = WorkerRegistry()
+
+
+def preload_workers(names):
+    """
+    Preloads workers in the registry of the current process (used as the
+    initializer of the processes of the process executor).
+    """
+    worker_registry.preload(names)
+
+
+def execute_worker(worker, data, document=None, on_chunk=None):
+    """
+    Resolves and runs a worker.
+
+    This function is used to run the workers in the worker slots of the
+    server, either in a thread or in a child process (see the ``--executor``
+    option of :func:`default_parser`).
+
+    :param worker: fully qualified name of the worker class or function.
+    :param data: worker data.
+    :param document: the document the request refers to (dict with the
+        document id, version and path), None if the request does not refer
+        to a document.
+    :param on_chunk: callback called with the items produced by a generator
+        worker, by chunks, as soon as they are available. If None, the items
+        of a generator worker are returned as a list.
+    :return: The worker results, an empty list if the worker failed or
+        returned None (or if its items have been streamed).
+    """
+    try:
+        worker = worker_registry.get(worker)
+    except ImportError:
+        _logger().exception('Failed to import worker class')
+        return []
+    _logger().log(1, 'worker: %r', worker)
+    _logger().log(1, 'data: %r', data)
+    _thread_data.document = document
+    try:
+        ret_val = worker(data)
+        if isinstance(ret_val, types.GeneratorType):
+            ret_val = _consume(ret_val, on_chunk)
+    except Exception:
+        _logger().exception(
+            'something went bad with worker %r(data=%r)', worker, data)
+        ret_val = None
+    finally:
+        _thread_data.document = None
+    if ret_val is None:
+        ret_val = []
+    return ret_val
+
+
+def _consume(generator, on_chunk=None):
+    """
+    Consumes the items of a generator worker, stops early if the request
+    has been cancelled.
+
+    The first item is streamed at once. The next ones are streamed by chunks:
+    a chunk is sent when it is full or :data:`CHUNK_DELAY` after its first
+    item, even if the generator is blocked meanwhile (a single flusher thread
+    per stream, started with the second item, sends the late chunks).
+
+    :returns: the list of items, an empty list if the items have been
+        streamed to ``on_chunk``.
+    """
+    items = []
+    if on_chunk is None:
+        try:
+            for item in generator:
+                items.append(item)
+                if not len(items) % CHUNK_SIZE and is_cancelled():
+                    break
+        finally:
+            generator.close()
+        return items
+    token = getattr(_thread_data, 'token', None)
+    condition = threading.Condition()
+    # time at which the pending chunk must be sent, None if it is empty
+    deadline = [None]
+    done = [False]
+    flushers = []
+
+    def flush():
+        # called with the condition acquired
+        if items and not (token is not None and token.cancelled):
+            on_chunk(items[:])
+        del items[:]
+        deadline[0] = None
+
+    def run_flusher():
+        # sends the chunks that are not full after the delay, the generator
+        # may be blocked until its next item
+        with condition:
+            while not done[0]:
+                if deadline[0] is None:
+                    condition.wait()
+                    continue
+                remaining = deadline[0] - time.time()
+                if remaining > 0:
+                    condition.wait(remaining)
+                else:
+                    flush()
+
+    first = True
+    try:
+        for item in generator:
+            with condition:
+                items.append(item)
+                full = first or len(items) >= CHUNK_SIZE
+                if full:
+                    first = False
+                    flush()
+                elif len(items) == 1:
+                    deadline[0] = time.time() + CHUNK_DELAY
+                    if not flushers:
+                        flusher = threading.Thread(target=run_flusher)
+                        flusher.daemon = True
+                        flushers.append(flusher)
+                        flusher.start()
+                    condition.notify()
+            if full and is_cancelled():
+                break
+    finally:
+        with condition:
+            done[0] = True
+            condition.notify()
+        for flusher in flushers:
+            flusher.join()
+        generator.close()
+    with condition:
+        flush()
+    return []
@@ -3,16 +3,30 @@
 This module contains the server socket definition.
 """
 import argparse
-import inspect
+import collections
 import logging
-import json
 import os
-import struct
+import socket
+import stat
 import sys
 import time
 import traceback
 import threading
 
+from pyqodeng.core.backend.cache import ResultCache
+from pyqodeng.core.backend.documents import DocumentStore
+from pyqodeng.core.backend.metrics import STATS_WORKER
+from pyqodeng.core.backend.metrics import server_metrics
+from pyqodeng.core.backend.profiler import PROFILE_WORKER
+from pyqodeng.core.backend.profiler import run_profiled
+from pyqodeng.core.backend.profiler import worker_profiler
+from pyqodeng.core.backend.protocol import Framing, FrameReader
+from pyqodeng.core.backend.registry import execute_worker
+from pyqodeng.core.backend.registry import import_class  # noqa: F401
+from pyqodeng.core.backend.registry import preload_workers
+from pyqodeng.core.backend.registry import worker_registry
+from pyqodeng.core.backend.workers import CancellationToken
+from pyqodeng.core.backend.zygote import serve_zygote
 
 try:
     import socketserver
@@ -28,131 +42,726 @@ def _logger():
 
 
 HEARTBEAT_DELAY = 60  # delay max without heartbeat signal
+RECV_BUFFER_SIZE = 64 * 1024
 
+#: Priority of the requests the user is actively waiting for (code completion,
+#: occurrences highlighting, search,...).
+PRIORITY_INTERACTIVE = 0
+#: Default request priority.
+PRIORITY_NORMAL = 1
+#: Priority of the background analysis requests (checkers, outline,...).
+PRIORITY_BACKGROUND = 2
 
-def import_class(klass):
+#: Workers that are run as soon as their request is received, without being
+#: queued: they report on the server state (metrics, profile) and must not
+#: wait behind the requests they describe.
+INLINE_WORKERS = (STATS_WORKER, PROFILE_WORKER)
+
+
+class RequestQueue(object):
     """
-    Imports a class from a fully qualified name string.
+    Thread safe queue of requests, ordered by priority.
+
+    Requests with the lowest priority value are always dequeued first,
+    requests of the same priority are dequeued in FIFO order.
+    """
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._queues = collections.defaultdict(collections.deque)
+
+    def __len__(self):
+        with self._cond:
+            return sum(len(q) for q in self._queues.values())
+
+    def put(self, priority, item):
+        """
+        Adds an item to the queue.
+
+        :param priority: the item priority (one of the PRIORITY_* constants).
+        :param item: the item to add.
+        """
+        with self._cond:
+            self._queues[priority].append(item)
+            self._cond.notify_all()
 
-    :param klass: class string, e.g.
-        "pyqode.core.backend.workers.CodeCompletionWorker"
-    :return: The corresponding class
+    def get(self, max_priority=None):
+        """
+        Removes and returns the item with the highest priority, blocks until
+        an item is available.
 
+        :param max_priority: only consider items whose priority value is
+            lower or equal to ``max_priority`` (None to consider all items).
+        """
+        with self._cond:
+            while True:
+                for priority in sorted(self._queues.keys()):
+                    if max_priority is not None and priority > max_priority:
+                        break
+                    if self._queues[priority]:
+                        return self._queues[priority].popleft()
+                self._cond.wait()
+
+    def remove(self, predicate):
+        """
+        Removes the items that match ``predicate``.
+
+        :param predicate: callable that takes an item and returns True if the
+            item must be removed.
+        :returns: The list of removed items.
+        """
+        removed = []
+        with self._cond:
+            for items in self._queues.values():
+                for item in list(items):
+                    if predicate(item):
+                        items.remove(item)
+                        removed.append(item)
+        return removed
+
+
+class _PipeConnection(object):
     """
-    path = klass.rfind(".")
-    class_name = klass[path + 1: len(klass)]
-    try:
-        module = __import__(klass[0:path], globals(), locals(), [class_name])
-        klass = getattr(module, class_name)
-    except ImportError as e:
-        raise ImportError('%s: %s' % (klass, str(e)))
-    except AttributeError:
-        raise ImportError(klass)
-    else:
-        return klass
+    Socket like wrapper around a pair of file descriptors, used to serve the
+    client through the standard input/output of the server process (stdio
+    transport).
+    """
+    def __init__(self, read_fd, write_fd):
+        if sys.platform == 'win32':
+            import msvcrt
+            msvcrt.setmode(read_fd, os.O_BINARY)
+            msvcrt.setmode(write_fd, os.O_BINARY)
+        self._read_fd = read_fd
+        self._write_fd = write_fd
+
+    def recv(self, size):
+        return os.read(self._read_fd, size)
+
+    def sendall(self, data):
+        view = memoryview(data)
+        while len(view):
+            written = os.write(self._write_fd, view)
+            view = view[written:]
 
 
-class JsonServer(socketserver.TCPServer):
+class ClientConnection(object):
     """
-    A server socket based on a json messaging system.
+    Handles the messages of a client connection (framing negotiation,
+    documents, requests, cancellation,...), independently of the way the
+    bytes are received and sent.
+
+    Subclasses feed the decoded messages to :meth:`dispatch` and implement
+    :meth:`write`, which must be thread safe: the responses are sent from
+    the worker slot threads.
     """
+    #: the server (:class:`RequestEngine`) that runs the requests
+    srv = None
 
-    class _Handler(socketserver.BaseRequestHandler):
-        def read_bytes(self, size):
-            """
-            Read x bytes
+    def setup_connection(self):
+        """ Initialises the framing state of the connection. """
+        self._send_lock = threading.Lock()
+        self._framing = Framing()
+        self._reader = FrameReader(self._framing)
 
-            :param size: number of bytes to read.
+    def write(self, frame):
+        """
+        Sends an encoded frame to the client.
 
-            """
-            if not PY33:
-                data = ''
+        :param frame: the frame bytes.
+        """
+        raise NotImplementedError()
+
+    def send(self, obj):
+        """
+        Sends a python obj to the client, using the framing negotiated with
+        the client.
+
+        :param obj: The object to send, must be Json serializable.
+        :returns: the size of the frame (in bytes).
+        """
+        with self._send_lock:
+            frame = self._framing.encode(obj)
+            _logger().log(1, 'sending %d bytes', len(frame))
+            self.write(frame)
+        return len(frame)
+
+    def dispatch(self, data):
+        """
+        Handles a message received from the client.
+        """
+        self.srv.reset_heartbeat()
+        msg_type = data.get('type')
+        if msg_type == 'ping':
+            # keepalive, the heartbeat has been reset above
+            return
+        elif msg_type == 'hello':
+            self._negotiate(data)
+        elif msg_type == 'cancel':
+            self.srv.cancel(self, data['request_id'])
+        elif msg_type == 'document':
+            self._handle_document(data)
+        elif msg_type == 'batch':
+            self._handle_batch(data, self._reader.last_size)
+        else:
+            self._handle(data, size=self._reader.last_size)
+
+    def _negotiate(self, data):
+        """
+        Negotiates the framing used for the next messages (the reply is
+        sent with the current framing).
+        """
+        reply = self._framing.negotiate(
+            data, allow_marshal=self.srv.allow_marshal)
+        with self._send_lock:
+            self.write(self._framing.encode(reply))
+            self._framing.configure(reply)
+        _logger().log(1, 'negotiated framing: %r', reply)
+
+    def _handle_document(self, data):
+        """
+        Handles a document message (full text, changes or close).
+        """
+        try:
+            self.srv.documents.handle_message(data)
+            if data.get('close', False):
+                worker_registry.document_closed(data['id'])
+        except KeyError:
+            # the requests that refer to this document will ask the
+            # client to send the full text
+            _logger().warning('document %s out of sync', data['id'])
+
+    def _handle_batch(self, data, size=0):
+        """
+        Handles a batch of requests: the document snapshot is resolved
+        once and shared by all the requests of the batch.
+
+        :param data: the batch message.
+        :param size: size of the batch frame, shared by its requests in the
+            metrics.
+        """
+        document = data.get('document')
+        snapshot = None
+        if document is not None:
+            try:
+                snapshot = self.srv.documents.get(
+                    document['id'], document['version'])
+            except KeyError:
+                # each request will ask for a resync
+                pass
+        requests = data.get('requests', [])
+        for request in requests:
+            if document is not None:
+                request['document'] = dict(document)
+            self._handle(request, snapshot, size // max(1, len(requests)))
+
+    def _handle(self, data, snapshot=None, size=0):
+        """
+        Handles a work request: the request is queued and will be run
+        by the first available worker slot.
+
+        :param data: the request.
+        :param snapshot: the document snapshot the request refers to, if
+            it has already been resolved.
+        :param size: size of the request frame.
+        """
+        try:
+            _logger().log(1, 'handling request %r', data)
+            assert data['worker']
+            assert data['request_id']
+            assert data['data'] is not None
+            document = data.get('document')
+            if document is not None:
+                if snapshot is None:
+                    try:
+                        snapshot = self.srv.documents.get(
+                            document['id'], document['version'])
+                    except KeyError:
+                        _logger().warning(
+                            'unknown document %s (version %r)',
+                            document['id'], document['version'])
+                        self.send({'request_id': data['request_id'],
+                                   'results': [],
+                                   'resync': document['id']})
+                        return
+                data['data'][document['key']] = snapshot.text
+                document['path'] = snapshot.path
+            self.srv.submit(self, data, size)
+        except:
+            _logger().warn('error with data=%r', data)
+            exc1, exc2, exc3 = sys.exc_info()
+            traceback.print_exception(exc1, exc2, exc3, file=sys.stderr)
+
+    def send_chunk(self, request_id, items):
+        """
+        Sends a chunk of the items produced by a streaming worker.
+
+        :returns: the number of bytes sent.
+        """
+        try:
+            return self.send({'request_id': request_id, 'chunk': items})
+        except (ConnectionAbortedError, BrokenPipeError):
+            return 0
+
+    def respond(self, request_id, results, cancelled=False):
+        """
+        Sends the results of a request.
+
+        :returns: the number of bytes sent.
+        """
+        response = {'request_id': request_id, 'results': results}
+        if cancelled:
+            response['cancelled'] = True
+        _logger().log(1, 'sending response: %r', response)
+        try:
+            return self.send(response)
+        except (ConnectionAbortedError, BrokenPipeError):
+            pass
+        except:
+            _logger().warn('error with response=%r', response)
+            exc1, exc2, exc3 = sys.exc_info()
+            traceback.print_exception(exc1, exc2, exc3, file=sys.stderr)
+        return 0
+
+
+class RequestEngine(object):
+    """
+    Runs the requests of the clients of a server: the request queue, the
+    worker slots, the cancellation tokens, the documents, the result cache
+    and the heartbeat. The server classes (:class:`JsonServer`,
+    :class:`pyqode.core.backend.async_server.AsyncJsonServer`) only
+    deal with the client connections and call :meth:`setup_engine` and
+    :meth:`start_engine`.
+
+    Subclasses must implement ``shutdown()``, which may be called from any
+    thread.
+    """
+    def setup_engine(self, args):
+        """
+        Creates the engine state from the parsed command line args.
+        """
+        self.reset_heartbeat()
+        self.port = args.port
+        self.timeout = HEARTBEAT_DELAY
+        #: the documents synchronised by the clients
+        self.documents = DocumentStore()
+        self._requests = RequestQueue()
+        #: tokens of the queued and running requests:
+        #: (handler, request_id) -> (token, group)
+        self._tokens = {}
+        self._tokens_lock = threading.Lock()
+        self._nb_running = 0
+        self._nb_running_lock = threading.Lock()
+        self._pool = None
+        cache_size = int(getattr(args, 'result_cache', 0) or 0)
+        #: results cache, None if disabled
+        self.result_cache = (ResultCache(cache_size * 1024 * 1024)
+                             if cache_size > 0 else None)
+        self._nb_slots = max(1, int(getattr(args, 'workers', 1)))
+        self._nb_interactive_slots = max(0, int(getattr(
+            args, 'interactive_slots', 1)))
+        preload = list(getattr(args, 'preload', None) or [])
+        worker_registry.preload(preload)
+        if getattr(args, 'executor', 'thread') == 'process':
+            from concurrent.futures import ProcessPoolExecutor
+            self._pool = ProcessPoolExecutor(
+                max_workers=self._nb_slots + self._nb_interactive_slots,
+                initializer=preload_workers, initargs=(preload,))
+        self._stopped = threading.Event()
+        self.transport = getattr(args, 'transport', 'tcp')
+        #: True to accept the marshal framing, only on the transports that
+        #: other users can't connect to since unmarshalling untrusted data is
+        #: not safe.
+        self.allow_marshal = self.transport in ('unix', 'stdio')
+        #: the server metrics, see :func:`pyqode.core.backend.stats_worker`
+        self.metrics = server_metrics
+        self.metrics.reset()
+        self.metrics.gauges.update({
+            'queued': lambda: len(self._requests),
+            'running': lambda: self._nb_running,
+            'in_flight': lambda: len(self._tokens)})
+        #: True to profile all the requests (``--profile``)
+        self.profile = bool(getattr(args, 'profile', False))
+        worker_profiler.reset()
+        worker_profiler.directory = getattr(args, 'profile_dir', None)
+
+    def start_engine(self, heartbeat=True):
+        """
+        Prints the readiness messages and starts the worker slots.
+
+        :param heartbeat: True to start the heartbeat thread.
+        """
+        print('running with python %d.%d.%d' % (sys.version_info[:3]))
+        print('running %d (+%d interactive) worker slot(s) using %s '
+              'executor' % (self._nb_slots, self._nb_interactive_slots,
+                            'process' if self._pool else 'thread'))
+        # the client waits for the readiness message to connect
+        sys.stdout.flush()
+        self._slots = []
+        for i in range(self._nb_slots + self._nb_interactive_slots):
+            if i < self._nb_slots:
+                max_priority = None
+                name = 'worker-slot-%d' % i
             else:
-                data = bytes()
-            while len(data) < size:
-                tmp = self.request.recv(size - len(data))
-                data += tmp
-                if tmp == '':
-                    raise RuntimeError("socket connection broken")
-            return data
+                max_priority = PRIORITY_INTERACTIVE
+                name = 'interactive-worker-slot-%d' % (i - self._nb_slots)
+            slot = threading.Thread(target=self._run_slot, name=name,
+                                    args=(max_priority,))
+            slot.daemon = True
+            slot.start()
+            self._slots.append(slot)
+        if heartbeat:
+            self._heartbeat_thread = threading.Thread(target=self.heartbeat)
+            self._heartbeat_thread.daemon = True
+            self._heartbeat_thread.start()
+
+    def close_engine(self):
+        """
+        Releases the process pool and the workers.
+        """
+        if self._pool is not None:
+            self._pool.shutdown(wait=False)
+        worker_registry.shutdown()
+        worker_profiler.dump()
+        self._stopped.set()
 
-        def get_msg_len(self):
-            """ Gets message len """
-            data = self.read_bytes(4)
-            payload = struct.unpack('=I', data)
-            return payload[0]
+    def submit(self, handler, data, size=0):
+        """
+        Queues a request, the request will be run by the first available
+        worker slot and its results will be sent using ``handler``.
 
-        def read(self):
-            """ Reads a json string from socket and load it. """
-            size = self.get_msg_len()
-            data = self.read_bytes(size).decode('utf-8')
-            return json.loads(data)
+        :param handler: the client connection.
+        :param data: the request.
+        :param size: size of the request frame, for the metrics.
+        """
+        worker = data['worker']
+        self.metrics.increment(worker, 'calls')
+        self.metrics.increment(worker, 'request_bytes', size)
+        if worker in INLINE_WORKERS:
+            self.metrics.increment(worker, 'response_bytes', handler.respond(
+                data['request_id'], execute_worker(worker, data['data'])))
+            return
+        priority = int(data.get('priority', PRIORITY_NORMAL))
+        group = data.get('group')
+        if group is not None:
+            # the new request supersedes the previous requests of its group
+            with self._tokens_lock:
+                superseded = [
+                    key[1] for key, (_, grp) in self._tokens.items()
+                    if key[0] is handler and grp == group]
+            for request_id in superseded:
+                self.cancel(handler, request_id)
+        cache_key = None
+        if self.result_cache is not None and data.get('cache', False):
+            cache_key = ResultCache.key(
+                data['worker'], data['data'],
+                (data.get('document') or {}).get('path'))
+            found, results = self.result_cache.get(cache_key)
+            if found:
+                _logger().log(1, 'cache hit for request %s',
+                              data['request_id'])
+                self.metrics.increment(worker, 'cache_hits')
+                self.metrics.increment(worker, 'response_bytes',
+                                       handler.respond(data['request_id'],
+                                                       results))
+                return
+        token = CancellationToken()
+        with self._tokens_lock:
+            self._tokens[(handler, data['request_id'])] = (token, group)
+        self._requests.put(priority, (handler, data, token, cache_key,
+                                      time.monotonic()))
+
+    def cancel(self, handler, request_id):
+        """
+        Cancels a request. A queued request is removed from the queue and
+        answered immediately, a running request is notified and will be
+        answered as soon as its worker returns.
 
-        def send(self, obj):
-            """
-            Sends a python obj as a json string on the socket.
+        :param handler: the client connection.
+        :param request_id: id of the request to cancel.
+        """
+        with self._tokens_lock:
+            try:
+                token, _ = self._tokens[(handler, request_id)]
+            except KeyError:
+                # already finished or unknown request
+                return
+        token.cancel()
+        removed = self._requests.remove(
+            lambda item: item[0] is handler and
+            item[1]['request_id'] == request_id)
+        if removed:
+            _logger().log(1, 'dropping cancelled request %s', request_id)
+            with self._tokens_lock:
+                self._tokens.pop((handler, request_id), None)
+            worker = removed[0][1]['worker']
+            self.metrics.increment(worker, 'cancelled')
+            self.metrics.increment(worker, 'response_bytes', handler.respond(
+                request_id, [], cancelled=True))
+
+    def cancel_all(self, handler):
+        """
+        Cancels all the requests of a client connection (used when the
+        client disconnects).
+        """
+        with self._tokens_lock:
+            tokens = [token for key, (token, _) in self._tokens.items()
+                      if key[0] is handler]
+        for token in tokens:
+            token.cancel()
+        self._requests.remove(lambda item: item[0] is handler)
+        with self._tokens_lock:
+            for key in list(self._tokens.keys()):
+                if key[0] is handler:
+                    self._tokens.pop(key)
+
+    def _run_slot(self, max_priority=None):
+        """
+        Worker slot: runs the queued requests one after the other, highest
+        priority first.
 
-            :param obj: The object to send, must be Json serializable.
-            """
-            msg = json.dumps(obj).encode('utf-8')
-            _logger().log(1, 'sending %d bytes for the payload', len(msg))
-            header = struct.pack('=I', len(msg))
-            self.request.sendall(header)
-            self.request.sendall(msg)
+        :param max_priority: lowest priority (highest value) accepted by the
+            slot, None to accept all requests.
+        """
+        while True:
+            handler, data, token, cache_key, queued_at = self._requests.get(
+                max_priority)
+            worker = data['worker']
+            started_at = time.monotonic()
+            self.metrics.observe(worker, 'queue', started_at - queued_at)
+            with self._nb_running_lock:
+                self._nb_running += 1
+            failed = False
+            # cancelled while queued
+            skipped = token.cancelled
+            profile = self.profile or data.get('profile', False)
+            # sizes of the chunks sent by a streaming worker
+            streamed = []
+            try:
+                if skipped:
+                    results = []
+                elif self._pool is not None:
+                    # generators can't cross the process boundary, their
+                    # items are sent at once
+                    if profile:
+                        # the statistics are collected in the child process
+                        results, raw_stats = self._pool.submit(
+                            run_profiled, execute_worker, worker,
+                            data['data'], data.get('document')).result()
+                        worker_profiler.add(worker, raw_stats)
+                    else:
+                        results = self._pool.submit(
+                            execute_worker, worker, data['data'],
+                            data.get('document')).result()
+                else:
+                    on_chunk = None
+                    if data.get('stream', False):
+                        def send_chunk(items, request_id=data['request_id']):
+                            streamed.append(
+                                handler.send_chunk(request_id, items))
+                        on_chunk = send_chunk
+                    with token:
+                        if profile:
+                            results, raw_stats = run_profiled(
+                                execute_worker, worker, data['data'],
+                                data.get('document'), on_chunk)
+                            worker_profiler.add(worker, raw_stats)
+                        else:
+                            results = execute_worker(
+                                worker, data['data'], data.get('document'),
+                                on_chunk)
+            except Exception:
+                _logger().exception('failed to run request %r', data)
+                results = []
+                failed = True
+            finally:
+                with self._nb_running_lock:
+                    self._nb_running -= 1
+            if not skipped:
+                self.metrics.observe(worker, 'execution',
+                                     time.monotonic() - started_at)
+            with self._tokens_lock:
+                self._tokens.pop((handler, data['request_id']), None)
+            self.reset_heartbeat()
+            if (cache_key is not None and not failed and not streamed and
+                    not token.cancelled):
+                self.result_cache.put(cache_key, results)
+            if failed:
+                self.metrics.increment(worker, 'errors')
+            if token.cancelled:
+                self.metrics.increment(worker, 'cancelled')
+            self.metrics.increment(
+                worker, 'response_bytes', sum(streamed) + handler.respond(
+                    data['request_id'], results, cancelled=token.cancelled))
 
-        def handle(self):
+    def reset_heartbeat(self):
+        self.last_time = time.time()
+        self.elapsed_time = 0
+
+    def heartbeat(self):
+        """
+        Shuts the server down if no message has been received during
+        ``timeout`` seconds (the client sends keepalive messages when it
+        has nothing else to send).
+
+        The thread sleeps until the deadline instead of polling: every
+        message simply moves the deadline.
+        """
+        while not self._stopped.is_set():
+            remaining = self.heartbeat_remaining()
+            if remaining <= 0:
+                self.shutdown()
+                sys.exit(1)
+            self._stopped.wait(remaining)
+
+    def heartbeat_remaining(self):
+        """
+        Returns the number of seconds left before the heartbeat deadline
+        (0 or less if the deadline has passed).
+        """
+        # make sure to have enough time to handle the running requests
+        timeout = self.timeout * 10 if self._nb_running else self.timeout
+        remaining = self.last_time + timeout - time.time()
+        if remaining <= 0:
+            _logger().info('no heartbeat during %ds, shutting down', timeout)
+        return remaining
+
+    def watch_stdin(self):
+        """
+        Shuts the server down as soon as its standard input is closed.
+
+        When the server is started by :class:`pyqode.core.api.BackendProcess`,
+        its stdin is a pipe that is closed by the OS when the client process
+        exits (even if it crashed). Watching this pipe detects a dead client
+        much sooner than the heartbeat, without any traffic.
+
+        Nothing is done if stdin is not a pipe (e.g. a terminal) or if stdin
+        is the data channel (stdio transport).
+        """
+        if self.transport == 'stdio':
+            return
+        try:
+            fd = sys.stdin.fileno()
+            if not stat.S_ISFIFO(os.fstat(fd).st_mode):
+                return
+        except (AttributeError, ValueError, OSError):
+            return
+
+        def watch():
+            try:
+                while os.read(fd, 4096):
+                    pass
+            except OSError:
+                pass
+            if not self._stopped.is_set():
+                _logger().info('stdin closed, shutting down')
+                self.shutdown()
+
+        thread = threading.Thread(target=watch, name='stdin-watcher')
+        thread.daemon = True
+        thread.start()
+
+
+class JsonServer(RequestEngine, socketserver.ThreadingMixIn,
+                 socketserver.TCPServer):
+    """
+    A server socket based on a json messaging system.
+
+    The server listens on a local tcp port (default), on a unix domain
+    socket or, with the stdio transport, serves one single client through its
+    standard input/output (see the ``--transport`` option of
+    :func:`default_parser`).
+
+    Client connections are persistent: a client connects once and sends all
+    its requests through the same connection. Each connection is served by
+    its own thread, the responses are tagged with the id of the request they
+    answer. The messages are json frames until the client negotiates a more
+    compact framing (marshal encoding, compression of the large payloads),
+    see :mod:`pyqode.core.backend.protocol`.
+
+    The workers are resolved through the
+    :class:`pyqode.core.backend.registry.WorkerRegistry`: a worker class is
+    instantiated once and the same instance serves all the requests (see the
+    ``--preload`` option to load some workers when the server starts).
+
+    The requests are put in a queue and run by a fixed number of worker slots,
+    independent requests can thus run in parallel. A worker slot runs the
+    worker in a thread or, to use several cores for CPU bound workers, in a
+    process of a process pool (see the ``--workers`` and ``--executor``
+    options of :func:`default_parser`).
+
+    The queue is ordered by request priority: interactive requests are always
+    run before the queued background requests. On top of the regular worker
+    slots, the server has some slots reserved to the interactive requests
+    (see ``--interactive-slots``) so that a long running background request
+    never delays the interactive ones.
+
+    The server keeps a copy of the client documents in a
+    :class:`pyqode.core.backend.documents.DocumentStore`, updated from the
+    document messages sent by the client. A request that refers to a
+    document (instead of embedding its text) gets the document text from the
+    store, in the request data key chosen by the client.
+
+    Requests can be cancelled by the client. A request that belongs to a
+    group (e.g. the checker requests of a given editor) also cancels the
+    previous requests of the same group. Cancelled requests are dropped from
+    the queue, running workers are notified through
+    :func:`pyqode.core.backend.workers.is_cancelled`.
+
+    A worker can be a generator: if the client asked for the results to be
+    streamed, the items are sent by chunks, as soon as they are produced (the
+    final response then has empty results), otherwise all the items are sent
+    at once.
+
+    The results of the requests can be memoized in a
+    :class:`pyqode.core.backend.cache.ResultCache` (see the
+    ``--result-cache`` option): a request that opts in and that has the same
+    worker, document content and arguments as a previous request is answered
+    immediately, without running the worker.
+
+    .. note:: With more than one worker slot, your workers must be thread
+        safe (or process safe with the process executor): the same worker
+        instance might run several requests at once. When using the
+        process executor, the workers are run in child processes: the
+        configuration of your workers (e.g. completion providers) must be
+        done at the module level of your server script if the child
+        processes are spawned instead of forked (Windows, macOS).
+    """
+    #: Don't wait for the connection threads when shutting down the server.
+    daemon_threads = True
+
+    class _Handler(ClientConnection, socketserver.BaseRequestHandler):
+        def setup(self):
+            self.setup_connection()
+
+        def read(self):
             """
-            Hanlde the request and keep it alive while shutdown signal
-            has not been received
+            Reads the next message sent by the client (blocks until a
+            complete frame has been received).
             """
-            self.srv.reset_heartbeat()
-            # make sure to have enough time to handle the request
-            self.srv.timeout = HEARTBEAT_DELAY * 10
-            data = self.read()
-            self._handle(data)
-            self.srv.timeout = HEARTBEAT_DELAY
-            self.srv.reset_heartbeat()
-
-        def _handle(self, data):
+            while True:
+                obj = self._reader.read_frame()
+                if obj is not None:
+                    return obj
+                data = self.request.recv(RECV_BUFFER_SIZE)
+                if not data:
+                    raise RuntimeError("socket connection broken")
+                self._reader.feed(data)
+
+        def write(self, frame):
+            self.request.sendall(frame)
+
+        def handle(self):
             """
-            Handles a work request.
+            Handle the requests of a client connection until the client
+            disconnects.
             """
-            try:
-                _logger().log(1, 'handling request %r', data)
-                assert data['worker']
-                assert data['request_id']
-                assert data['data'] is not None
-                response = {'request_id': data['request_id'], 'results': []}
+            while True:
                 try:
-                    worker = import_class(data['worker'])
-                except ImportError:
-                    _logger().exception('Failed to import worker class')
-                else:
-                    if inspect.isclass(worker):
-                        worker = worker()
-                    _logger().log(1, 'worker: %r', worker)
-                    _logger().log(1, 'data: %r', data['data'])
-                    try:
-                        ret_val = worker(data['data'])
-                    except Exception:
-                        _logger().exception(
-                            'something went bad with worker %r(data=%r)',
-                            worker, data['data'])
-                        ret_val = None
-                    if ret_val is None:
-                        ret_val = []
-                    response = {'request_id': data['request_id'],
-                                'results': ret_val}
-                finally:
-                    _logger().log(1, 'sending response: %r', response)
-                    try:
-                        self.send(response)
-                    except ConnectionAbortedError:
-                        pass
-            except:
-                _logger().warn('error with data=%r', data)
-                exc1, exc2, exc3 = sys.exc_info()
-                traceback.print_exception(exc1, exc2, exc3, file=sys.stderr)
+                    data = self.read()
+                except (RuntimeError, OSError):
+                    _logger().log(1, 'client disconnected')
+                    break
+                self.dispatch(data)
+            self.srv.cancel_all(self)
 
     def __init__(self, args=None):
         """
@@ -160,31 +769,78 @@ class JsonServer(socketserver.TCPServer):
             use its own argument parser (using
             :meth:`pyqode.core.backend.default_parser`)
         """
-        self.reset_heartbeat()
         if not args:
             args = default_parser().parse_args()
-        self.port = args.port
-        self.timeout = HEARTBEAT_DELAY
+        self.setup_engine(args)
         self._Handler.srv = self
-        socketserver.TCPServer.__init__(
-            self, ('127.0.0.1', int(args.port)), self._Handler)
-        print('started on 127.0.0.1:%d' % int(args.port))
-        print('running with python %d.%d.%d' % (sys.version_info[:3]))
-        self._heartbeat_thread = threading.Thread(target=self.heartbeat)
-        self._heartbeat_thread.setDaemon(True)
-        self._heartbeat_thread.start()
+        if self.transport == 'stdio':
+            self._pipe = _PipeConnection(*_redirect_stdout())
+            print('started on stdio')
+        elif self.transport == 'unix':
+            self.address_family = socket.AF_UNIX
+            _remove_stale_socket(args.port)
+            socketserver.TCPServer.__init__(self, args.port, self._Handler)
+            # only the current user may connect (marshal framing)
+            os.chmod(args.port, 0o600)
+            print('started on unix:%s' % args.port)
+        else:
+            socketserver.TCPServer.__init__(
+                self, ('127.0.0.1', int(args.port)), self._Handler)
+            print('started on 127.0.0.1:%d' % int(args.port))
+        self.start_engine()
+
+    def serve_forever(self, poll_interval=0.5):
+        if self.transport != 'stdio':
+            socketserver.TCPServer.serve_forever(self, poll_interval)
+            return
+        # one single client, served until stdin is closed
+        thread = threading.Thread(target=self._serve_pipe,
+                                  name='stdio-handler')
+        thread.daemon = True
+        thread.start()
+        self._stopped.wait()
+
+    def _serve_pipe(self):
+        try:
+            self._Handler(self._pipe, 'stdio', self)
+        finally:
+            self._stopped.set()
+
+    def shutdown(self):
+        if self.transport == 'stdio':
+            self._stopped.set()
+        else:
+            socketserver.TCPServer.shutdown(self)
+
+    def server_close(self):
+        if self.transport != 'stdio':
+            socketserver.TCPServer.server_close(self)
+        if self.transport == 'unix':
+            try:
+                os.remove(self.port)
+            except OSError:
+                pass
+        self.close_engine()
 
-    def reset_heartbeat(self):
-        self.last_time = time.time()
-        self.elapsed_time = 0
 
-    def heartbeat(self):
-        while True:
-            elapsed_time = time.time() - self.last_time
-            if elapsed_time > self.timeout:
-                self.shutdown()
-                sys.exit(1)
-            time.sleep(1)
+def _redirect_stdout():
+    """
+    Prepares the stdio transport: stdout becomes the data channel and
+    everything else written on stdout (e.g. print statements) goes to
+    stderr.
+
+    :returns: the file descriptors of the data channel (read, write).
+    """
+    sys.stdout.flush()
+    write_fd = os.dup(sys.stdout.fileno())
+    os.dup2(sys.stderr.fileno(), sys.stdout.fileno())
+    return sys.stdin.fileno(), write_fd
+
+
+def _remove_stale_socket(path):
+    """ Removes the unix socket left by a previous server """
+    if os.path.exists(path):
+        os.remove(path)
 
 
 def default_parser():
@@ -192,15 +848,77 @@ def default_parser():
     Configures and return the default argument parser. You should use this
     parser as a base if you want to add custom arguments.
 
-    The default parser only has one argument, the tcp port used to start the
-    server socket. *(CodeEdit picks up a free port and use it to run
+    The default parser has one positional argument, the tcp port used to
+    start the server socket. *(CodeEdit picks up a free port and use it to run
     the server and connect its client socket)*
 
+    The following options can be used to configure the server:
+
+        - ``--transport``: ``tcp`` (default), ``unix`` to listen on a unix
+          domain socket (the positional argument is then the socket path) or
+          ``stdio`` to serve the client through the standard input/output of
+          the server process (the positional argument is ignored).
+        - ``--workers``: the number of worker slots, i.e. the number of
+          requests that can run concurrently (default is 1).
+        - ``--executor``: ``thread`` to run the workers in threads (default),
+          ``process`` to run them in a pool of processes.
+        - ``--interactive-slots``: the number of additional worker slots
+          reserved to the interactive requests (default is 1).
+        - ``--preload``: fully qualified name of a worker to load (and
+          instantiate) when the server starts, can be repeated.
+        - ``--result-cache``: size (in MB) of the cache of the results of the
+          requests that opt in, 0 to disable the cache (default).
+        - ``--server``: ``threading`` to serve each client connection in
+          its own thread (default, :class:`JsonServer`), ``asyncio`` to
+          serve all the connections from one event loop (see
+          :class:`pyqode.core.backend.async_server.AsyncJsonServer`).
+        - ``--profile``: run all the workers under the profiler (the
+          requests can also opt in individually), see
+          :mod:`pyqode.core.backend.profiler`.
+        - ``--profile-dir``: directory where the profile statistics of each
+          worker are written.
+        - ``--zygote``: run a zygote instead of a server: the workers are
+          loaded once and a new server is forked each time the client asks
+          for one (POSIX only, see :mod:`pyqode.core.backend.zygote`). The
+          positional argument is ignored.
+
     :returns: The default server argument parser.
     """
     parser = argparse.ArgumentParser()
     parser.add_argument("port", help="the local tcp port to use to run "
-                        "the server")
+                        "the server (the socket path with the unix "
+                        "transport, ignored with the stdio transport)")
+    parser.add_argument("--transport", choices=['tcp', 'unix', 'stdio'],
+                        default='tcp', help="listen on a tcp port, on a unix "
+                        "domain socket or serve one client through "
+                        "stdin/stdout")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="number of worker slots (concurrent requests)")
+    parser.add_argument("--executor", choices=['thread', 'process'],
+                        default='thread', help="run the workers in threads "
+                        "or in a pool of processes")
+    parser.add_argument("--interactive-slots", type=int, default=1,
+                        help="number of additional worker slots reserved to "
+                        "interactive requests")
+    parser.add_argument("--preload", action='append', default=[],
+                        metavar='WORKER', help="fully qualified name of a "
+                        "worker to load when the server starts (can be "
+                        "repeated)")
+    parser.add_argument("--result-cache", type=int, default=0, metavar='MB',
+                        help="size of the results cache in MB (0 to "
+                        "disable it)")
+    parser.add_argument("--server", choices=['threading', 'asyncio'],
+                        default='threading', help="serve each client "
+                        "connection in a thread or all of them from an "
+                        "asyncio event loop")
+    parser.add_argument("--profile", action='store_true',
+                        help="profile the workers")
+    parser.add_argument("--profile-dir", metavar='DIR', help="directory "
+                        "where the profile statistics of each worker are "
+                        "written")
+    parser.add_argument("--zygote", action='store_true',
+                        help="fork the servers requested on stdin from a "
+                        "process that has already loaded the workers")
     return parser
 
 
@@ -215,9 +933,21 @@ def serve_forever(args=None):
     class Unbuffered:
         def __init__(self, stream):
             self.stream = stream
+            self._tail = ''
 
         def write(self, data):
-            self.stream.write(data)
+            # writing complete lines only: the lines written by the
+            # processes that share the stream are not interleaved
+            data = self._tail + data
+            lines, sep, self._tail = data.rpartition('\n')
+            if sep:
+                self.stream.write(lines + sep)
+                self.stream.flush()
+
+        def flush(self):
+            if self._tail:
+                self.stream.write(self._tail)
+                self._tail = ''
             self.stream.flush()
 
         def __getattr__(self, attr):
@@ -226,8 +956,31 @@ def serve_forever(args=None):
     sys.stdout = Unbuffered(sys.stdout)
     sys.stderr = Unbuffered(sys.stderr)
 
-    server = JsonServer(args=args)
-    server.serve_forever()
+    if not args:
+        args = default_parser().parse_args()
+    if getattr(args, 'zygote', False):
+        serve_zygote(args, _serve)
+    else:
+        _serve(args)
+
+
+def _serve(args):
+    """ Creates a server and serves until it is shut down """
+    server_class = JsonServer
+    if getattr(args, 'server', 'threading') == 'asyncio':
+        if args.transport == 'stdio' and sys.platform == 'win32':
+            _logger().warning('the asyncio server does not support the '
+                              'stdio transport on Windows, using the '
+                              'threading server')
+        else:
+            from pyqodeng.core.backend.async_server import AsyncJsonServer
+            server_class = AsyncJsonServer
+    server = server_class(args=args)
+    server.watch_stdin()
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
 
 
 # Server script example
@@ -9,18 +9,241 @@ response object (json serializable).
 A worker is always tightly coupled with its caller, so are the data.
 
 .. warning::
-    This module should keep its dependencies as low as possible and fully
-    supports python2 syntax. This is badly needed since the server might be run
-    with a python2 interpreter. We don't want to force the user to install all
-    the pyqode dependencies twice (if the user choose to run the server with
-    python2, which might happen in pyqode.python to support python2 syntax).
+    This module should keep its dependencies as low as possible (the standard
+    library only) since the server might be run with another interpreter than
+    the client. We don't want to force the user to install all the pyqode
+    dependencies twice. The server requires python 3.
 
 """
+import bisect
+import collections
 import logging
 import re
 import sys
+import threading
+import time
 import traceback
 
+from pyqodeng.core.backend.completion import CompletionIndex
+
+
+def _logger():
+    """ Returns the module's logger """
+    return logging.getLogger(__name__)
+
+
+#: Per thread data, used to store the cancellation token and the document of
+#: the request being run by a worker slot of the server.
+_thread_data = threading.local()
+
+
+class CancellationToken(object):
+    """
+    Token used to cancel a request that is queued or running.
+
+    Cancellation is cooperative: a queued request is simply dropped by the
+    server but a running worker must poll :func:`is_cancelled` and stop as
+    soon as possible.
+
+    The server uses the token as a context manager while the worker runs::
+
+        with token:
+            worker(data)
+    """
+    def __init__(self):
+        self._event = threading.Event()
+
+    def __enter__(self):
+        _thread_data.token = self
+        return self
+
+    def __exit__(self, *args):
+        _thread_data.token = None
+
+    @property
+    def cancelled(self):
+        """ True if the request has been cancelled """
+        return self._event.is_set()
+
+    def cancel(self):
+        """ Cancels the request """
+        self._event.set()
+
+
+def is_cancelled():
+    """
+    Tells whether the request run by the current worker has been cancelled
+    (either explicitly by the client or because it has been superseded by a
+    newer request).
+
+    Long running workers should poll this function and return early when the
+    request has been cancelled, their results will be discarded anyway.
+
+    .. note:: This only works with the thread executor, the requests run in a
+        process pool are not notified of cancellation.
+    """
+    token = getattr(_thread_data, 'token', None)
+    return token is not None and token.cancelled
+
+
+def current_document():
+    """
+    Returns the document the request run by the current worker refers to, as
+    a dict with the following keys: 'id', 'version' and 'path'.
+
+    Workers that keep some per-document state (see
+    :class:`pyqode.core.backend.registry.WorkerRegistry`) can use the
+    document id as a key.
+
+    :returns: The document dict, None if the request does not refer to a
+        document (i.e. if the client embedded the text in the request data).
+    """
+    return getattr(_thread_data, 'document', None)
+
+
+class _Artifact(object):
+    """ An artifact being computed or computed, other workers wait for it """
+    def __init__(self):
+        self.ready = threading.Event()
+        self.failed = False
+        self.value = None
+
+
+class ArtifactCache(object):
+    """
+    Thread safe, per process cache of the artifacts computed from the text of
+    a document (syntax trees, token lists,...), shared by all the workers.
+
+    The artifacts are keyed by document revision: the first worker that
+    needs an artifact of a revision computes it, the other workers (the
+    checker and the outline workers of the same editor for example) reuse
+    it. When a request refers to a newer revision of a document, the
+    artifacts of the previous revision are evicted. The artifacts of a
+    closed document are dropped (see
+    :meth:`pyqode.core.backend.registry.WorkerRegistry.document_closed`).
+
+    For the requests that do not refer to a document (the text is embedded
+    in the request data), the artifacts are keyed by the text itself.
+
+    Workers should use :func:`document_artifact` rather than the cache
+    directly.
+
+    .. warning:: The artifacts are shared, workers must not modify them.
+    """
+    def __init__(self, max_documents=32):
+        """
+        :param max_documents: maximum number of documents (or texts) whose
+            artifacts are kept, the least recently used are evicted.
+        """
+        self._lock = threading.Lock()
+        #: document key -> (revision, {artifact name: _Artifact}), least
+        #: recently used first
+        self._entries = collections.OrderedDict()
+        self.max_documents = max_documents
+
+    def __len__(self):
+        with self._lock:
+            return len(self._entries)
+
+    def get(self, name, factory, text, document=None):
+        """
+        Gets an artifact of a document revision, the artifact is computed
+        by ``factory(text)`` if it is not in the cache.
+
+        If the factory raises an exception, the exception is propagated and
+        nothing is cached.
+
+        :param name: name of the artifact, e.g. ``'ast'``.
+        :param factory: callable that computes the artifact from the text.
+        :param text: the document text.
+        :param document: the document dict (see :func:`current_document`),
+            None to key the artifact by the text.
+        """
+        if document is not None:
+            key = document['id']
+            revision = document['version']
+        else:
+            key = ('text', hash(text))
+            revision = text
+        owner = False
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is not None and entry[0] != revision:
+                if document is not None and entry[0] > revision:
+                    # a late request for an older revision, the newer
+                    # artifacts are kept
+                    self._entries[key] = entry
+                    entry = None
+                else:
+                    entry = (revision, {})
+                    self._entries[key] = entry
+            else:
+                if entry is None:
+                    entry = (revision, {})
+                self._entries[key] = entry
+            while len(self._entries) > self.max_documents:
+                self._entries.popitem(last=False)
+            if entry is not None:
+                artifact = entry[1].get(name)
+                if artifact is None:
+                    artifact = entry[1][name] = _Artifact()
+                    owner = True
+        if entry is None:
+            return factory(text)
+        if owner:
+            try:
+                artifact.value = factory(text)
+            except BaseException:
+                artifact.failed = True
+                with self._lock:
+                    if entry[1].get(name) is artifact:
+                        del entry[1][name]
+                raise
+            finally:
+                artifact.ready.set()
+            return artifact.value
+        artifact.ready.wait()
+        if artifact.failed:
+            return factory(text)
+        return artifact.value
+
+    def discard(self, document_id):
+        """
+        Drops the artifacts of a document.
+
+        :param document_id: the document id.
+        """
+        with self._lock:
+            self._entries.pop(document_id, None)
+
+    def clear(self):
+        """ Drops all the artifacts. """
+        with self._lock:
+            self._entries.clear()
+
+
+#: The artifact cache of the current process.
+artifact_cache = ArtifactCache()
+
+
+def document_artifact(name, factory, text):
+    """
+    Returns an artifact computed from the text of the document of the
+    current request, the artifact is computed once per document revision and
+    shared by all the workers of the process (see :class:`ArtifactCache`)::
+
+        def outline_worker(data):
+            tree = document_artifact('ast', ast.parse, data['code'])
+            ...
+
+    :param name: name of the artifact, workers that use the same name must
+        use the same factory.
+    :param factory: callable that computes the artifact from the text.
+    :param text: the document text (from the request data).
+    :returns: the (shared, read only) artifact.
+    """
+    return artifact_cache.get(name, factory, text, current_document())
+
 
 def echo_worker(data):
     """
@@ -33,6 +256,66 @@ def echo_worker(data):
     return data
 
 
+class _ThreadPool(object):
+    """
+    Minimal bounded thread pool. The threads are started on demand and
+    reused.
+    """
+    def __init__(self, max_threads):
+        self.max_threads = max_threads
+        self._condition = threading.Condition()
+        self._tasks = collections.deque()
+        self._threads = []
+        self._idle = 0
+        self._closed = False
+
+    def submit(self, func, *args):
+        """
+        Runs ``func(*args)`` in a thread of the pool, the tasks are queued
+        while all the threads are busy.
+        """
+        with self._condition:
+            if self._closed:
+                raise RuntimeError('thread pool is shut down')
+            self._tasks.append((func, args))
+            if (len(self._tasks) > self._idle and
+                    len(self._threads) < self.max_threads):
+                thread = threading.Thread(target=self._run)
+                thread.daemon = True
+                self._threads.append(thread)
+                thread.start()
+            self._condition.notify()
+
+    def shutdown(self, timeout=1.0):
+        """
+        Drops the queued tasks and waits for the running ones, during
+        ``timeout`` seconds at most.
+        """
+        with self._condition:
+            self._closed = True
+            self._tasks.clear()
+            self._condition.notify_all()
+            threads = list(self._threads)
+        deadline = time.time() + timeout
+        for thread in threads:
+            thread.join(max(deadline - time.time(), 0))
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while not self._tasks and not self._closed:
+                    self._idle += 1
+                    self._condition.wait()
+                    self._idle -= 1
+                if self._closed:
+                    return
+                func, args = self._tasks.popleft()
+            try:
+                func(*args)
+            except Exception:
+                _logger().exception('task %r failed', func)
+
+
 class CodeCompletionWorker:
     """
     This is the worker associated with the code completion mode.
@@ -48,10 +331,38 @@ class CodeCompletionWorker:
 
         from pyqode.core.backend import CodeCompletionWorker
         CodeCompletionWorker.providers.insert(0, MyProvider())
+
+    If the request data has a ``'limit'`` key, the completions are ranked
+    for the completion prefix and only the best ``limit`` completions are
+    returned, starting at ``'offset'`` (see
+    :meth:`pyqode.core.backend.completion.CompletionIndex.search`). The
+    total number of matching completions is then appended to the request
+    context: ``[(line, column, request_id, total), completions]``.
+
+    If the request data has a ``'concurrent'`` key (set to true), all the
+    providers run concurrently instead of stopping at the first one that
+    returns, see :meth:`complete_concurrently`.
     """
     #: The list of code completion provider to run on each completion request.
     providers = []
 
+    #: Default time budget (in seconds) of a provider in concurrent mode, a
+    #: provider can define its own ``budget`` attribute.
+    provider_budget = 0.1
+
+    #: Maximum time (in seconds) the results of the late providers are
+    #: waited for in concurrent mode.
+    max_late_delay = 2.0
+
+    #: Maximum number of threads running the providers in concurrent mode,
+    #: the providers of a request are queued while all the threads are busy
+    #: (e.g. with late providers of the previous requests).
+    max_provider_threads = 8
+
+    #: Number of completion indexes kept (e.g. one per editor), an index is
+    #: reused as long as its provider returns the same completions.
+    max_indexes = 4
+
     class Provider:
         """
         This class describes the expected interface for code completion
@@ -64,6 +375,13 @@ class CodeCompletionWorker:
             def complete(self, code, line, column, path, encoding, prefix):
                 pass
 
+        Providers that keep some per-document state may also implement the
+        ``on_document_closed(document_id)`` hook (see
+        :class:`pyqode.core.backend.registry.WorkerRegistry`).
+
+        In concurrent mode, a provider may also have a ``budget`` attribute:
+        the time (in seconds) it is waited for before the first results are
+        sent (see :attr:`CodeCompletionWorker.provider_budget`).
         """
 
         def complete(self, code, line, column, path, encoding, prefix):
@@ -76,6 +394,9 @@ class CodeCompletionWorker:
                   inserted when the user select a completion in the list
                 - 'icon': an optional icon file name
                 - 'tooltip': an optional tooltip string
+                - 'count': an optional number of occurrences (or any weight),
+                  the completions with the highest count are ranked first
+                  among the completions that match the prefix equally well
 
             :param code: code string
             :param line: line number (0 based)
@@ -89,6 +410,13 @@ class CodeCompletionWorker:
             """
             raise NotImplementedError()
 
+    def __init__(self):
+        self._lock = threading.Lock()
+        #: indexes of the last completion lists, most recently used last
+        self._indexes = []
+        #: threads of the providers in concurrent mode, started on demand
+        self._pool = None
+
     def __call__(self, data):
         """
         Do the work (this will be called in the child process by the
@@ -101,27 +429,348 @@ class CodeCompletionWorker:
         encoding = data['encoding']
         prefix = data['prefix']
         req_id = data['request_id']
+        args = (code, line, column, path, encoding, prefix)
+        if data.get('concurrent', False):
+            return self.complete_concurrently(data, args)
         completions = []
         for prov in CodeCompletionWorker.providers:
-            try:
-                results = prov.complete(
-                    code, line, column, path, encoding, prefix)
+            if is_cancelled():
+                break
+            results = self._run_provider(prov, args)
+            if results is not None:
                 completions.append(results)
-                if len(completions):
+                break
+        if data.get('limit') is None:
+            return [(line, column, req_id)] + completions
+        if len(completions) == 1:
+            candidates = completions[0]
+        else:
+            candidates = [item for results in completions for item in results]
+        return self._page(candidates, data)
+
+    def complete_concurrently(self, data, args):
+        """
+        Runs all the providers concurrently, in a bounded pool of threads
+        (see :attr:`max_provider_threads`).
+
+        The providers are waited for until they return or until their time
+        budget expires. The completions of the providers that returned in
+        time are merged (in the providers order, the duplicate names are
+        dropped) and produced first. If the request data has a ``'stream'``
+        key (set to true), the completions of the late providers are then
+        produced as soon as they are available (minus the names that have
+        already been produced), during :attr:`max_late_delay` at most. The
+        completions of the late providers are dropped otherwise.
+
+        Each item has the same format as the results of a sequential request
+        (``[context, completions]``, the ``'limit'`` key applies to each
+        item), the items are streamed to the client if the request is
+        streamed (see :mod:`pyqode.core.backend`).
+
+        :param data: the request data.
+        :param args: arguments of the providers ``complete`` method.
+        :returns: a generator of ``[context, completions]`` items.
+        """
+        providers = list(CodeCompletionWorker.providers)
+        done = []
+        condition = threading.Condition()
+        document = current_document()
+        token = getattr(_thread_data, 'token', None)
+
+        def run(i, provider):
+            # the providers can check is_cancelled and current_document
+            _thread_data.document = document
+            _thread_data.token = token
+            try:
+                results = self._run_provider(provider, args)
+            finally:
+                _thread_data.document = None
+                _thread_data.token = None
+            with condition:
+                done.append((i, results))
+                condition.notify()
+
+        with self._lock:
+            if self._pool is None:
+                self._pool = _ThreadPool(self.max_provider_threads)
+            pool = self._pool
+        start = time.time()
+        deadlines = [start + getattr(provider, 'budget', self.provider_budget)
+                     for provider in providers]
+        for i, provider in enumerate(providers):
+            pool.submit(run, i, provider)
+        pending = set(range(len(providers)))
+        received = {}
+        with condition:
+            while True:
+                for i, results in done:
+                    received[i] = results
+                    pending.discard(i)
+                del done[:]
+                remaining = max([deadlines[i] for i in pending] or [0]) - \
+                    time.time()
+                if remaining <= 0 or is_cancelled():
                     break
-            except:
-                sys.stderr.write('Failed to get completions from provider %r'
-                                 % prov)
-                exc1, exc2, exc3 = sys.exc_info()
-                traceback.print_exception(exc1, exc2, exc3, file=sys.stderr)
-        return [(line, column, req_id)] + completions
+                condition.wait(remaining)
+        seen = set()
+        yield self._page(self._merge(
+            [received[i] for i in sorted(received)], seen), data)
+        if not pending or not data.get('stream', False):
+            return
+        late_deadline = time.time() + self.max_late_delay
+        while (pending and not is_cancelled() and
+               time.time() < late_deadline):
+            with condition:
+                if not done:
+                    # poll, cancellation is not notified
+                    condition.wait(0.05)
+                items = done[:]
+                del done[:]
+            for i, results in items:
+                pending.discard(i)
+                completions = self._merge([results], seen)
+                if completions:
+                    yield self._page(completions, data)
+
+    @staticmethod
+    def _run_provider(provider, args):
+        """
+        Returns the completions of a provider, None if the provider failed.
+        """
+        try:
+            return provider.complete(*args)
+        except:
+            sys.stderr.write('Failed to get completions from provider %r'
+                             % provider)
+            exc1, exc2, exc3 = sys.exc_info()
+            traceback.print_exception(exc1, exc2, exc3, file=sys.stderr)
+            return None
+
+    @staticmethod
+    def _merge(results, seen):
+        """
+        Merges lists of completions, drops the names that are in seen (which
+        is updated).
+        """
+        completions = []
+        for items in results:
+            if items is None:
+                continue
+            for completion in items:
+                name = completion['name']
+                if name not in seen:
+                    seen.add(name)
+                    completions.append(completion)
+        return completions
+
+    def _page(self, candidates, data):
+        """
+        Returns ``[context, completions]``: all the candidates, or the best
+        ones for the prefix if the request data has a ``'limit'`` key.
+        """
+        context = (data['line'], data['column'], data['request_id'])
+        limit = data.get('limit')
+        if limit is None:
+            return [context, candidates]
+        completions, total = self._index(candidates).search(
+            data['prefix'], limit, data.get('offset', 0),
+            data.get('case_sensitive', False))
+        return [context + (total,), completions]
+
+    def _index(self, candidates):
+        """
+        Returns the index of a list of completions, the index of the previous
+        requests is reused if the completions did not change.
+        """
+        with self._lock:
+            indexes = self._indexes
+            for i, index in enumerate(indexes):
+                if (index.completions is candidates or
+                        index.completions == candidates):
+                    break
+            else:
+                index = CompletionIndex(candidates)
+                i = len(indexes)
+                indexes.append(index)
+            # most recently used last
+            indexes.append(indexes.pop(i))
+            del indexes[:-self.max_indexes]
+            return index
+
+    def shutdown(self):
+        """
+        Stops the threads of the providers (see :meth:`complete_concurrently`).
+        """
+        with self._lock:
+            pool = self._pool
+            self._pool = None
+        if pool is not None:
+            pool.shutdown()
+
+    def on_document_closed(self, document_id):
+        """
+        Forwards the ``on_document_closed`` hook to the providers.
+        """
+        for prov in CodeCompletionWorker.providers:
+            method = getattr(prov, 'on_document_closed', None)
+            if method is not None:
+                method(document_id)
+
+
+class WordIndex(object):
+    """
+    Index of the words of a document, with their number of occurrences.
+
+    The index is updated incrementally: :meth:`update` only tokenizes the
+    region of the text that changed since the previous update. The region
+    is found by comparing the new text with the previous one from both ends,
+    by blocks, so that an update costs O(changed text) python operations.
+    The ranked completions are kept sorted as well, only the words whose
+    number of occurrences changed are moved.
+    """
+    #: Size (in characters) of the first blocks compared when looking for
+    #: the changed region.
+    BLOCK_SIZE = 4096
+
+    def __init__(self, separators):
+        """
+        :param separators: list of word separators (single characters).
+        """
+        separators = [sep for sep in separators if sep]
+        self._separators = frozenset(separators)
+        self._pattern = re.compile(
+            '[^%s]+' % ''.join(re.escape(sep) for sep in separators))
+        #: the indexed text
+        self.text = ''
+        #: number of occurrences of each word
+        self.counts = {}
+        #: completion dicts, most frequent words first, and their sort keys
+        self._ranked = []
+        self._keys = []
+        self._completions = None
+
+    def update(self, text):
+        """
+        Updates the index with a new version of the text.
+
+        :param text: the new text.
+        """
+        old = self.text
+        if text == old:
+            return
+        start, old_end, new_end = self._changed_region(old, text)
+        # word -> number of occurrences before the update
+        changed = {}
+        self._remove_words(old[start:old_end], changed)
+        self._add_words(text[start:new_end], changed)
+        self._rank(changed)
+        self.text = text
+
+    def completions(self):
+        """
+        Returns the words as a list of completion dicts with their number of
+        occurrences (``'count'`` key), the most frequent words first. The
+        same list is returned as long as the counts do not change.
+        """
+        if self._completions is None:
+            self._completions = list(self._ranked)
+        return self._completions
+
+    def _rank(self, changed):
+        """
+        Moves the completions of the words whose number of occurrences
+        changed.
+
+        :param changed: word -> number of occurrences before the update.
+        """
+        keys = self._keys
+        ranked = self._ranked
+        for word, old_count in changed.items():
+            count = self.counts.get(word, 0)
+            if count == old_count:
+                continue
+            if old_count:
+                i = bisect.bisect_left(keys, (-old_count, word))
+                del keys[i]
+                del ranked[i]
+            if count:
+                key = (-count, word)
+                i = bisect.bisect_left(keys, key)
+                keys.insert(i, key)
+                ranked.insert(i, {'name': word, 'count': count})
+            self._completions = None
+
+    def _changed_region(self, old, new):
+        """
+        Returns the changed region (start, end in the old text, end in the
+        new text), extended to the word boundaries.
+        """
+        size = min(len(old), len(new))
+        prefix = 0
+        block = self.BLOCK_SIZE
+        while block:
+            while (prefix + block <= size and
+                   old[prefix:prefix + block] == new[prefix:prefix + block]):
+                prefix += block
+            block //= 2
+        limit = size - prefix
+        suffix = 0
+        block = self.BLOCK_SIZE
+        while block:
+            while (suffix + block <= limit and
+                   old[len(old) - suffix - block:len(old) - suffix] ==
+                   new[len(new) - suffix - block:len(new) - suffix]):
+                suffix += block
+            block //= 2
+        # the unchanged parts are identical in both texts, the region is
+        # extended to the enclosing words in both texts at once.
+        start = prefix
+        while start > 0 and old[start - 1] not in self._separators:
+            start -= 1
+        old_end = len(old) - suffix
+        new_end = len(new) - suffix
+        while old_end < len(old) and old[old_end] not in self._separators:
+            old_end += 1
+            new_end += 1
+        return start, old_end, new_end
+
+    def _tokens(self, text):
+        for match in self._pattern.finditer(text):
+            word = match.group()
+            if word.replace('_', '').isalpha():
+                yield word
+
+    def _add_words(self, text, changed):
+        for word in self._tokens(text):
+            count = self.counts.get(word, 0)
+            changed.setdefault(word, count)
+            self.counts[word] = count + 1
+
+    def _remove_words(self, text, changed):
+        for word in self._tokens(text):
+            count = self.counts[word]
+            changed.setdefault(word, count)
+            if count > 1:
+                self.counts[word] = count - 1
+            else:
+                del self.counts[word]
 
 
 class DocumentWordsProvider:
     """
-    Provides completions based on the document words
+    Provides completions based on the document words.
+
+    The provider keeps a :class:`WordIndex` per document (see
+    :func:`current_document`), only the text that changed since the previous
+    request is tokenized. The text of the requests that do not refer to a
+    document is tokenized entirely, each time.
+
+    The words are ranked by number of occurrences (see
+    :meth:`WordIndex.completions`).
     """
-    words = {}
+    #: Maximum number of indexed documents, the least recently used indexes
+    #: are dropped.
+    max_documents = 32
 
     # word separators
     separators = [
@@ -130,6 +779,11 @@ class DocumentWordsProvider:
         ']', '\\', '\n', '\t', '=', '-', ' '
     ]
 
+    def __init__(self):
+        self._lock = threading.Lock()
+        #: document key -> WordIndex, least recently used first
+        self._indexes = collections.OrderedDict()
+
     @staticmethod
     def split(txt, seps):
         """
@@ -155,17 +809,42 @@ class DocumentWordsProvider:
                 words.add(word)
         return sorted(words)
 
+    def _index(self, code, key):
+        """
+        Updates the word index of a document and returns it (must be called
+        with the lock held).
+        """
+        index = self._indexes.pop(key, None)
+        if index is None:
+            index = WordIndex(self.separators)
+        self._indexes[key] = index
+        while len(self._indexes) > self.max_documents:
+            self._indexes.popitem(last=False)
+        index.update(code)
+        return index
+
     def complete(self, code, *args):
         """
         Provides completions based on the document words.
 
         :param code: code to complete
-        :param args: additional (unused) arguments.
+        :param args: additional arguments (line, column, path, encoding,
+            prefix), unused.
         """
-        completions = []
-        for word in self.split(code, self.separators):
-            completions.append({'name': word})
-        return completions
+        document = current_document()
+        if document is None:
+            index = WordIndex(self.separators)
+            index.update(code)
+            return index.completions()
+        with self._lock:
+            return self._index(code, document['id']).completions()
+
+    def on_document_closed(self, document_id):
+        """
+        Drops the index of a closed document.
+        """
+        with self._lock:
+            self._indexes.pop(document_id, None)
 
 
 def finditer_noregex(string, sub, whole_word):
@@ -241,6 +920,26 @@ def findall(data):
         }
     :return: list of occurrence positions in text
     """
-    return list(findalliter(
+    occurrences = []
+    for i, occurrence in enumerate(findalliter(
+            data['string'], data['sub'], regex=data['regex'],
+            whole_word=data['whole_word'],
+            case_sensitive=data['case_sensitive'])):
+        if not i % 1000 and is_cancelled():
+            # superseded by a newer search
+            break
+        occurrences.append(occurrence)
+    return occurrences
+
+
+def findall_stream(data):
+    """
+    Generator version of :func:`findall`: when the request is streamed, the
+    occurrences are sent to the client as soon as they are found.
+
+    :param data: Request data dict, see :func:`findall`.
+    :return: generator of occurrence positions in text
+    """
+    return findalliter(
         data['string'], data['sub'], regex=data['regex'],
-        whole_word=data['whole_word'], case_sensitive=data['case_sensitive']))
+        whole_word=data['whole_word'], case_sensitive=data['case_sensitive'])
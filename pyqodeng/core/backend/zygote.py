@@ -0,0 +1,181 @@
+# -*- coding: utf-8 -*-
+"""
+This module contains the zygote: a backend process that loads the server
+script and the workers once, then forks a new server for each backend
+requested by the client (see the ``--zygote`` option of
+:func:`pyqode.core.backend.default_parser`). Forking a warm process is much
+faster than starting a new interpreter and importing everything again.
+
+The client requests a new backend by writing a json object on the zygote
+standard input, one per line::
+
+    {"port": 53422, "transport": "tcp"}
+
+The transport is ``tcp`` or ``unix``: the forked servers can't use the
+stdio transport since they share the standard input and output of the
+zygote.
+
+The zygote then writes the following lines on its standard output:
+
+    - ``forked <pid> <port>`` once the server process has been forked
+    - ``failed <port>`` if the server process could not be forked
+    - ``exited <pid> <exit code>`` when a server process exits
+
+The forked servers inherit the standard output of the zygote, their
+``started on ...`` readiness messages go through it too.
+
+The zygote exits when its standard input is closed and all the servers it
+has forked have exited.
+
+.. note:: The zygote is only available on POSIX systems.
+"""
+import copy
+import json
+import logging
+import os
+import select
+import signal
+import sys
+import traceback
+
+from pyqodeng.core.backend.registry import worker_registry
+
+
+def _logger():
+    """ Returns the module's logger """
+    return logging.getLogger(__name__)
+
+
+def _write(line):
+    # unbuffered, the forked servers write on the same stdout
+    os.write(sys.stdout.fileno(), (line + '\n').encode('utf-8'))
+
+
+def _exit_code(status):
+    if os.WIFSIGNALED(status):
+        return -os.WTERMSIG(status)
+    return os.WEXITSTATUS(status)
+
+
+def _on_sigchld(*args):
+    # the servers are reaped by the main loop, woken up through the wakeup
+    # fd of the signal module
+    pass
+
+
+def _reap():
+    """ Reaps the server processes that have exited """
+    while True:
+        try:
+            pid, status = os.waitpid(-1, os.WNOHANG)
+        except ChildProcessError:
+            return
+        if not pid:
+            return
+        _write('exited %d %d' % (pid, _exit_code(status)))
+
+
+def _requests(wakeup_fd):
+    """
+    Yields the lines written on the standard input and reaps the servers
+    that have exited while waiting for them.
+    """
+    stdin = sys.stdin.fileno()
+    tail = b''
+    while True:
+        readable, _, _ = select.select([stdin, wakeup_fd], [], [])
+        if wakeup_fd in readable:
+            try:
+                while os.read(wakeup_fd, 512):
+                    pass
+            except BlockingIOError:
+                pass
+            _reap()
+        if stdin in readable:
+            data = os.read(stdin, 4096)
+            if not data:
+                if tail:
+                    yield tail.decode('utf-8')
+                return
+            lines = (tail + data).split(b'\n')
+            tail = lines.pop()
+            for line in lines:
+                yield line.decode('utf-8')
+
+
+def _run_child(args, serve, wakeup_fds):
+    """ Runs a server in a forked process, never returns """
+    code = 0
+    try:
+        signal.set_wakeup_fd(-1)
+        signal.signal(signal.SIGCHLD, signal.SIG_DFL)
+        for fd in wakeup_fds:
+            os.close(fd)
+        # stdin is the control channel of the zygote
+        null = os.open(os.devnull, os.O_RDONLY)
+        os.dup2(null, sys.stdin.fileno())
+        os.close(null)
+        serve(args)
+    except SystemExit as e:
+        code = e.code if isinstance(e.code, int) else 1
+    except BaseException:
+        traceback.print_exc()
+        code = 1
+    finally:
+        os._exit(code)
+
+
+def serve_zygote(args, serve):
+    """
+    Runs the zygote until its standard input is closed.
+
+    :param args: the parsed command line args of the zygote, the args of
+        the forked servers are a copy with the port and transport requested
+        by the client.
+    :param serve: function that runs a server with the given args.
+    """
+    worker_registry.preload(list(getattr(args, 'preload', None) or []))
+    # SIGCHLD only wakes up the main loop, nothing is written from the
+    # signal handler
+    wakeup_fds = os.pipe()
+    for fd in wakeup_fds:
+        os.set_blocking(fd, False)
+    signal.signal(signal.SIGCHLD, _on_sigchld)
+    signal.set_wakeup_fd(wakeup_fds[1])
+    _write('zygote ready')
+    for line in _requests(wakeup_fds[0]):
+        try:
+            spec = json.loads(line)
+        except ValueError:
+            _logger().warning('invalid zygote request: %r', line)
+            continue
+        transport = spec.get('transport', 'tcp')
+        if transport not in ('tcp', 'unix'):
+            _logger().warning('cannot fork a server with the %s transport',
+                              transport)
+            _write('failed %s' % spec['port'])
+            continue
+        child_args = copy.copy(args)
+        child_args.zygote = False
+        child_args.port = spec['port']
+        child_args.transport = transport
+        try:
+            pid = os.fork()
+            if pid == 0:
+                _run_child(child_args, serve, wakeup_fds)
+            _write('forked %d %s' % (pid, spec['port']))
+        except OSError:
+            _logger().exception('failed to fork a server')
+            _write('failed %s' % spec['port'])
+    signal.set_wakeup_fd(-1)
+    signal.signal(signal.SIGCHLD, signal.SIG_DFL)
+    for fd in wakeup_fds:
+        os.close(fd)
+    # the client went away or does not need new servers anymore, the exit of
+    # the running servers is still reported.
+    while True:
+        try:
+            pid, status = os.wait()
+        except ChildProcessError:
+            break
+        _write('exited %d %d' % (pid, _exit_code(status)))
@@ -6,6 +6,7 @@ A manager is class that takes care of a specific aspect of CodeEdit:
     - FileManager: open, save, encoding detection
     - BackendManager: manage the backend process (start the process and
       handle communication through sockets).
+    - BackendPool: a pool of backend processes shared by several editors.
     - ModesManager: manage the list of modes of an editor
     - PanelsManager: manage the list of panels and draw them into the editor
       margins.
@@ -13,6 +14,7 @@ A manager is class that takes care of a specific aspect of CodeEdit:
 
 """
 from .backend import BackendManager
+from .backend import BackendPool
 from .decorations import TextDecorationsManager
 from .file import FileManager
 from .modes import ModesManager
@@ -21,6 +23,7 @@ from .panels import PanelsManager
 
 __all__ = [
     'BackendManager',
+    'BackendPool',
     'FileManager',
     'ModesManager',
     'PanelsManager',
@@ -2,13 +2,26 @@
 This module contains the backend controller
 """
 import logging
+import os
+import shutil
 import socket
 import sys
+import tempfile
+import uuid
+
 from qtpy import QtCore
 
 from pyqodeng.core.api.client import JsonTcpClient, BackendProcess
+from pyqodeng.core.api.client import BackendZygote
+from pyqodeng.core.api.client import JsonLocalClient, JsonPipeClient
+from pyqodeng.core.api.client import DocumentTracker
 from pyqodeng.core.api.manager import Manager
-from pyqodeng.core.backend import NotRunning, echo_worker
+from pyqodeng.core.backend import NotRunning
+from pyqodeng.core.backend import PRIORITY_INTERACTIVE
+from pyqodeng.core.backend import PRIORITY_NORMAL
+from pyqodeng.core.backend import profile_worker
+from pyqodeng.core.backend import stats_worker
+from pyqodeng.core.backend.registry import execute_worker
 
 
 def _logger():
@@ -23,6 +36,298 @@ def comm(msg, *args):
     _logger().log(COMM, msg, *args)
 
 
+def _backend_address(transport):
+    """
+    Allocates the address of a new backend.
+
+    :returns: the address (tcp port, unix socket path or None for the stdio
+        transport) and the matching command line arguments of the server.
+    """
+    if transport == 'unix':
+        # the socket is created in a private directory (0700)
+        runtime_dir = os.environ.get('XDG_RUNTIME_DIR')
+        if not runtime_dir or not os.path.isdir(runtime_dir):
+            runtime_dir = None
+        address = os.path.join(
+            tempfile.mkdtemp(prefix='pyqode-', dir=runtime_dir),
+            'backend.sock')
+        address_args = [address, '--transport', 'unix']
+    elif transport == 'stdio':
+        address = None
+        address_args = ['-', '--transport', 'stdio']
+    else:
+        address = JsonTcpClient.pick_free_port()
+        address_args = [str(address)]
+    return address, address_args
+
+
+def _backend_command(script, interpreter, args, address_args):
+    """
+    Returns the program and the arguments used to start a backend process.
+    """
+    backend_script = script.replace('.pyc', '.py')
+    if hasattr(sys, "frozen") and not backend_script.endswith('.py'):
+        # frozen backend script on windows/mac does not need an
+        # interpreter
+        program = backend_script
+        pgm_args = address_args
+    else:
+        program = interpreter
+        pgm_args = [backend_script] + address_args
+    if args:
+        pgm_args += args
+    return program, pgm_args
+
+
+def _start_backend(parent, script, interpreter=sys.executable, args=None,
+                   transport='tcp', error_callback=None):
+    """
+    Starts a backend process.
+
+    :returns: the backend process and its address (tcp port, unix socket
+        path or None for the stdio transport).
+    """
+    address, address_args = _backend_address(transport)
+    program, pgm_args = _backend_command(script, interpreter, args,
+                                         address_args)
+    process = BackendProcess(parent)
+    if error_callback:
+        process.errorOccurred.connect(error_callback)
+    process.start(program, pgm_args)
+    comm('starting backend process: %s %s', program, ' '.join(pgm_args))
+    return process, address
+
+
+def _create_client(process, transport, address):
+    """
+    Creates the client for the transport used by a backend process.
+    """
+    if transport == 'unix':
+        return JsonLocalClient(process, address)
+    if transport == 'stdio':
+        return JsonPipeClient(process)
+    return JsonTcpClient(process, address)
+
+
+def _stop_backend(process, client, transport, address):
+    """
+    Closes the client and stops a backend process.
+    """
+    comm('stopping backend process')
+    # close the client socket
+    if client is not None:
+        client.close()
+    # prevent crash logs from being written if we are busy killing
+    # the process
+    process._prevent_logs = True
+    while process.state() != BackendProcess.NotRunning:
+        process.waitForFinished(1)
+        if sys.platform == 'win32':
+            # Console applications on Windows that do not run an event
+            # loop, or whose event loop does not handle the WM_CLOSE
+            # message, can only be terminated by calling kill().
+            process.kill()
+        else:
+            process.terminate()
+    process._prevent_logs = False
+    if transport == 'unix':
+        shutil.rmtree(os.path.dirname(address), ignore_errors=True)
+    comm('backend process terminated')
+
+
+class _PooledBackend(object):
+    """
+    A backend process of a :class:`BackendPool` and its client connection.
+    """
+    def __init__(self, pool):
+        self.transport = pool.transport
+        self.process, self.address, self._client = \
+            BackendManager._launch_backend(
+                None, pool.script, pool.interpreter, pool.args,
+                pool.transport, pool._on_process_error)
+        #: affinity keys (document paths) routed to this backend
+        self.keys = set()
+
+    @property
+    def client(self):
+        """
+        The client connected to the backend process, a new connection is made
+        if the previous one has been closed.
+        """
+        if self._client.closed:
+            self._client = _create_client(
+                self.process, self.transport, self.address)
+        return self._client
+
+    @property
+    def running(self):
+        try:
+            return self.process.state() != BackendProcess.NotRunning
+        except RuntimeError:
+            return False
+
+    @property
+    def load(self):
+        """ Load of the backend: (pending requests, routed documents) """
+        return self._client.pending_requests, len(self.keys)
+
+    def stop(self):
+        _stop_backend(self.process, self._client, self.transport,
+                      self.address)
+
+
+class BackendPool(object):
+    """
+    A pool of backend processes shared by all the editors that use the same
+    server script (see the ``pool_size`` parameter of
+    :meth:`BackendManager.start`).
+
+    Processes are started lazily, as documents are opened, up to the pool size
+    and :attr:`MAX_PROCESSES` processes for all the pools. The requests of
+    a document are always routed to the same process so that the caches of the
+    workers stay warm; a new document goes to the least loaded process.
+
+    The processes are stopped when the last editor that uses the pool is
+    stopped.
+    """
+    #: Maximum number of backend processes started by all the pools.
+    MAX_PROCESSES = 4
+
+    _pools = {}
+
+    def __init__(self, script, interpreter=sys.executable, args=None,
+                 transport='tcp', size=2):
+        self.script = script
+        self.interpreter = interpreter
+        self.args = list(args) if args else None
+        self.transport = transport
+        #: maximum number of processes of the pool
+        self.size = size
+        self._backends = []
+        #: affinity key -> [backend, reference count]
+        self._routes = {}
+        self._error_callbacks = []
+        self._users = 0
+
+    @classmethod
+    def get(cls, script, interpreter=sys.executable, args=None,
+            transport='tcp', size=2):
+        """
+        Returns the pool of a server script, the pool is created if needed.
+        """
+        key = (script, interpreter, tuple(args or ()), transport)
+        pool = cls._pools.get(key)
+        if pool is None:
+            pool = cls._pools[key] = cls(script, interpreter, args, transport,
+                                         size)
+        else:
+            pool.size = max(pool.size, size)
+        return pool
+
+    @classmethod
+    def process_count(cls):
+        """ Returns the number of backend processes started by all pools """
+        return sum(len(pool._backends) for pool in cls._pools.values())
+
+    @property
+    def backends(self):
+        """ Returns the list of backends of the pool """
+        return list(self._backends)
+
+    def acquire(self, error_callback=None):
+        """
+        Registers a user of the pool.
+
+        :param error_callback: optional callback called when one of the
+            backend processes fails.
+        """
+        self._users += 1
+        if error_callback:
+            self._error_callbacks.append(error_callback)
+
+    def release(self, error_callback=None):
+        """
+        Unregisters a user of the pool, the backend processes are stopped when
+        the pool is not used anymore.
+        """
+        if error_callback in self._error_callbacks:
+            self._error_callbacks.remove(error_callback)
+        self._users -= 1
+        if self._users <= 0:
+            self.stop()
+
+    def stop(self):
+        """ Stops all the backend processes of the pool. """
+        for backend in self._backends:
+            backend.stop()
+        self._backends[:] = []
+        self._routes.clear()
+        self._users = 0
+        key = (self.script, self.interpreter, tuple(self.args or ()),
+               self.transport)
+        if self._pools.get(key) is self:
+            del self._pools[key]
+
+    def attach(self, key):
+        """
+        Adds a reference to an affinity key (e.g. a document path).
+        """
+        try:
+            self._routes[key][1] += 1
+        except KeyError:
+            self._routes[key] = [None, 1]
+
+    def detach(self, key):
+        """
+        Removes a reference to an affinity key, the key is not routed to its
+        backend anymore when it is not referenced.
+        """
+        route = self._routes.get(key)
+        if route is None:
+            return
+        route[1] -= 1
+        if route[1] <= 0:
+            del self._routes[key]
+            if route[0] is not None:
+                route[0].keys.discard(key)
+
+    def backend(self, key):
+        """
+        Returns the backend that handles the requests of an affinity key.
+        """
+        self._prune()
+        route = self._routes.setdefault(key, [None, 0])
+        if route[0] is None:
+            route[0] = self._select()
+            route[0].keys.add(key)
+        return route[0]
+
+    def _select(self):
+        backends = self._backends
+        if (len(backends) < self.size and
+                self.process_count() < self.MAX_PROCESSES and
+                all(backend.keys for backend in backends)) or not backends:
+            backend = _PooledBackend(self)
+            backends.append(backend)
+            return backend
+        return min(backends, key=lambda backend: backend.load)
+
+    def _prune(self):
+        """ Removes the backends whose process is not running anymore """
+        for backend in [b for b in self._backends if not b.running]:
+            _logger().warning('backend process %r of pool %r died',
+                              backend.address, self.script)
+            backend.stop()
+            self._backends.remove(backend)
+            for route in self._routes.values():
+                if route[0] is backend:
+                    route[0] = None
+
+    def _on_process_error(self, error):
+        for callback in self._error_callbacks:
+            callback(error)
+
+
 class BackendManager(Manager):
     """
     The backend controller takes care of controlling the client-server
@@ -38,20 +343,50 @@ class BackendManager(Manager):
     """
     LAST_PORT = None
     LAST_PROCESS = None
+    LAST_CLIENT = None
+    LAST_TRANSPORT = None
     SHARE_COUNT = 0
 
+    #: Available transports, see :meth:`start`.
+    TRANSPORTS = ('tcp', 'unix', 'stdio')
+
+    #: Number of requests in flight above which the requests made with
+    #: ``fallback=True`` are run in process instead of being queued behind
+    #: them (see :meth:`send_request`).
+    FALLBACK_THRESHOLD = 8
+
+    #: Maximum size (in characters) of the document of a request that can
+    #: be run in process (see the ``fallback`` parameter of
+    #: :meth:`send_request`).
+    FALLBACK_MAX_SIZE = 100000
+
+    #: Backends started in advance by :meth:`prespawn`:
+    #: (script, interpreter, args, transport) -> [(process, address, client)]
+    _SPARES = {}
+    #: Zygotes started by :meth:`prespawn`:
+    #: (script, interpreter, args) -> BackendZygote
+    _ZYGOTES = {}
+
     def __init__(self, editor):
         super(BackendManager, self).__init__(editor)
         self._process = None
-        self._sockets = []
+        self._client = None
+        self._port = None
+        self._transport = 'tcp'
+        self._tracker = None
         self.server_script = None
         self.interpreter = None
         self.args = None
         self._shared = False
-        self._heartbeat_timer = QtCore.QTimer()
-        self._heartbeat_timer.setInterval(1000)
-        self._heartbeat_timer.timeout.connect(self._send_heartbeat)
-        self._heartbeat_timer.start()
+        self._pool = None
+        self._pool_key = None
+        self._error_callback = None
+        #: requests run in process: request_id -> group
+        self._local_requests = {}
+        #: timeout callbacks of the requests that fall back to an in process
+        #: run (the client only keeps weak references): request_id ->
+        #: callback
+        self._fallbacks = {}
 
     @staticmethod
     def pick_free_port():
@@ -63,7 +398,8 @@ class BackendManager(Manager):
         return free_port
 
     def start(self, script, interpreter=sys.executable, args=None,
-              error_callback=None, reuse=False):
+              error_callback=None, reuse=False, transport='tcp',
+              pool_size=None):
         """
         Starts the backend process.
 
@@ -88,11 +424,52 @@ class BackendManager(Manager):
             you're creating an app which supports multiple programming
             languages you will need to merge all backend scripts into one
             single script, otherwise the wrong script might be picked up).
+        :param transport: the transport used to communicate with the backend:
+
+            - ``'tcp'``: the backend listens on a free local tcp port
+              (default).
+            - ``'unix'``: the backend listens on a unix domain socket created
+              in a private directory (falls back to ``'tcp'`` on Windows).
+            - ``'stdio'``: the messages go through the standard input/output
+              of the backend process, there is no socket at all.
+
+            The ``unix`` and ``stdio`` transports require a server script
+            that parses its command line with
+            :func:`pyqode.core.backend.default_parser` (or a parser based on
+            it).
+        :param pool_size: use a :class:`BackendPool` of up to ``pool_size``
+            processes shared by all the editors that start the same script
+            with the same interpreter, args and transport. The requests of a
+            document are always handled by the same process. Takes
+            precedence over ``reuse``.
         """
+        if transport not in self.TRANSPORTS:
+            raise ValueError('unknown transport: %r' % transport)
+        if transport == 'unix' and not hasattr(socket, 'AF_UNIX'):
+            _logger().warning('unix domain sockets not supported, using tcp')
+            transport = 'tcp'
+        if self._pool is not None:
+            self.stop()
+        if pool_size:
+            if self.running:
+                self.stop()
+            self.server_script = script
+            self.interpreter = interpreter
+            self.args = args
+            self._transport = transport
+            self._shared = False
+            self._error_callback = error_callback
+            self._pool = BackendPool.get(script, interpreter, args, transport,
+                                         pool_size)
+            self._pool.acquire(error_callback)
+            self._select_backend()
+            return
         self._shared = reuse
         if reuse and BackendManager.SHARE_COUNT:
             self._port = BackendManager.LAST_PORT
+            self._transport = BackendManager.LAST_TRANSPORT
             self._process = BackendManager.LAST_PROCESS
+            self._client = BackendManager.LAST_CLIENT
             BackendManager.SHARE_COUNT += 1
         else:
             if self.running:
@@ -100,65 +477,178 @@ class BackendManager(Manager):
             self.server_script = script
             self.interpreter = interpreter
             self.args = args
-            backend_script = script.replace('.pyc', '.py')
-            self._port = self.pick_free_port()
-            if hasattr(sys, "frozen") and not backend_script.endswith('.py'):
-                # frozen backend script on windows/mac does not need an
-                # interpreter
-                program = backend_script
-                pgm_args = [str(self._port)]
-            else:
-                program = interpreter
-                pgm_args = [backend_script, str(self._port)]
-            if args:
-                pgm_args += args
-            self._process = BackendProcess(self.editor)
-            if error_callback:
-                self._process.error.connect(error_callback)
-            self._process.start(program, pgm_args)
+            self._transport = transport
+            # the client connects as soon as the server is listening,
+            # requests made in the meantime are queued.
+            self._process, self._port, self._client = self._launch_backend(
+                self.editor, script, interpreter, args, transport,
+                error_callback)
 
             if reuse:
                 BackendManager.LAST_PROCESS = self._process
+                BackendManager.LAST_CLIENT = self._client
                 BackendManager.LAST_PORT = self._port
+                BackendManager.LAST_TRANSPORT = self._transport
                 BackendManager.SHARE_COUNT += 1
-            comm('starting backend process: %s %s', program,
-                 ' '.join(pgm_args))
-            self._heartbeat_timer.start()
+
+    @classmethod
+    def prespawn(cls, script, interpreter=sys.executable, args=None,
+                 transport='tcp', zygote=False):
+        """
+        Starts a backend in advance, e.g. when the application starts, before
+        the first editor is created: the next editor that starts the same
+        backend (same script, interpreter, args and transport) gets a
+        backend that is already running and connected. A new spare backend
+        is started each time the spare backend is used.
+
+        :param script: Path to the backend script.
+        :param interpreter: The python interpreter to use to run the backend
+            script.
+        :param args: list of additional command line args of the backend.
+        :param transport: the transport used to communicate with the
+            backend, see :meth:`start`.
+        :param zygote: True to also start a zygote (see
+            :mod:`pyqode.core.backend.zygote`): a process that loads the
+            server script and the workers once and forks the new backends,
+            which are then ready in a few milliseconds. Requires a POSIX
+            system and the ``tcp`` or ``unix`` transport.
+        """
+        if transport not in cls.TRANSPORTS:
+            raise ValueError('unknown transport: %r' % transport)
+        if transport == 'unix' and not hasattr(socket, 'AF_UNIX'):
+            transport = 'tcp'
+        app = QtCore.QCoreApplication.instance()
+        if not cls._SPARES and not cls._ZYGOTES and app is not None:
+            app.aboutToQuit.connect(cls.stop_prespawned)
+        key = (script, interpreter, tuple(args or ()), transport)
+        if zygote and hasattr(os, 'fork') and transport != 'stdio':
+            zygote_process = cls._ZYGOTES.get(key[:3])
+            if (zygote_process is None or
+                    zygote_process.state() == BackendProcess.NotRunning):
+                program, pgm_args = _backend_command(
+                    script, interpreter, args, ['-', '--zygote'])
+                zygote_process = BackendZygote()
+                zygote_process.start(program, pgm_args)
+                comm('starting backend zygote: %s %s', program,
+                     ' '.join(pgm_args))
+                cls._ZYGOTES[key[:3]] = zygote_process
+        elif zygote:
+            _logger().warning('backend zygote not supported, using regular '
+                              'processes')
+        spares = cls._SPARES.setdefault(key, [])
+        if not spares:
+            process, address = cls._spawn(None, *key)
+            spares.append(
+                (process, address, _create_client(process, transport,
+                                                  address)))
+
+    @classmethod
+    def stop_prespawned(cls):
+        """
+        Stops the spare backends and the zygotes started by
+        :meth:`prespawn`. The backends used by the editors keep running.
+        """
+        for key, spares in list(cls._SPARES.items()):
+            for process, address, client in spares:
+                _stop_backend(process, client, key[3], address)
+        cls._SPARES.clear()
+        for zygote in cls._ZYGOTES.values():
+            if zygote.state() != BackendProcess.NotRunning:
+                # the zygote exits when its stdin is closed and all the
+                # backends it has forked have exited.
+                zygote.closeWriteChannel()
+                if not zygote.forked:
+                    zygote.waitForFinished(1000)
+        cls._ZYGOTES.clear()
+
+    @classmethod
+    def _launch_backend(cls, parent, script, interpreter, args, transport,
+                        error_callback=None):
+        """
+        Launches a backend: a spare backend started by :meth:`prespawn` is
+        used if there is one.
+
+        :returns: the backend process, its address and its client.
+        """
+        key = (script, interpreter, tuple(args or ()), transport)
+        spares = cls._SPARES.get(key)
+        while spares:
+            process, address, client = spares.pop(0)
+            if (process.state() != BackendProcess.NotRunning and
+                    not client.closed):
+                comm('using prespawned backend %r', address)
+                process.setParent(parent)
+                if error_callback:
+                    process.errorOccurred.connect(error_callback)
+                # keep a spare backend ready for the next editor
+                QtCore.QTimer.singleShot(0, lambda: cls._refill(key))
+                return process, address, client
+            _stop_backend(process, client, transport, address)
+        process, address = cls._spawn(parent, script, interpreter, args,
+                                      transport, error_callback)
+        return process, address, _create_client(process, transport, address)
+
+    @classmethod
+    def _spawn(cls, parent, script, interpreter, args, transport,
+               error_callback=None):
+        """
+        Starts a backend process, the process is forked by the zygote of
+        the backend script if there is one.
+        """
+        zygote = cls._ZYGOTES.get((script, interpreter, tuple(args or ())))
+        if (zygote is None or transport == 'stdio' or
+                zygote.state() == BackendProcess.NotRunning):
+            return _start_backend(parent, script, interpreter, args,
+                                  transport, error_callback)
+        address, _ = _backend_address(transport)
+        process = zygote.fork(address, transport, parent)
+        if error_callback:
+            process.errorOccurred.connect(error_callback)
+        return process, address
+
+    @classmethod
+    def _refill(cls, key):
+        """ Starts a new spare backend (if still needed) """
+        spares = cls._SPARES.get(key)
+        if spares is not None and not spares:
+            cls.prespawn(*key[:2], args=list(key[2]), transport=key[3])
 
     def stop(self):
         """
         Stops the backend process.
         """
+        self._local_requests.clear()
+        self._fallbacks.clear()
+        if self._pool is not None:
+            if (self._client is not None and not self._client.closed and
+                    self._tracker is not None):
+                self._client.close_document(self._tracker)
+            if self._pool_key is not None:
+                self._pool.detach(self._pool_key)
+            self._pool.release(self._error_callback)
+            self._pool = None
+            self._pool_key = None
+            self._process = None
+            self._client = None
+            return
         if self._process is None:
             return
         if self._shared:
             BackendManager.SHARE_COUNT -= 1
             if BackendManager.SHARE_COUNT:
+                # the process is still used by other editors
+                if self._client is not None and self._tracker is not None:
+                    self._client.close_document(self._tracker)
                 return
-        comm('stopping backend process')
-        # close all sockets
-        for s in self._sockets:
-            s._callback = None
-            s.close()
-
-        self._sockets[:] = []
-        # prevent crash logs from being written if we are busy killing
-        # the process
-        self._process._prevent_logs = True
-        while self._process.state() != self._process.NotRunning:
-            self._process.waitForFinished(1)
-            if sys.platform == 'win32':
-                # Console applications on Windows that do not run an event
-                # loop, or whose event loop does not handle the WM_CLOSE
-                # message, can only be terminated by calling kill().
-                self._process.kill()
-            else:
-                self._process.terminate()
-        self._process._prevent_logs = False
-        self._heartbeat_timer.stop()
-        comm('backend process terminated')
-
-    def send_request(self, worker_class_or_function, args, on_receive=None):
+        _stop_backend(self._process, self._client, self._transport,
+                      self._port)
+        self._client = None
+
+    def send_request(self, worker_class_or_function, args, on_receive=None,
+                     priority=PRIORITY_NORMAL, supersede=False,
+                     document=None, cache=False, on_chunk=None,
+                     profile=False, timeout=None, on_timeout=None,
+                     fallback=False):
         """
         Requests some work to be done by the backend. You can get notified of
         the work results by passing a callback (on_receive).
@@ -168,14 +658,58 @@ class BackendManager(Manager):
         :param on_receive: an optional callback executed when we receive the
             worker's results. The callback will be called with one arguments:
             the results of the worker (object)
+        :param priority: priority of the request: use
+            :attr:`pyqode.core.backend.PRIORITY_INTERACTIVE` for requests the
+            user is waiting for (e.g. code completion) and
+            :attr:`pyqode.core.backend.PRIORITY_BACKGROUND` for background
+            analysis (e.g. linters). Queued requests with a higher priority
+            are run first by the backend.
+        :param supersede: True to cancel the previous requests of the same
+            worker made by the editor: the backend drops them if they are
+            still queued and notifies the worker if they are running (see
+            :func:`pyqode.core.backend.is_cancelled`). Their results are
+            never delivered.
+        :param document: name of the ``args`` key that must receive the
+            editor text. Instead of sending the full text with each request,
+            the document is synchronised incrementally with the backend (only
+            the changes made since the last request are sent) and the backend
+            fills ``args[document]`` before running the worker.
+        :param cache: True if the worker results only depend on the request
+            args (and document): when the backend runs with a result cache
+            (``--result-cache``), an identical request is answered with the
+            cached results instead of running the worker again.
+        :param on_chunk: optional callback called with the items of a
+            generator worker, by chunks, as soon as they are produced by the
+            backend. ``on_receive`` is then called with an empty list once
+            the worker has finished.
+        :param profile: True to run the worker under the backend profiler,
+            see :meth:`request_profile`.
+        :param timeout: optional deadline (in milliseconds). If the results
+            have not been received in time, the request is cancelled and
+            ``on_timeout`` is called (without arguments).
+        :param on_timeout: see ``timeout``.
+        :param fallback: True to run the worker in process (in the gui
+            thread) when the backend is busy: when more than
+            :attr:`FALLBACK_THRESHOLD` requests are in flight, and when the
+            deadline of the request expires (after ``on_timeout`` has been
+            called). The results are delivered to ``on_receive`` as usual.
+            Only use it for cheap workers that are importable by the gui
+            process (e.g. :func:`pyqode.core.backend.workers.findall`). The
+            streamed requests (``on_chunk``) and the requests whose document
+            is larger than :attr:`FALLBACK_MAX_SIZE` never fall back.
+
+        :returns: The request id, it can be used to cancel the request (see
+            :meth:`cancel_request`).
 
         :raise: backend.NotRunning if the backend process is not running.
         """
+        if self._pool is not None:
+            self._select_backend()
         if not self.running:
             try:
                 # try to restart the backend if it crashed.
                 self.start(self.server_script, interpreter=self.interpreter,
-                           args=self.args)
+                           args=self.args, transport=self._transport)
             except AttributeError:
                 pass  # not started yet
             finally:
@@ -183,29 +717,292 @@ class BackendManager(Manager):
                 raise NotRunning()
         else:
             comm('sending request, worker=%r' % worker_class_or_function)
-            # create a socket, the request will be send as soon as the socket
-            # has connected
-            socket = JsonTcpClient(
-                self.editor, self._port, worker_class_or_function, args,
-                on_receive=on_receive)
-            socket.finished.connect(self._rm_socket)
-            self._sockets.append(socket)
-            # restart heartbeat timer
-            self._heartbeat_timer.start()
-
-    def _send_heartbeat(self):
-        try:
-            self.send_request(echo_worker, {'heartbeat': True})
-        except NotRunning:
-            self._heartbeat_timer.stop()
+            # the request is written on the persistent connection (or queued
+            # until the client socket has connected)
+            group = None
+            if supersede:
+                group = '%s@%x' % (self._worker_name(
+                    worker_class_or_function), id(self.editor))
+                self._drop_local_requests(group)
+            client = self._get_client()
+            fallback = fallback and self._can_fall_back(document, on_chunk)
+            if (fallback and
+                    client.pending_requests >= self.FALLBACK_THRESHOLD):
+                comm('backend busy, running %r in process',
+                     worker_class_or_function)
+                if group is not None:
+                    client.cancel_group(group)
+                return self._run_locally(
+                    worker_class_or_function, args, on_receive, group,
+                    document)
+            if fallback and timeout is not None:
+                on_timeout = self._make_fallback(
+                    worker_class_or_function, args, on_receive, group,
+                    document, on_timeout)
+            tracker = None
+            if document is not None:
+                tracker = self._get_tracker()
+            request_id = client.request(
+                worker_class_or_function, args, on_receive=on_receive,
+                priority=priority, group=group, document=tracker,
+                document_key=document, cache=cache, on_chunk=on_chunk,
+                profile=profile, timeout=timeout, on_timeout=on_timeout)
+            if fallback and timeout is not None:
+                self._fallbacks[request_id] = on_timeout
+            return request_id
 
-    def _rm_socket(self, socket):
-        try:
-            socket.close()
-            self._sockets.remove(socket)
-            socket.deleteLater()
-        except ValueError:
-            pass
+    def _can_fall_back(self, document, on_chunk):
+        """
+        Checks if a request can be run in process: the request must not be
+        streamed (the items already delivered would be delivered again) and
+        its document must be small enough to not freeze the gui.
+        """
+        if on_chunk is not None:
+            return False
+        return (document is None or self.editor is None or
+                self.editor.document().characterCount() <=
+                self.FALLBACK_MAX_SIZE)
+
+    def _make_fallback(self, worker, args, on_receive, group, document,
+                       on_timeout):
+        """
+        Returns the timeout callback of a request that falls back to an in
+        process run when its deadline expires.
+        """
+        # forget the callbacks of the requests that have been answered
+        for request_id in list(self._fallbacks):
+            if not self._client.is_pending(request_id):
+                del self._fallbacks[request_id]
+
+        def on_deadline():
+            if on_timeout is not None:
+                on_timeout()
+            comm('request timed out, running %r in process', worker)
+            self._run_locally(worker, args, on_receive, group, document)
+        return on_deadline
+
+    def _run_locally(self, worker, args, on_receive, group=None,
+                     document=None):
+        """
+        Runs a worker in process. The worker runs from the event loop, as
+        soon as possible, so that the results are delivered after
+        :meth:`send_request` has returned, like the results of the backend.
+
+        :returns: the id of the request, it can be cancelled with
+            :meth:`cancel_request` until the worker has run.
+        """
+        if document is not None:
+            args = dict(args)
+            args[document] = self.editor.toPlainText()
+        worker_name = self._worker_name(worker)
+        if self._client is not None:
+            self._client.metrics.increment(worker_name, 'fallbacks')
+        request_id = str(uuid.uuid4())
+        self._local_requests[request_id] = group
+
+        def run():
+            try:
+                self._local_requests.pop(request_id)
+            except KeyError:
+                # cancelled or superseded
+                return
+            results = execute_worker(worker_name, args)
+            if on_receive is not None:
+                on_receive(results)
+
+        QtCore.QTimer.singleShot(0, run)
+        return request_id
+
+    def _drop_local_requests(self, group):
+        """ Drops the in process requests of a group that have not run yet """
+        for request_id, request_group in list(self._local_requests.items()):
+            if request_group == group:
+                del self._local_requests[request_id]
+
+    def send_batch(self, requests, priority=PRIORITY_NORMAL, supersede=False,
+                   document=None, cache=False):
+        """
+        Sends several requests in one single message. The requests of a
+        batch run on the same document snapshot: the document is synchronised
+        once for all the workers (see the ``document`` parameter of
+        :meth:`send_request`).
+
+        E.g.::
+
+            editor.backend.send_batch([
+                (checker_worker, {'path': path}, on_checker_results),
+                (outline_worker, {'path': path}, on_outline_results),
+            ], priority=PRIORITY_BACKGROUND, document='code')
+
+        :param requests: list of (worker_class_or_function, args, on_receive)
+            tuples. The results of each worker are delivered to its own
+            callback.
+        :param priority: priority of the requests, see :meth:`send_request`.
+        :param supersede: see :meth:`send_request`.
+        :param document: see :meth:`send_request`.
+        :param cache: see :meth:`send_request`.
+
+        :returns: The list of request ids, in the order of ``requests``.
+
+        :raise: backend.NotRunning if the backend process is not running.
+        """
+        if self._pool is not None:
+            self._select_backend()
+        if not self.running:
+            raise NotRunning()
+        comm('sending batch of %d requests', len(requests))
+        calls = []
+        for worker, args, on_receive in requests:
+            group = None
+            if supersede:
+                group = '%s@%x' % (self._worker_name(worker), id(self.editor))
+            calls.append((worker, args, on_receive, priority, group))
+        tracker = None
+        if document is not None:
+            tracker = self._get_tracker()
+        return self._get_client().request_batch(
+            calls, document=tracker, document_key=document,
+            cache=cache)
+
+    def request_stats(self, on_receive):
+        """
+        Requests the metrics of the backend process: per worker call counts,
+        queue and execution latency histograms, payload sizes, number of
+        queued and running requests (see
+        :func:`pyqode.core.backend.stats_worker`). The backend answers
+        immediately, the request is not queued behind the running requests.
+
+        :param on_receive: callback called with the metrics (dict).
+        :returns: The request id.
+
+        :raise: backend.NotRunning if the backend process is not running.
+        """
+        return self.send_request(stats_worker, {}, on_receive=on_receive,
+                                 priority=PRIORITY_INTERACTIVE)
+
+    def request_profile(self, on_receive, worker=None, limit=30,
+                        reset=False):
+        """
+        Requests the profile statistics of the backend workers, aggregated
+        per worker: the statistics of the requests made with
+        ``profile=True`` (see :meth:`send_request`) or of all the requests
+        if the backend runs with the ``--profile`` option (see
+        :func:`pyqode.core.backend.profile_worker`).
+
+        :param on_receive: callback called with the statistics (dict).
+        :param worker: worker class or function, None for all the workers.
+        :param limit: maximum number of functions per worker.
+        :param reset: True to discard the statistics once received.
+        :returns: The request id.
+
+        :raise: backend.NotRunning if the backend process is not running.
+        """
+        data = {'limit': limit, 'reset': reset}
+        if worker is not None:
+            data['worker'] = self._worker_name(worker)
+        return self.send_request(profile_worker, data, on_receive=on_receive,
+                                 priority=PRIORITY_INTERACTIVE)
+
+    @property
+    def metrics(self):
+        """
+        Returns the client side metrics of the connection to the backend
+        process: per worker call counts and round trip latency histograms,
+        number of requests in flight, bytes sent and received. None if the
+        backend is not running.
+
+        The connection is shared by the editors that share the backend
+        process, so are its metrics.
+        """
+        if self._client is None or self._client.closed:
+            return None
+        return self._client.metrics.snapshot()
+
+    @property
+    def client(self):
+        """
+        Returns the client connected to the backend process (None if the
+        backend is not running). Connect to its ``request_completed``
+        signal to be notified of the round trip time of each request.
+
+        .. note:: The client is replaced if the connection is lost and the
+            backend restarted.
+        """
+        return self._client
+
+    def cancel_request(self, request_id):
+        """
+        Cancels a request, the request callback won't be called.
+
+        :param request_id: The id of the request to cancel (as returned by
+            :meth:`send_request`).
+        """
+        self._fallbacks.pop(request_id, None)
+        if request_id in self._local_requests:
+            # run in process, not run yet
+            del self._local_requests[request_id]
+            return
+        if self._client is not None and not self._client.closed:
+            self._client.cancel(request_id)
+
+    @staticmethod
+    def _worker_name(worker_class_or_function):
+        if isinstance(worker_class_or_function, str):
+            return worker_class_or_function
+        return '%s.%s' % (worker_class_or_function.__module__,
+                          worker_class_or_function.__name__)
+
+    def _get_tracker(self):
+        """
+        Returns the tracker of the editor document (the editor document might
+        have been replaced, e.g. for clones).
+        """
+        document = self.editor.document()
+        if self._tracker is None or self._tracker.document is not document:
+            self._tracker = DocumentTracker(document)
+        self._tracker.path = self.editor.file.path
+        return self._tracker
+
+    def _select_backend(self):
+        """
+        Selects the pooled backend that handles the requests of the editor
+        document.
+        """
+        key = self.editor.file.path or '%x' % id(self.editor)
+        if key != self._pool_key:
+            if self._pool_key is not None:
+                self._pool.detach(self._pool_key)
+            self._pool.attach(key)
+            self._pool_key = key
+        backend = self._pool.backend(key)
+        if backend.process is not self._process:
+            if (self._client is not None and not self._client.closed and
+                    self._tracker is not None):
+                # the document moved to another process
+                self._client.close_document(self._tracker)
+            self._process = backend.process
+            self._port = backend.address
+        self._client = backend.client
+
+    def _get_client(self):
+        """
+        Returns the client socket connected to the backend process, a new
+        connection is made if the previous one has been closed (e.g. the
+        server dropped the connection).
+        """
+        if self._pool is not None:
+            return self._client
+        if self._client is None or self._client.closed:
+            self._client = self._create_client()
+            if self._shared:
+                BackendManager.LAST_CLIENT = self._client
+        return self._client
+
+    def _create_client(self):
+        """
+        Creates the client for the transport used by the backend process.
+        """
+        return _create_client(self._process, self._transport, self._port)
 
     @property
     def running(self):
@@ -216,7 +1013,7 @@ class BackendManager(Manager):
         """
         try:
             return (self._process is not None and
-                    self._process.state() != self._process.NotRunning)
+                    self._process.state() != BackendProcess.NotRunning)
         except RuntimeError:
             return False
 
@@ -225,9 +1022,10 @@ class BackendManager(Manager):
         """
         Checks if the client socket is connected to the backend.
 
-        .. deprecated: Since v2.3, a socket is created per request. Checking
-            for global connection status does not make any sense anymore. This
-            property now returns ``running``. This will be removed in v2.5
+        .. deprecated: Since v2.3, checking for global connection status
+            does not make any sense anymore, requests made while the client is
+            connecting are queued. This property now returns ``running``. This
+            will be removed in v2.5
         """
         return self.running
 
@@ -6,7 +6,7 @@ import logging
 from pyqodeng.core.api import TextBlockUserData
 from pyqodeng.core.api.decoration import TextDecoration
 from pyqodeng.core.api.mode import Mode
-from pyqodeng.core.backend import NotRunning
+from pyqodeng.core.backend import NotRunning, PRIORITY_BACKGROUND
 from pyqodeng.core.api.utils import DelayJobRunner
 from qtpy import QtCore, QtGui
 
@@ -125,10 +125,14 @@ class CheckerMode(Mode, QtCore.QObject):
                 'encoding': self.editor.file.encoding
             }
 
-    and the return value is a tuple made up of the following elements:
+    and the return value is a list of tuples made up of the following
+    elements:
 
         (description, status, line, [col], [icon], [color], [path])
 
+    The function can also be a generator that yields those tuples: the
+    messages are then displayed as soon as they are found.
+
     The background process is ran when the text changed and the ide is an idle
     state for a few seconds.
 
@@ -147,7 +151,8 @@ class CheckerMode(Mode, QtCore.QObject):
 
     def __init__(self, worker,
                  delay=500,
-                 show_tooltip=True):
+                 show_tooltip=True,
+                 timeout=None):
         """
         :param worker: The process function or class to call remotely.
         :param delay: The delay used before running the analysis process when
@@ -155,6 +160,9 @@ class CheckerMode(Mode, QtCore.QObject):
                       :class:pyqode.core.modes.CheckerTriggers`
         :param show_tooltip: Specify if a tooltip must be displayed when the
                              mouse is over a checker message decoration.
+        :param timeout: Delay (in ms) after which a running analysis is
+                        cancelled, None (default) to wait for its results
+                        whatever the time it takes.
         """
         Mode.__init__(self)
         QtCore.QObject.__init__(self)
@@ -168,6 +176,15 @@ class CheckerMode(Mode, QtCore.QObject):
         self._show_tooltip = show_tooltip
         self._pending_msg = []
         self._finished = True
+        self._request_id = None
+        #: Delay (in ms) after which a running analysis is cancelled (the
+        #: backend is busy or the analysis is too slow), None to never cancel
+        #: it.
+        self.timeout = timeout
+        #: messages streamed by the running analysis
+        self._streamed_messages = []
+        #: streamed messages that are not displayed yet
+        self._streamed_pending = []
 
     def set_ignore_rules(self, rules):
         """
@@ -223,35 +240,52 @@ class CheckerMode(Mode, QtCore.QObject):
                 _logger(self.__class__).log(5, 'finished')
                 self.editor.repaint()
                 return False
-            message = self._pending_msg.pop(0)
-            if message.line >= 0:
-                try:
-                    usd = message.block.userData()
-                except AttributeError:
-                    message.block = self.editor.document().findBlockByNumber(message.line)
-                    usd = message.block.userData()
-                if usd is None:
-                    usd = TextBlockUserData()
-                    message.block.setUserData(usd)
-                # check if the same message already exists
-                if message in usd.messages:
-                    continue
-                self._messages.append(message)
-                usd.messages.append(message)
-                tooltip = None
-                if self._show_tooltip:
-                    tooltip = message.description
-                message.decoration = TextDecoration(
-                    self.editor.textCursor(), start_line=message.line,
-                    tooltip=tooltip, draw_order=3)
-                message.decoration.set_full_width()
-                message.decoration.set_as_error(color=QtGui.QColor(
-                    message.color))
-                self.editor.decorations.append(message.decoration)
+            self._add_message(self._pending_msg.pop(0))
         QtCore.QTimer.singleShot(1, self._add_batch)
         self.editor.repaint()
         return True
 
+    def _add_streamed_batch(self):
+        """
+        Adds the messages streamed by the running analysis. Unlike
+        _add_batch, it does not mark the analysis as finished.
+        """
+        if self.editor is None:
+            return
+        for message in self._streamed_pending[:10]:
+            self._add_message(message)
+        del self._streamed_pending[:10]
+        if self._streamed_pending:
+            QtCore.QTimer.singleShot(1, self._add_streamed_batch)
+        self.editor.repaint()
+
+    def _add_message(self, message):
+        if message.line < 0:
+            return
+        try:
+            usd = message.block.userData()
+        except AttributeError:
+            message.block = self.editor.document().findBlockByNumber(message.line)
+            usd = message.block.userData()
+        if usd is None:
+            usd = TextBlockUserData()
+            message.block.setUserData(usd)
+        # check if the same message already exists
+        if message in usd.messages:
+            return
+        self._messages.append(message)
+        usd.messages.append(message)
+        tooltip = None
+        if self._show_tooltip:
+            tooltip = message.description
+        message.decoration = TextDecoration(
+            self.editor.textCursor(), start_line=message.line,
+            tooltip=tooltip, draw_order=3)
+        message.decoration.set_full_width()
+        message.decoration.set_as_error(color=QtGui.QColor(
+            message.color))
+        self.editor.decorations.append(message.decoration)
+
     def remove_message(self, message):
         """
         Removes a message.
@@ -301,6 +335,38 @@ class CheckerMode(Mode, QtCore.QObject):
         :param status: Response status
         :param results: Response data, messages.
         """
+        self._request_id = None
+        messages = self._streamed_messages + self._make_messages(results)
+        self._streamed_messages = []
+        self._streamed_pending = []
+        self.add_messages(messages)
+
+    def _on_work_timeout(self):
+        """
+        Gives up on an analysis that did not finish in time, the next text
+        change will request a new one.
+        """
+        _logger(self.__class__).warning(
+            'analysis cancelled, no results after %dms', self.timeout)
+        self._request_id = None
+        self._streamed_messages = []
+        self._streamed_pending = []
+        self._finished = True
+
+    def _on_work_chunk(self, results):
+        """
+        Displays the first messages of a generator worker, the outdated
+        messages are removed once the analysis has finished.
+        """
+        if len(self._streamed_messages) >= self.limit:
+            return
+        messages = self._make_messages(results)
+        self._streamed_messages += messages
+        if not self._streamed_pending:
+            QtCore.QTimer.singleShot(1, self._add_streamed_batch)
+        self._streamed_pending += messages
+
+    def _make_messages(self, results):
         messages = []
         for msg in results:
             msg = CheckerMessage(*msg)
@@ -309,12 +375,19 @@ class CheckerMode(Mode, QtCore.QObject):
             block = self.editor.document().findBlockByNumber(msg.line)
             msg.block = block
             messages.append(msg)
-        self.add_messages(messages)
+        return messages
 
     def request_analysis(self):
         """
         Requests an analysis.
         """
+        if self._request_id is not None:
+            # the running analysis is outdated, cancel it instead of waiting
+            # for its results
+            _logger(self.__class__).log(5, 'cancelling outdated analysis')
+            self.editor.backend.cancel_request(self._request_id)
+            self._request_id = None
+            self._finished = True
         if self._finished:
             _logger(self.__class__).log(5, 'running analysis')
             self._job_runner.request_job(self._request)
@@ -336,15 +409,19 @@ class CheckerMode(Mode, QtCore.QObject):
         except KeyError:
             max_line_length = 79
         request_data = {
-            'code': self.editor.toPlainText(),
             'path': self.editor.file.path,
             'encoding': self.editor.file.encoding,
             'ignore_rules': self.ignore_rules,
             'max_line_length': max_line_length,
         }
+        self._streamed_messages = []
+        self._streamed_pending = []
         try:
-            self.editor.backend.send_request(
-                self._worker, request_data, on_receive=self._on_work_finished)
+            self._request_id = self.editor.backend.send_request(
+                self._worker, request_data, on_receive=self._on_work_finished,
+                priority=PRIORITY_BACKGROUND, supersede=True, document='code',
+                cache=True, on_chunk=self._on_work_chunk,
+                timeout=self.timeout, on_timeout=self._on_work_timeout)
             self._finished = False
         except NotRunning:
             # retry later
@@ -11,6 +11,7 @@ from pyqodeng.core.backend import NotRunning
 from qtpy import QtWidgets, QtCore, QtGui
 from pyqodeng.core.api.utils import TextHelper
 from pyqodeng.core import backend
+from pyqodeng.core.backend.fuzzy import FuzzyMatcher
 
 
 def _logger():
@@ -29,6 +30,11 @@ def debug(msg, *args):
 class SubsequenceSortFilterProxyModel(QtCore.QSortFilterProxyModel):
     """
     Performs subsequence matching/sorting (see pyQode/pyQode#1).
+
+    .. deprecated:: the :class:`SubsequenceCompleter` now uses a
+        :class:`FuzzyCompletionModel`, which scores each completion once per
+        prefix instead of matching one regular expression per row and per
+        prefix length.
     """
     def __init__(self, case, parent=None):
         QtCore.QSortFilterProxyModel.__init__(self, parent)
@@ -90,40 +96,118 @@ class SubsequenceSortFilterProxyModel(QtCore.QSortFilterProxyModel):
         return len(self.prefix) == 0
 
 
+class FuzzyCompletionModel(QtCore.QAbstractListModel):
+    """
+    List model of the completions, filtered and sorted by the fuzzy matching
+    engine (see :class:`pyqode.core.backend.fuzzy.FuzzyMatcher`).
+
+    The completions are kept in plain lists, the score of each completion is
+    computed once per prefix and the model is only reset when the matching
+    rows (or their order) change.
+    """
+    def __init__(self, names=(), icons=None, parent=None):
+        """
+        :param names: list of completion names.
+        :param icons: list of QIcon (or None), parallel to names.
+        :param parent: parent QObject.
+        """
+        super(FuzzyCompletionModel, self).__init__(parent)
+        self._matcher = FuzzyMatcher(names)
+        if icons is None:
+            icons = [None] * len(self._matcher.candidates)
+        self._icons = list(icons)
+        self._rows = self._matcher.matches
+
+    @classmethod
+    def from_model(cls, model, parent=None):
+        """
+        Creates a fuzzy model from the first column of any item model.
+
+        :param model: the source model (e.g. a QStandardItemModel).
+        :param parent: parent QObject.
+        """
+        names = []
+        icons = []
+        if model is not None:
+            for row in range(model.rowCount()):
+                index = model.index(row, 0)
+                names.append(model.data(index, QtCore.Qt.DisplayRole) or '')
+                icons.append(model.data(index, QtCore.Qt.DecorationRole))
+        return cls(names, icons, parent=parent)
+
+    @property
+    def case_sensitive(self):
+        """ True to match the prefix case. """
+        return self._matcher.case_sensitive
+
+    @case_sensitive.setter
+    def case_sensitive(self, value):
+        self._matcher.case_sensitive = value
+
+    @property
+    def prefix(self):
+        """ The current prefix. """
+        return self._matcher.pattern
+
+    def set_prefix(self, prefix):
+        """
+        Filters and sorts the completions for a new prefix.
+
+        :param prefix: the completion prefix.
+        """
+        rows = self._matcher.match(prefix)
+        if rows != self._rows:
+            self.beginResetModel()
+            self._rows = rows
+            self.endResetModel()
+        else:
+            self._rows = rows
+
+    def rowCount(self, parent=QtCore.QModelIndex()):
+        if parent.isValid():
+            return 0
+        return len(self._rows)
+
+    def data(self, index, role=QtCore.Qt.DisplayRole):
+        if not index.isValid() or index.row() >= len(self._rows):
+            return None
+        i = self._rows[index.row()]
+        if role in (QtCore.Qt.DisplayRole, QtCore.Qt.EditRole):
+            return self._matcher.candidates[i]
+        if role == QtCore.Qt.DecorationRole:
+            return self._icons[i]
+        if role == QtCore.Qt.UserRole:
+            return self._matcher.scores[i]
+        return None
+
+
 class SubsequenceCompleter(QtWidgets.QCompleter):
     """
-    QCompleter specialised for subsequence matching
+    QCompleter specialised for subsequence matching: the completions are
+    filtered and ranked by a :class:`FuzzyCompletionModel`.
     """
     def __init__(self, *args):
         super(SubsequenceCompleter, self).__init__(*args)
         self.local_completion_prefix = ""
         self.source_model = None
-        self.filterProxyModel = SubsequenceSortFilterProxyModel(
-            self.caseSensitivity(), parent=self)
-        self.filterProxyModel.setSortRole(QtCore.Qt.UserRole)
-        self._force_next_update = True
+        self.fuzzy_model = FuzzyCompletionModel(parent=self)
 
     def setModel(self, model):
+        """
+        Sets the completion model, models that are not a
+        :class:`FuzzyCompletionModel` are converted.
+        """
         self.source_model = model
-        self.filterProxyModel = SubsequenceSortFilterProxyModel(
-            self.caseSensitivity(), parent=self)
-        self.filterProxyModel.setSortRole(QtCore.Qt.UserRole)
-        self.filterProxyModel.set_prefix(self.local_completion_prefix)
-        self.filterProxyModel.setSourceModel(self.source_model)
-        super(SubsequenceCompleter, self).setModel(self.filterProxyModel)
-        self.filterProxyModel.invalidate()
-        self.filterProxyModel.sort(0)
-        self._force_next_update = True
+        if not isinstance(model, FuzzyCompletionModel):
+            model = FuzzyCompletionModel.from_model(model, parent=self)
+        self.fuzzy_model = model
+        self.update_model()
+        super(SubsequenceCompleter, self).setModel(model)
 
     def update_model(self):
-        if (self.completionCount() or
-                len(self.local_completion_prefix) <= 1 or
-                self._force_next_update):
-            self.filterProxyModel.set_prefix(self.local_completion_prefix)
-            self.filterProxyModel.invalidate()  # force sorting/filtering
-        if self.completionCount() > 1:
-            self.filterProxyModel.sort(0)
-        self._force_next_update = False
+        self.fuzzy_model.case_sensitive = (
+            self.caseSensitivity() == QtCore.Qt.CaseSensitive)
+        self.fuzzy_model.set_prefix(self.local_completion_prefix)
 
     def splitPath(self, path):
         self.local_completion_prefix = path
@@ -277,6 +361,57 @@ class CodeCompletionMode(Mode, QtCore.QObject):
                     # this should never happen since we're working with clones
                     pass
 
+    @property
+    def max_completions(self):
+        """
+        Maximum number of completions requested at once: the backend ranks
+        the completions for the current prefix and only sends the best ones
+        (see :class:`pyqode.core.backend.completion.CompletionIndex`), the
+        next ones are requested when the user scrolls to the end of the
+        completion list. None (the default) to request all the completions
+        and let the completer filter them.
+        """
+        return self._max_completions
+
+    @max_completions.setter
+    def max_completions(self, value):
+        self._max_completions = value
+        if self.editor:
+            # propagate changes to every clone
+            for clone in self.editor.clones:
+                try:
+                    clone.modes.get(CodeCompletionMode).max_completions = \
+                        value
+                except KeyError:
+                    # this should never happen since we're working with clones
+                    pass
+
+    @property
+    def concurrent_providers(self):
+        """
+        True to run the completion providers of the backend concurrently,
+        each one with its own time budget (see
+        :meth:`pyqode.core.backend.CodeCompletionWorker.complete_concurrently`).
+        The completions of the providers that return in time are shown
+        first, the completions of the late providers are added to the
+        completion list as soon as they are available. Default is False: the
+        first provider that returns wins.
+        """
+        return self._concurrent_providers
+
+    @concurrent_providers.setter
+    def concurrent_providers(self, value):
+        self._concurrent_providers = value
+        if self.editor:
+            # propagate changes to every clone
+            for clone in self.editor.clones:
+                try:
+                    clone.modes.get(
+                        CodeCompletionMode).concurrent_providers = value
+                except KeyError:
+                    # this should never happen since we're working with clones
+                    pass
+
     def __init__(self):
         Mode.__init__(self)
         QtCore.QObject.__init__(self)
@@ -292,6 +427,25 @@ class CodeCompletionMode(Mode, QtCore.QObject):
         self._tooltips = {}
         self._show_tooltips = False
         self._request_id = self._last_request_id = 0
+        self._max_completions = None
+        self._concurrent_providers = False
+        #: completions of the last request and total number of matching
+        #: completions (if the backend did not send all of them)
+        self._completions = []
+        self._completions_total = 0
+        #: number of ranked completions received (the completions of the
+        #: late providers are not counted) and whether the backend sent
+        #: the best completions of a late provider only
+        self._completions_received = 0
+        self._late_truncated = False
+        #: request id of the last received batch of concurrent completions
+        self._batch_request_id = None
+        #: prefix of the last request
+        self._requested_prefix = ''
+        self._fetching_more = False
+        #: completion session: (line, word start column, prefix, filtered)
+        #: of the completions that are in the model, see _session_covers
+        self._session = None
 
     def clone_settings(self, original):
         self.trigger_key = original.trigger_key
@@ -299,6 +453,8 @@ class CodeCompletionMode(Mode, QtCore.QObject):
         self.trigger_symbols = original.trigger_symbols
         self.show_tooltips = original.show_tooltips
         self.case_sensitive = original.case_sensitive
+        self.max_completions = original.max_completions
+        self.concurrent_providers = original.concurrent_providers
 
     #
     # Mode interface
@@ -323,6 +479,8 @@ class CodeCompletionMode(Mode, QtCore.QObject):
         self._completer.highlighted.connect(
             self._on_selected_completion_changed)
         self._completer.highlighted.connect(self._display_completion_tooltip)
+        self._completer.popup().verticalScrollBar().valueChanged.connect(
+            self._on_popup_scrolled)
 
     def on_install(self, editor):
         self._create_completer()
@@ -371,6 +529,7 @@ class CodeCompletionMode(Mode, QtCore.QObject):
                 event.accept()
             elif event.key() == QtCore.Qt.Key_End:
                 self._show_popup(index=self._completer.completionCount() - 1)
+                self._fetch_more_completions()
                 event.accept()
 
         debug('key pressed: %s' % event.text())
@@ -383,6 +542,7 @@ class CodeCompletionMode(Mode, QtCore.QObject):
                 _handle_completer_events()
         elif is_shortcut:
             self._reset_sync_data()
+            self._session = None
             self.request_completion()
             event.accept()
 
@@ -406,6 +566,7 @@ class CodeCompletionMode(Mode, QtCore.QObject):
             if event.text() in self._trigger_symbols:
                 # symbol trigger, force request
                 self._reset_sync_data()
+                self._session = None
                 self.request_completion()
             elif len(word) >= self._trigger_len and event.text() not in \
                     self.editor.word_separators:
@@ -446,7 +607,7 @@ class CodeCompletionMode(Mode, QtCore.QObject):
                         results, self.completion_prefix)
         context = results[0]
         results = results[1:]
-        line, column, request_id = context
+        line, column, request_id = context[:3]
         debug('request context: %r', context)
         debug('latest context: %r', (self._last_cursor_line,
                                                self._last_cursor_column,
@@ -458,10 +619,135 @@ class CodeCompletionMode(Mode, QtCore.QObject):
                 all_results = []
                 for res in results:
                     all_results += res
+                self._completions = all_results
+                self._completions_received = len(all_results)
+                self._completions_total = (
+                    context[3] if len(context) > 3 else len(all_results))
+                self._late_truncated = False
+                if request_id == self._request_id - 1:
+                    self._session = (line, column, self._requested_prefix,
+                                     len(context) > 3)
+                else:
+                    self._session = None
                 self._show_completions(all_results)
         else:
             debug('outdated request, dropping')
 
+    def _on_completion_items(self, items):
+        """
+        Handles the ``[context, completions]`` items of a concurrent request
+        (streamed or not): the first item holds the completions of the
+        providers that returned in time, the next ones hold the completions
+        of the late providers.
+        """
+        for context, completions in items:
+            if context[2] != self._batch_request_id:
+                self._batch_request_id = context[2]
+                self._on_results_available([context, completions])
+            else:
+                self._on_late_results_available(context, completions)
+
+    def _on_late_results_available(self, context, completions):
+        line, column, request_id = context[:3]
+        if (request_id != self._last_request_id or
+                line != self._last_cursor_line or
+                column != self._last_cursor_column or
+                not self.editor):
+            debug('outdated late completions, dropping')
+            return
+        if len(context) > 3 and context[3] > len(completions):
+            self._late_truncated = True
+        debug('%d late completions received', len(completions))
+        self._add_completions(completions)
+
+    def _on_more_results_available(self, results):
+        if results and results[0][2] != self._request_id - 1:
+            # the page requests are not superseded, a page of a previous
+            # request may still arrive
+            debug('outdated page, dropping')
+            return
+        self._fetching_more = False
+        if not results:
+            return
+        context = results[0]
+        line, column, _ = context[:3]
+        if (line != self._last_cursor_line or
+                column != self._last_cursor_column or
+                not self.editor):
+            debug('outdated request, dropping')
+            return
+        completions = []
+        for res in results[1:]:
+            completions += res
+        self._completions_received += len(completions)
+        self._completions_total = context[3]
+        debug('%d/%d completions received', self._completions_received,
+              self._completions_total)
+        self._add_completions(completions)
+
+    def _on_more_items_available(self, items):
+        self._on_more_results_available(items[0] if items else None)
+
+    def _add_completions(self, completions):
+        """
+        Adds completions to the completion list (the names that are already
+        in the list are dropped), keeps the current row of the popup.
+        """
+        names = set(completion['name'] for completion in self._completions)
+        completions = [completion for completion in completions
+                       if completion['name'] not in names]
+        if not completions:
+            return
+        row = self._completer.popup().currentIndex().row()
+        self._completions += completions
+        self._update_model(self._completions)
+        self._show_popup(index=max(row, 0))
+
+    def _on_popup_scrolled(self, value):
+        scroll_bar = self._completer.popup().verticalScrollBar()
+        if value and value == scroll_bar.maximum():
+            self._fetch_more_completions()
+
+    def _has_more_completions(self):
+        return self._completions_total > self._completions_received
+
+    def _has_missing_completions(self):
+        """
+        True if the backend did not send all the matching completions: the
+        list can't be filtered locally for another prefix.
+        """
+        return self._has_more_completions() or self._late_truncated
+
+    def _fetch_more_completions(self):
+        """
+        Requests the next completions, if the backend did not send all the
+        matching completions.
+        """
+        if (self._fetching_more or not self._has_more_completions() or
+                self._max_completions is None or
+                not self._is_popup_visible()):
+            return
+        data = self._request_data(self._last_cursor_line,
+                                  self._last_cursor_column,
+                                  self._requested_prefix,
+                                  self._request_id - 1)
+        data['offset'] = self._completions_received
+        if self._concurrent_providers:
+            on_receive = self._on_more_items_available
+        else:
+            on_receive = self._on_more_results_available
+        try:
+            # the request must not supersede the request it pages, which
+            # may still be streaming the completions of the late providers
+            self.editor.backend.send_request(
+                backend.CodeCompletionWorker, args=data,
+                on_receive=on_receive,
+                priority=backend.PRIORITY_INTERACTIVE, supersede=False,
+                document='code')
+        except NotRunning:
+            return
+        self._fetching_more = True
+
     #
     # Helper methods
     #
@@ -480,6 +766,21 @@ class CodeCompletionMode(Mode, QtCore.QObject):
             len(self.completion_prefix)
         same_context = (line == self._last_cursor_line and
                         column == self._last_cursor_column)
+        if not same_context and self._session_covers(
+                line, column, self.completion_prefix):
+            # the user is refining the prefix of the word that has already
+            # been completed: filter the completions locally
+            debug('filtering the completions of the session locally')
+            self._last_cursor_line = line
+            self._last_cursor_column = column
+            self._show_popup()
+            return True
+        if same_context and self._has_missing_completions() and \
+                self.completion_prefix != self._requested_prefix:
+            # the backend only sent the best completions for the previous
+            # prefix, they can't be filtered locally
+            debug('prefix changed, requesting the best completions again')
+            same_context = False
         if same_context:
             if self._request_id - 1 == self._last_request_id:
                 # context has not changed and the correct results can be
@@ -493,19 +794,21 @@ class CodeCompletionMode(Mode, QtCore.QObject):
             return True
         else:
             debug('requesting completion')
-            data = {
-                'code': self.editor.toPlainText(),
-                'line': line,
-                'column': column,
-                'path': self.editor.file.path,
-                'encoding': self.editor.file.encoding,
-                'prefix': self.completion_prefix,
-                'request_id': self._request_id
-            }
+            data = self._request_data(line, column, self.completion_prefix,
+                                      self._request_id)
+            if self._concurrent_providers:
+                # the completions of the late providers are streamed
+                data['stream'] = True
+                on_receive = on_chunk = self._on_completion_items
+            else:
+                on_receive = self._on_results_available
+                on_chunk = None
             try:
                 self.editor.backend.send_request(
                     backend.CodeCompletionWorker, args=data,
-                    on_receive=self._on_results_available)
+                    on_receive=on_receive, on_chunk=on_chunk,
+                    priority=backend.PRIORITY_INTERACTIVE, supersede=True,
+                    document='code')
             except NotRunning:
                 _logger().exception('failed to send the completion request')
                 return False
@@ -513,9 +816,50 @@ class CodeCompletionMode(Mode, QtCore.QObject):
                 debug('request sent: %r', data)
                 self._last_cursor_column = column
                 self._last_cursor_line = line
+                self._requested_prefix = data['prefix']
+                self._fetching_more = False
                 self._request_id += 1
                 return True
 
+    def _session_covers(self, line, column, prefix):
+        """
+        Checks if the completions of the current session can be filtered
+        locally for a prefix: the session must be about the same word
+        (line and word start column) and, if the backend filtered the
+        completions, the new prefix must extend the session prefix and all
+        the matching completions must have been received.
+        """
+        if self._session is None:
+            return False
+        session_line, session_column, session_prefix, filtered = \
+            self._session
+        if line != session_line or column != session_column:
+            return False
+        if not filtered:
+            return True
+        if self._has_missing_completions():
+            return False
+        if not self._case_sensitive:
+            prefix = prefix.lower()
+            session_prefix = session_prefix.lower()
+        return prefix.startswith(session_prefix)
+
+    def _request_data(self, line, column, prefix, request_id):
+        data = {
+            'line': line,
+            'column': column,
+            'path': self.editor.file.path,
+            'encoding': self.editor.file.encoding,
+            'prefix': prefix,
+            'request_id': request_id
+        }
+        if self._max_completions is not None:
+            data['limit'] = self._max_completions
+            data['case_sensitive'] = self._case_sensitive
+        if self._concurrent_providers:
+            data['concurrent'] = True
+        return data
+
     def _is_shortcut(self, event):
         """
         Checks if the event's key and modifiers make the completion shortcut
@@ -601,29 +945,43 @@ class CodeCompletionMode(Mode, QtCore.QObject):
 
     def _update_model(self, completions):
         """
-        Creates a QStandardModel that holds the suggestion from the completion
-        models for the QCompleter
+        Creates the model that holds the suggestion from the completion
+        models for the QCompleter: a :class:`FuzzyCompletionModel` for the
+        fuzzy filter mode, a QStandardItemModel otherwise.
 
-        :param completionPrefix:
+        :param completions: list of completion dicts.
         """
         # build the completion model
-        cc_model = QtGui.QStandardItemModel()
+        names = []
+        icons = []
+        qicons = {}
         self._tooltips.clear()
         for completion in completions:
             name = completion['name']
-            item = QtGui.QStandardItem()
-            item.setData(name, QtCore.Qt.DisplayRole)
+            names.append(name)
             if 'tooltip' in completion and completion['tooltip']:
                 self._tooltips[name] = completion['tooltip']
-            if 'icon' in completion:
-                icon = completion['icon']
-                if isinstance(icon, list):
-                    icon = QtGui.QIcon.fromTheme(icon[0], QtGui.QIcon(icon[1]))
-                else:
-                    icon = QtGui.QIcon(icon)
-                item.setData(QtGui.QIcon(icon),
-                             QtCore.Qt.DecorationRole)
-            cc_model.appendRow(item)
+            icon = completion.get('icon')
+            if icon is not None:
+                # most completions share a few icons
+                key = tuple(icon) if isinstance(icon, list) else icon
+                try:
+                    icon = qicons[key]
+                except (KeyError, TypeError):
+                    icon = self._make_icon(icon)
+                    if isinstance(key, (tuple, str)):
+                        qicons[key] = icon
+            icons.append(icon)
+        if isinstance(self._completer, SubsequenceCompleter):
+            cc_model = FuzzyCompletionModel(names, icons)
+        else:
+            cc_model = QtGui.QStandardItemModel()
+            for name, icon in zip(names, icons):
+                item = QtGui.QStandardItem()
+                item.setData(name, QtCore.Qt.DisplayRole)
+                if icon is not None:
+                    item.setData(icon, QtCore.Qt.DecorationRole)
+                cc_model.appendRow(item)
         try:
             self._completer.setModel(cc_model)
         except RuntimeError:
@@ -631,6 +989,12 @@ class CodeCompletionMode(Mode, QtCore.QObject):
             self._completer.setModel(cc_model)
         return cc_model
 
+    @staticmethod
+    def _make_icon(icon):
+        if isinstance(icon, list):
+            return QtGui.QIcon.fromTheme(icon[0], QtGui.QIcon(icon[1]))
+        return QtGui.QIcon(icon)
+
     def _display_completion_tooltip(self, completion):
         if not self._show_tooltips:
             return
@@ -3,7 +3,7 @@ This module contains the occurrences highlighter mode.
 """
 from qtpy import QtGui
 from pyqodeng.core.api import Mode, DelayJobRunner, TextHelper, TextDecoration
-from pyqodeng.core.backend import NotRunning
+from pyqodeng.core.backend import NotRunning, PRIORITY_INTERACTIVE
 from pyqodeng.core.backend.workers import findall
 
 
@@ -140,15 +140,16 @@ class OccurrencesHighlighterMode(Mode):
             select_whole_word=True).selectedText()
         if not cursor.hasSelection() or cursor.selectedText() == self._sub:
             request_data = {
-                'string': self.editor.toPlainText(),
                 'sub': self._sub,
                 'regex': False,
                 'whole_word': True,
                 'case_sensitive': self.case_sensitive
             }
             try:
-                self.editor.backend.send_request(findall, request_data,
-                                                 self._on_results_available)
+                self.editor.backend.send_request(
+                    findall, request_data, self._on_results_available,
+                    priority=PRIORITY_INTERACTIVE, supersede=True,
+                    document='string')
             except NotRunning:
                 self._request_highlight()
 
@@ -1,7 +1,7 @@
 import logging
 from pyqodeng.core.api import Mode
 from pyqodeng.core.api import DelayJobRunner
-from pyqodeng.core.backend import NotRunning
+from pyqodeng.core.backend import NotRunning, PRIORITY_BACKGROUND
 from pyqodeng.core.share import Definition
 from qtpy import QtCore
 
@@ -61,14 +61,15 @@ class OutlineMode(Mode, QtCore.QObject):
             return
         if self.enabled:
             request_data = {
-                'code': self.editor.toPlainText(),
                 'path': self.editor.file.path,
                 'encoding': self.editor.file.encoding
             }
             try:
                 self.editor.backend.send_request(
                     self._worker, request_data,
-                    on_receive=self._on_results_available)
+                    on_receive=self._on_results_available,
+                    priority=PRIORITY_BACKGROUND, supersede=True, cache=True,
+                    document='code')
             except NotRunning:
                 QtCore.QTimer.singleShot(100, self._run_analysis)
         else:
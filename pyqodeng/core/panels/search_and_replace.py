@@ -11,8 +11,8 @@ from pyqodeng.core._forms.search_panel_ui import Ui_SearchPanel
 from pyqodeng.core.api.decoration import TextDecoration
 from pyqodeng.core.api.panel import Panel
 from pyqodeng.core.api.utils import DelayJobRunner, TextHelper
-from pyqodeng.core.backend import NotRunning
-from pyqodeng.core.backend.workers import findall
+from pyqodeng.core.backend import NotRunning, PRIORITY_INTERACTIVE
+from pyqodeng.core.backend.workers import findall, findall_stream
 
 
 class SearchAndReplacePanel(Panel, Ui_SearchPanel):
@@ -89,6 +89,19 @@ class SearchAndReplacePanel(Panel, Ui_SearchPanel):
     #:    the extra selection used to highlight search result can be slow.
     MAX_HIGHLIGHTED_OCCURENCES = 500
 
+    #: Delay (in ms) after which the search is run in process if the backend
+    #: has not answered (e.g. because it is busy with other requests).
+    SEARCH_TIMEOUT = 500
+
+    #: Size (in characters) above which the occurrences are streamed: the
+    #: first ones are highlighted while the backend is still searching the
+    #: rest of the text. Streamed searches are never run in process.
+    STREAM_THRESHOLD = 100000
+
+    #: Delay (in ms) without any streamed occurrence after which a streamed
+    #: search is stopped (the occurrences already received are kept).
+    STREAM_TIMEOUT = 5000
+
     @property
     def background(self):
         """ Text decoration background """
@@ -140,6 +153,8 @@ class SearchAndReplacePanel(Panel, Ui_SearchPanel):
         self._separator = None
         self._decorations = []
         self._occurrences = []
+        #: occurrences received while the search is running
+        self._streamed_occurrences = []
         self._current_occurrence_index = 0
         self._bg = None
         self._fg = None
@@ -565,30 +580,74 @@ class SearchAndReplacePanel(Panel, Ui_SearchPanel):
         regex, case_sensitive, whole_word, in_selection = flags
         tc = self.editor.textCursor()
         assert isinstance(tc, QtGui.QTextCursor)
-        if in_selection and tc.hasSelection():
-            text = tc.selectedText()
-            self._offset = tc.selectionStart()
-        else:
-            text = self.editor.toPlainText()
-            self._offset = 0
         request_data = {
-            'string': text,
             'sub': sub,
             'regex': regex,
             'whole_word': whole_word,
             'case_sensitive': case_sensitive
         }
+        if in_selection and tc.hasSelection():
+            request_data['string'] = tc.selectedText()
+            self._offset = tc.selectionStart()
+            document = None
+        else:
+            # the backend already has (most of) the document text
+            self._offset = 0
+            document = 'string'
+        if document is None:
+            size = len(request_data['string'])
+        else:
+            size = self.editor.document().characterCount()
+        self._streamed_occurrences = []
         try:
-            self.editor.backend.send_request(findall, request_data,
-                                             self._on_results_available)
+            if size > self.STREAM_THRESHOLD:
+                self.editor.backend.send_request(
+                    findall_stream, request_data, self._on_results_available,
+                    priority=PRIORITY_INTERACTIVE, supersede=True,
+                    document=document, on_chunk=self._on_results_chunk,
+                    timeout=self.STREAM_TIMEOUT,
+                    on_timeout=self._on_stream_timeout)
+            else:
+                self.editor.backend.send_request(
+                    findall, request_data, self._on_results_available,
+                    priority=PRIORITY_INTERACTIVE, supersede=True,
+                    document=document, timeout=self.SEARCH_TIMEOUT,
+                    on_timeout=self._on_search_timeout, fallback=True)
         except AttributeError:
+            if document is not None:
+                request_data[document] = self.editor.toPlainText()
             self._on_results_available(findall(request_data))
         except NotRunning:
             QtCore.QTimer.singleShot(100, self.request_search)
 
+    def _on_search_timeout(self):
+        # the search is run again in process, from the start
+        self._streamed_occurrences = []
+
+    def _on_stream_timeout(self):
+        # the backend stopped streaming: keep what has been found
+        self._on_results_available([])
+
+    def _on_results_chunk(self, results):
+        if not self._streamed_occurrences:
+            self._clear_decorations()
+        first = len(self._streamed_occurrences)
+        self._streamed_occurrences += [
+            (start + self._offset, end + self._offset)
+            for start, end in results]
+        for start, end in self._streamed_occurrences[
+                first:self.MAX_HIGHLIGHTED_OCCURENCES]:
+            deco = self._create_decoration(start, end)
+            self._decorations.append(deco)
+            self.editor.decorations.append(deco)
+        self.cpt_occurences = len(self._streamed_occurrences)
+        self._update_label_matches()
+
     def _on_results_available(self, results):
-        self._occurrences = [(start + self._offset, end + self._offset)
-                             for start, end in results]
+        self._occurrences = self._streamed_occurrences + [
+            (start + self._offset, end + self._offset)
+            for start, end in results]
+        self._streamed_occurrences = []
         self._on_search_finished()
 
     def _update_label_matches(self):
@@ -0,0 +1,271 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Backend load test: starts the benchmark server (bench_server.py) and sends
+requests to it through the editors backend managers, with a fixed number
+of outstanding requests per editor. Reports the round trip latency
+percentiles and the throughput, plus the queue and execution latencies
+measured by the server (see :func:`pyqode.core.backend.stats_worker`).
+
+Examples::
+
+    # 2000 echo requests, 16 in flight
+    python3 bench_backend.py --requests 2000 --concurrency 16
+
+    # compare the transports for 1MB responses
+    python3 bench_backend.py --workload payload --transport unix
+    python3 bench_backend.py --workload payload --transport stdio
+
+    # 8 editors sharing a pool of 2 processes running CPU bound workers
+    python3 bench_backend.py --workload cpu --editors 8 --pool-size 2
+
+Run with ``--help`` to get the list of options.
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+
+from qtpy import QtCore, QtWidgets  # noqa: E402
+
+from pyqodeng.core.api import CodeEdit  # noqa: E402
+from pyqodeng.core.backend import NotRunning  # noqa: E402
+
+
+SERVER = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                      'bench_server.py')
+
+#: workload name -> worker name
+WORKERS = {
+    'echo': 'pyqodeng.core.backend.workers.echo_worker',
+    'cpu': 'bench_workers.cpu_worker',
+    'sleep': 'bench_workers.sleep_worker',
+    'payload': 'bench_workers.payload_worker',
+}
+
+
+def percentile(samples, percent):
+    """
+    Returns a percentile of the samples (nearest rank method).
+
+    :param samples: sorted list of values.
+    :param percent: the percentile, between 0 and 100.
+    """
+    if not samples:
+        return 0.0
+    rank = max(1, int(round(percent / 100.0 * len(samples))))
+    return samples[min(rank, len(samples)) - 1]
+
+
+class Benchmark(object):
+    """
+    Drives the backend of the editors: each editor keeps ``concurrency``
+    requests in flight until ``requests`` responses have been received.
+    """
+    def __init__(self, app, args):
+        self.app = app
+        self.args = args
+        self.worker = WORKERS[args.workload]
+        self.data = {'iterations': args.iterations, 'delay': args.delay,
+                     'size': args.payload_size}
+        if args.workload == 'echo':
+            self.data = 'x' * args.request_size
+        self.editors = []
+        self.latencies = []
+        self.sent = 0
+        self.received = 0
+        self.start_time = None
+        self.end_time = None
+        self.stats = None
+        # the client keeps weak references to the callbacks
+        self._callbacks = {}
+
+    def start(self):
+        """ Starts the backends and sends the warmup requests """
+        server_args = ['--server', self.args.server,
+                       '--workers', str(self.args.workers),
+                       '--executor', self.args.executor]
+        server_args += self.args.server_arg
+        for i in range(self.args.editors):
+            editor = CodeEdit()
+            editor.file._path = os.path.join(os.getcwd(), 'file%d.py' % i)
+            editor.backend.start(
+                SERVER, args=server_args, transport=self.args.transport,
+                pool_size=self.args.pool_size or None,
+                reuse=self.args.reuse)
+            self.editors.append(editor)
+        self._pending_warmup = len(self.editors) * self.args.warmup
+        if not self._pending_warmup:
+            self._run()
+            return
+        for editor in self.editors:
+            for _ in range(self.args.warmup):
+                self._send(editor, self._on_warmup_received)
+
+    def _send(self, editor, callback):
+        key = object()
+
+        def on_receive(results):
+            self._callbacks.pop(key, None)
+            callback(editor)
+
+        self._callbacks[key] = on_receive
+        try:
+            editor.backend.send_request(self.worker, self.data,
+                                        on_receive=on_receive)
+        except NotRunning:
+            self._callbacks.pop(key, None)
+            # not ready yet, try again a bit later
+            QtCore.QTimer.singleShot(
+                10, lambda: self._send(editor, callback))
+
+    def _on_warmup_received(self, editor):
+        self._pending_warmup -= 1
+        if not self._pending_warmup:
+            self._run()
+
+    def _run(self):
+        """ Starts the measured requests """
+        self.start_time = time.perf_counter()
+        for editor in self.editors:
+            for _ in range(self.args.concurrency):
+                self._send_next(editor)
+
+    def _send_next(self, editor):
+        if self.sent >= self.args.requests:
+            return
+        self.sent += 1
+        sent_at = time.perf_counter()
+
+        def on_received(editor):
+            self.latencies.append(time.perf_counter() - sent_at)
+            self.received += 1
+            if self.received == self.args.requests:
+                self.end_time = time.perf_counter()
+                self._request_stats()
+            else:
+                self._send_next(editor)
+
+        self._send(editor, on_received)
+
+    def _request_stats(self):
+        def on_stats(stats):
+            self.stats = stats
+            self.app.quit()
+
+        self._on_stats = on_stats
+        self.editors[0].backend.request_stats(on_stats)
+
+    def stop(self):
+        """ Stops the backends """
+        for editor in self.editors:
+            editor.backend.stop()
+            editor.close()
+
+    def report(self):
+        """
+        Returns the results of the benchmark (dict), latencies are in
+        milliseconds.
+        """
+        latencies = sorted(self.latencies)
+        elapsed = ((self.end_time or time.perf_counter()) -
+                   (self.start_time or time.perf_counter()))
+        report = {
+            'workload': self.args.workload,
+            'transport': self.args.transport,
+            'server': self.args.server,
+            'editors': self.args.editors,
+            'concurrency': self.args.concurrency,
+            'requests': self.received,
+            'elapsed': elapsed,
+            'requests_per_second': self.received / elapsed if elapsed else 0,
+        }
+        for percent in (50, 95, 99):
+            report['p%d' % percent] = percentile(latencies, percent) * 1000
+        report['max'] = latencies[-1] * 1000 if latencies else 0.0
+        if self.stats is not None:
+            worker = self.stats['workers'].get(self.worker, {})
+            for name in ('queue', 'execution'):
+                hist = worker.get(name)
+                if hist:
+                    report['server_%s_p50' % name] = hist['p50'] * 1000
+                    report['server_%s_p99' % name] = hist['p99'] * 1000
+        return report
+
+
+def print_report(report):
+    print('%(workload)s workload, %(transport)s transport, %(server)s '
+          'server, %(editors)d editor(s) x %(concurrency)d in flight'
+          % report)
+    print('  %(requests)d requests in %(elapsed).2fs: '
+          '%(requests_per_second).0f req/s' % report)
+    print('  round trip (ms): p50=%(p50).2f p95=%(p95).2f p99=%(p99).2f '
+          'max=%(max).2f' % report)
+    for name in ('queue', 'execution'):
+        if 'server_%s_p50' % name in report:
+            print('  server %s (ms): p50<=%.2f p99<=%.2f' % (
+                name, report['server_%s_p50' % name],
+                report['server_%s_p99' % name]))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--workload', choices=sorted(WORKERS),
+                        default='echo', help='worker to run')
+    parser.add_argument('--requests', type=int, default=1000,
+                        help='number of measured requests')
+    parser.add_argument('--warmup', type=int, default=10,
+                        help='number of requests sent by each editor before '
+                        'measuring')
+    parser.add_argument('--concurrency', type=int, default=8,
+                        help='number of requests in flight per editor')
+    parser.add_argument('--editors', type=int, default=1,
+                        help='number of editors')
+    parser.add_argument('--pool-size', type=int, default=0,
+                        help='share a pool of backend processes between the '
+                        'editors')
+    parser.add_argument('--reuse', action='store_true',
+                        help='share one backend process between the editors')
+    parser.add_argument('--transport', choices=['tcp', 'unix', 'stdio'],
+                        default='tcp')
+    parser.add_argument('--server', choices=['threading', 'asyncio'],
+                        default='threading')
+    parser.add_argument('--workers', type=int, default=1,
+                        help='number of worker slots of the server')
+    parser.add_argument('--executor', choices=['thread', 'process'],
+                        default='thread')
+    parser.add_argument('--server-arg', action='append', default=[],
+                        help='additional server option (can be repeated)')
+    parser.add_argument('--iterations', type=int, default=10000,
+                        help='iterations of the cpu workload')
+    parser.add_argument('--delay', type=float, default=0.01,
+                        help='delay (in seconds) of the sleep workload')
+    parser.add_argument('--payload-size', type=int, default=1024 * 1024,
+                        help='response size of the payload workload')
+    parser.add_argument('--request-size', type=int, default=100,
+                        help='request size of the echo workload')
+    parser.add_argument('--timeout', type=float, default=300,
+                        help='maximum duration (in seconds)')
+    parser.add_argument('--json', action='store_true',
+                        help='print the report as json')
+    args = parser.parse_args()
+
+    app = QtWidgets.QApplication(sys.argv)
+    benchmark = Benchmark(app, args)
+    QtCore.QTimer.singleShot(0, benchmark.start)
+    QtCore.QTimer.singleShot(int(args.timeout * 1000), app.quit)
+    app.exec_()
+    benchmark.stop()
+    report = benchmark.report()
+    if args.json:
+        print(json.dumps(report, indent=2, sort_keys=True))
+    else:
+        print_report(report)
+    return 0 if report['requests'] == args.requests else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
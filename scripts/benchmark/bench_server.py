@@ -0,0 +1,12 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Backend server used by the benchmark: the synthetic workers of
+bench_workers.py are importable because the directory of this script is on
+sys.path.
+"""
+from pyqodeng.core import backend
+
+
+if __name__ == '__main__':
+    backend.serve_forever()
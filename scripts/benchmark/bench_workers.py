@@ -0,0 +1,32 @@
+# -*- coding: utf-8 -*-
+"""
+Synthetic workers used by the backend benchmark.
+"""
+import time
+
+
+def cpu_worker(data):
+    """
+    CPU bound worker: sums the squares of the first ``data['iterations']``
+    integers.
+    """
+    total = 0
+    for i in range(data.get('iterations', 10000)):
+        total += i * i
+    return total
+
+
+def sleep_worker(data):
+    """
+    Worker that waits ``data['delay']`` seconds (e.g. an I/O bound checker).
+    """
+    time.sleep(data.get('delay', 0.01))
+    return True
+
+
+def payload_worker(data):
+    """
+    Worker that returns a payload of ``data['size']`` bytes, to measure the
+    cost of the serialisation and of the transport.
+    """
+    return 'x' * data.get('size', 1024 * 1024)
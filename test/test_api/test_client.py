@@ -2,3 +2,64 @@
 """
 Test the client/server API
 """
+from qtpy import QtGui, QtWidgets
+
+from pyqodeng.core.api.client import DocumentTracker
+from pyqodeng.core.backend.documents import Document
+
+
+def _sync(tracker, document):
+    """ Synchronises the server document with the changes of the tracker """
+    changes = tracker.changes_since(document.version)
+    assert changes is not None
+    document.apply_changes(changes)
+    document.version = tracker.version
+    assert document.text == tracker.document.toPlainText()
+
+
+def test_document_tracker_non_bmp():
+    editor = QtWidgets.QPlainTextEdit()
+    editor.setPlainText('a\U0001f600b\nc d')
+    tracker = DocumentTracker(editor.document())
+    document = Document(tracker.id, tracker.version, tracker.text())
+    assert document.text == editor.toPlainText()
+    cursor = editor.textCursor()
+    # type after a non-BMP character
+    cursor.setPosition(3)
+    cursor.insertText('x')
+    _sync(tracker, document)
+    # type non-BMP characters and soft line breaks
+    cursor.movePosition(QtGui.QTextCursor.End)
+    cursor.insertText('\U0001f601y\u2028z')
+    _sync(tracker, document)
+    # delete a non-BMP character
+    cursor.setPosition(1)
+    cursor.setPosition(3, QtGui.QTextCursor.KeepAnchor)
+    cursor.removeSelectedText()
+    _sync(tracker, document)
+    # delete a soft line break
+    cursor.movePosition(QtGui.QTextCursor.End)
+    cursor.deletePreviousChar()
+    cursor.deletePreviousChar()
+    _sync(tracker, document)
+    # several changes synchronised at once
+    version = document.version
+    cursor.setPosition(0)
+    cursor.insertText('\U0001f602\n')
+    cursor.movePosition(QtGui.QTextCursor.End)
+    cursor.insertText(' end')
+    assert len(tracker.changes_since(version)) == 2
+    _sync(tracker, document)
+    assert document.text == '\U0001f602\naxb\nc d\U0001f601y end'
+
+
+def test_document_tracker_soft_line_break():
+    editor = QtWidgets.QPlainTextEdit()
+    editor.setPlainText('a b')
+    tracker = DocumentTracker(editor.document())
+    document = Document(tracker.id, tracker.version, tracker.text())
+    cursor = editor.textCursor()
+    cursor.setPosition(1)
+    cursor.insertText('\u2028c\xa0')
+    _sync(tracker, document)
+    assert document.text == 'a\nc  b'
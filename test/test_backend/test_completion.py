@@ -0,0 +1,150 @@
+"""
+Tests the completion index.
+"""
+import time
+
+from pyqodeng.core.backend import completion
+from pyqodeng.core.backend import workers
+
+
+def _names(completions):
+    return [item['name'] for item in completions]
+
+
+def _index(names):
+    return completion.CompletionIndex([{'name': name} for name in names])
+
+
+def test_prefix_first():
+    index = _index(['get_value', 'set_value', 'getter', 'widget', 'Get'])
+    completions, total = index.search('get')
+    assert total == 4
+    assert _names(completions) == ['getter', 'get_value', 'Get', 'widget']
+    completions, total = index.search('Get', case_sensitive=True)
+    assert _names(completions) == ['Get']
+    assert total == 1
+
+
+def test_count_ranking():
+    index = completion.CompletionIndex([
+        {'name': 'getter', 'count': 1}, {'name': 'get_value', 'count': 5},
+        {'name': 'gxv', 'count': 1}, {'name': 'gyv', 'count': 4}])
+    completions, total = index.search('get')
+    assert _names(completions) == ['get_value', 'getter']
+    completions, total = index.search('gv')
+    assert _names(completions) == ['get_value', 'gyv', 'gxv']
+
+
+def test_subsequence_ranking():
+    index = _index(['xsetvalue', 'set_value', 'value', 'sv'])
+    completions, total = index.search('sv')
+    assert total == 3
+    assert _names(completions) == ['sv', 'set_value', 'xsetvalue']
+
+
+def test_limit_offset():
+    names = ['item%03d' % i for i in range(100)] + ['other']
+    index = _index(names)
+    completions, total = index.search('item', limit=10)
+    assert total == 100
+    assert _names(completions) == names[:10]
+    completions, total = index.search('item', limit=10, offset=95)
+    assert _names(completions) == names[95:100]
+    completions, total = index.search('', limit=5, offset=99)
+    assert total == 101
+    assert _names(completions) == ['item099', 'other']
+
+
+def test_long_prefix():
+    index = _index(['a' * 30, 'a' * 20 + 'b' * 10])
+    completions, total = index.search('a' * 25)
+    assert _names(completions) == ['a' * 30]
+    assert total == 1
+
+
+class _StaticProvider(object):
+    def __init__(self, names):
+        self.completions = [{'name': name} for name in names]
+
+    def complete(self, *args):
+        return self.completions
+
+
+def test_worker_limit(monkeypatch):
+    provider = _StaticProvider(['foo', 'foobar', 'bar', 'fizz_old'])
+    monkeypatch.setattr(workers.CodeCompletionWorker, 'providers',
+                        [provider])
+    worker = workers.CodeCompletionWorker()
+    data = {'code': '', 'line': 1, 'column': 0, 'path': '',
+            'encoding': 'utf-8', 'prefix': 'fo', 'request_id': 3,
+            'limit': 2}
+    context, completions = worker(data)
+    assert context == (1, 0, 3, 3)
+    assert _names(completions) == ['foo', 'foobar']
+    index = worker._indexes[-1]
+    data['offset'] = 2
+    context, completions = worker(data)
+    assert _names(completions) == ['fizz_old']
+    # the index is reused as long as the provider completions do not change
+    assert worker._indexes == [index]
+    del data['limit']
+    assert worker(data) == [(1, 0, 3), provider.completions]
+
+
+class _SlowProvider(_StaticProvider):
+    budget = 0.05
+
+    def complete(self, *args):
+        time.sleep(0.3)
+        return self.completions
+
+
+class _FailingProvider(object):
+    def complete(self, *args):
+        raise ValueError()
+
+
+def test_worker_concurrent(monkeypatch):
+    monkeypatch.setattr(workers.CodeCompletionWorker, 'providers', [
+        _SlowProvider(['qux', 'foo']), _FailingProvider(),
+        _StaticProvider(['foo', 'bar']), _StaticProvider(['foo', 'baz'])])
+    worker = workers.CodeCompletionWorker()
+    data = {'code': '', 'line': 1, 'column': 0, 'path': '',
+            'encoding': 'utf-8', 'prefix': '', 'request_id': 3,
+            'concurrent': True}
+    start = time.time()
+    items = list(worker(data))
+    # the slow provider is not waited for
+    assert time.time() - start < 0.25
+    assert [item[0] for item in items] == [(1, 0, 3)]
+    assert _names(items[0][1]) == ['foo', 'bar', 'baz']
+    # streamed: the late completions follow, without the duplicates
+    data['stream'] = True
+    data['limit'] = 10
+    items = list(worker(data))
+    assert [item[0] for item in items] == [(1, 0, 3, 3), (1, 0, 3, 1)]
+    assert [_names(item[1]) for item in items] == [
+        ['foo', 'bar', 'baz'], ['qux']]
+
+
+def test_worker_concurrent_threads(monkeypatch):
+    provider = _StaticProvider(['foo'])
+    monkeypatch.setattr(workers.CodeCompletionWorker, 'providers',
+                        [provider] * 4)
+    worker = workers.CodeCompletionWorker()
+    data = {'code': '', 'line': 1, 'column': 0, 'path': '',
+            'encoding': 'utf-8', 'prefix': '', 'request_id': 3,
+            'concurrent': True}
+    for _ in range(20):
+        assert _names(list(worker(data))[0][1]) == ['foo']
+    # the provider threads are reused
+    assert len(worker._pool._threads) <= worker.max_provider_threads
+    worker.shutdown()
+    assert worker._pool is None
+
+
+def test_subsequence_linear_time():
+    index = _index(['a' * 200 + str(i) for i in range(200)])
+    start = time.time()
+    assert index.search('aaaaz') == ([], 0)
+    assert time.time() - start < 1
@@ -0,0 +1,65 @@
+import random
+
+import pytest
+
+from pyqodeng.core.backend.documents import Document, DocumentStore
+
+
+def test_open_and_change():
+    store = DocumentStore()
+    store.open('doc', 0, 'hello world', path='/tmp/foo.py')
+    assert 'doc' in store
+    store.change('doc', 0, 2, [[0, 5, 'goodbye'], [7, 0, ' cruel']])
+    document = store.get('doc', 2)
+    assert document.text == 'goodbye cruel world'
+    assert document.path == '/tmp/foo.py'
+
+
+def test_apply_changes():
+    rand = random.Random(0)
+    for _ in range(200):
+        text = ''.join(rand.choice('abc\n')
+                       for _ in range(rand.randint(0, 50)))
+        document = Document('doc', 0, text)
+        changes = []
+        for _ in range(rand.randint(1, 20)):
+            position = rand.randint(0, len(text))
+            removed = rand.randint(0, len(text) - position)
+            added = ''.join(rand.choice('xyz') for _ in range(
+                rand.randint(0, 5)))
+            changes.append((position, removed, added))
+            text = text[:position] + added + text[position + removed:]
+        document.apply_changes(changes)
+        assert document.text == text
+
+
+def test_snapshot():
+    store = DocumentStore()
+    store.open('doc', 0, 'abc')
+    snapshot = store.get('doc')
+    store.change('doc', 0, 1, [[3, 0, 'def']])
+    assert snapshot.text == 'abc'
+    assert store.get('doc').text == 'abcdef'
+
+
+def test_out_of_sync():
+    store = DocumentStore()
+    store.open('doc', 3, 'abc')
+    with pytest.raises(KeyError):
+        store.get('doc', 2)
+    with pytest.raises(KeyError):
+        store.change('doc', 2, 4, [[0, 0, 'x']])
+    # the document must be sent again
+    assert 'doc' not in store
+
+
+def test_handle_message():
+    store = DocumentStore()
+    store.handle_message({'type': 'document', 'id': 'doc', 'version': 1,
+                          'text': 'foo', 'path': None})
+    store.handle_message({'type': 'document', 'id': 'doc',
+                          'base_version': 1, 'version': 2,
+                          'changes': [[1, 2, 'ish']]})
+    assert store.get('doc', 2).text == 'fish'
+    store.handle_message({'type': 'document', 'id': 'doc', 'close': True})
+    assert len(store) == 0
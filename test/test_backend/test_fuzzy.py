@@ -0,0 +1,41 @@
+"""
+Tests the fuzzy matching engine.
+"""
+from pyqodeng.core.backend.fuzzy import fuzzy_score, FuzzyMatcher
+
+
+def test_fuzzy_score():
+    assert fuzzy_score('xyz', 'foo') is None
+    assert fuzzy_score('', 'foo') == 0
+    # word boundaries
+    assert fuzzy_score('fb', 'foo_bar') > fuzzy_score('fb', 'xfooxbar')
+    assert fuzzy_score('fb', 'fooBar') > fuzzy_score('fb', 'foobar')
+    assert fuzzy_score('get', 'get_value') > fuzzy_score('get', 'widget')
+    # consecutive characters
+    assert fuzzy_score('abc', 'abcx') > fuzzy_score('abc', 'axbxc')
+    # case
+    assert fuzzy_score('Fo', 'Foo') > fuzzy_score('Fo', 'foo')
+    assert fuzzy_score('Fo', 'foo', case_sensitive=True) is None
+    # the shortest window is scored
+    assert fuzzy_score('ab', 'a_xxxx_ab') == fuzzy_score('ab', 'x_ab')
+    # characters that change length when lowered ('İ'.lower() has 2
+    # characters)
+    assert fuzzy_score(u'\u0130', u'\u0130x') is not None
+    assert fuzzy_score(u'\u0130x', u'\u0130x') is not None
+    assert fuzzy_score(u'x\u0130', u'xi\u0307') is not None
+
+
+def test_fuzzy_matcher():
+    candidates = ['get_value', 'set_value', 'getter', 'widget', 'Get', 'gv']
+    matcher = FuzzyMatcher(candidates)
+    assert matcher.match('') == list(range(len(candidates)))
+    matches = [candidates[i] for i in matcher.match('g')]
+    assert matches[-1] == 'widget'
+    assert 'set_value' not in matches
+    assert [candidates[i] for i in matcher.match('gv')] == ['gv', 'get_value']
+    assert matcher.scores[candidates.index('getter')] is None
+    assert matcher.scores[candidates.index('gv')] == fuzzy_score('gv', 'gv')
+    # shorter pattern: all the candidates are matched again
+    assert len(matcher.match('g')) == 5
+    matcher.case_sensitive = True
+    assert [candidates[i] for i in matcher.match('G')] == ['Get']
@@ -0,0 +1,37 @@
+"""
+Tests the backend metrics.
+"""
+from pyqodeng.core.backend.metrics import Histogram, Metrics
+
+
+def test_histogram():
+    hist = Histogram()
+    assert hist.percentile(50) == 0
+    for _ in range(90):
+        hist.add(0.0015)
+    for _ in range(10):
+        hist.add(0.3)
+    assert hist.count == 100
+    assert hist.max == 0.3
+    assert hist.percentile(50) == 0.002
+    assert hist.percentile(95) == 0.3
+    data = hist.to_dict()
+    assert data['p99'] == 0.3
+    assert data['buckets'][-1] == [None, 0]
+    assert sum(count for _, count in data['buckets']) == 100
+
+
+def test_snapshot():
+    metrics = Metrics()
+    metrics.gauges['queued'] = lambda: 3
+    metrics.increment('worker_a', 'calls')
+    metrics.increment('worker_a', 'request_bytes', 100)
+    metrics.increment('worker_b', 'calls', 2)
+    metrics.observe('worker_a', 'execution', 0.01)
+    snapshot = metrics.snapshot()
+    assert snapshot['gauges'] == {'queued': 3}
+    assert snapshot['totals'] == {'calls': 3, 'request_bytes': 100}
+    assert snapshot['workers']['worker_a']['execution']['count'] == 1
+    assert snapshot['workers']['worker_b'] == {'calls': 2}
+    metrics.reset()
+    assert metrics.snapshot()['workers'] == {}
@@ -0,0 +1,39 @@
+"""
+Tests the worker profiler.
+"""
+import os
+import pstats
+
+from pyqodeng.core.backend.profiler import WorkerProfiler, run_profiled
+
+
+def _fib(n):
+    return n if n < 2 else _fib(n - 1) + _fib(n - 2)
+
+
+def test_run_profiled():
+    results, raw_stats = run_profiled(_fib, 10)
+    assert results == 55
+    assert any(function == '_fib' for _, _, function in raw_stats)
+
+
+def test_aggregation(tmpdir):
+    profiler = WorkerProfiler()
+    for _ in range(2):
+        profiler.add('fib', run_profiled(_fib, 10)[1])
+    profiler.add('other', run_profiled(_fib, 5)[1])
+    summary = profiler.summary('fib', limit=5)
+    assert list(summary) == ['fib']
+    assert summary['fib']['requests'] == 2
+    assert len(summary['fib']['functions']) <= 5
+    fib = [f for f in summary['fib']['functions']
+           if f['function'].endswith('(_fib)')][0]
+    # 177 calls per run
+    assert fib['calls'] == 2 * 177
+    assert fib['primitive_calls'] == 2
+    profiler.directory = str(tmpdir)
+    profiler.dump()
+    stats = pstats.Stats(os.path.join(str(tmpdir), 'fib.prof'))
+    assert any(function == '_fib' for _, _, function in stats.stats)
+    profiler.reset()
+    assert profiler.summary() == {}
@@ -0,0 +1,99 @@
+"""
+Tests the message framing.
+"""
+import sys
+
+from pyqodeng.core.backend import protocol
+
+
+def _negotiated(**hello):
+    server_framing = protocol.Framing()
+    client_framing = protocol.Framing()
+    reply = server_framing.negotiate(client_framing.hello(**hello))
+    server_framing.configure(reply)
+    client_framing.configure(reply)
+    return server_framing, client_framing, reply
+
+
+def test_json_framing():
+    framing = protocol.Framing()
+    reader = protocol.FrameReader(protocol.Framing())
+    reader.feed(framing.encode({'request_id': '1', 'results': [1, 2]}))
+    assert list(reader) == [{'request_id': '1', 'results': [1, 2]}]
+    assert len(reader) == 0
+
+
+def test_negotiation():
+    server_framing, client_framing, reply = _negotiated()
+    assert reply['encoding'] == 'marshal'
+    assert reply['compression'] == 'zlib'
+    assert client_framing.marshal and client_framing.compact
+    # marshal is never used with a different python version
+    hello = client_framing.hello()
+    hello['python'] = [sys.version_info[0], sys.version_info[1] + 1]
+    assert protocol.Framing().negotiate(hello)['encoding'] == 'json'
+    # nor with an untrusted client
+    hello = client_framing.hello()
+    assert protocol.Framing().negotiate(
+        hello, allow_marshal=False)['encoding'] == 'json'
+    _, framing, reply = _negotiated(encodings=['json'], compression=False)
+    assert reply['encoding'] == 'json' and reply['compression'] is None
+    assert not framing.marshal and framing.compression_threshold is None
+
+
+def test_partial_frames():
+    server_framing, client_framing, _ = _negotiated()
+    messages = [{'request_id': str(i), 'results': list(range(i))}
+                for i in range(20)]
+    data = b''.join(server_framing.encode(m) for m in messages)
+    reader = protocol.FrameReader(client_framing)
+    received = []
+    # feed the frames byte by byte
+    for i in range(len(data)):
+        reader.feed(data[i:i + 1])
+        received += list(reader)
+    assert received == messages
+    assert len(reader) == 0
+
+
+def test_compression():
+    server_framing, client_framing, _ = _negotiated()
+    server_framing.compression_threshold = 100
+    obj = {'request_id': 'findall', 'results': [[0, 10]] * 1000}
+    frame = server_framing.encode(obj)
+    _, flags = protocol.COMPACT_HEADER.unpack_from(frame)
+    assert flags & protocol.FLAG_COMPRESSED
+    assert len(frame) < 1000
+    reader = protocol.FrameReader(client_framing)
+    reader.feed(frame)
+    assert list(reader) == [obj]
+
+
+def test_unmarshallable_object():
+    class Results(dict):
+        pass
+    server_framing, client_framing, _ = _negotiated()
+    frame = server_framing.encode(Results(results=[1]))
+    _, flags = protocol.COMPACT_HEADER.unpack_from(frame)
+    assert not flags & protocol.FLAG_MARSHAL
+    reader = protocol.FrameReader(client_framing)
+    reader.feed(frame)
+    assert list(reader) == [{'results': [1]}]
+
+
+def test_same_results_on_all_encodings():
+    obj = {'request_id': '1', 'results': [(0, 10), {1: 'a'}, [1.5, None]]}
+    expected = [{'request_id': '1',
+                 'results': [[0, 10], {'1': 'a'}, [1.5, None]]}]
+    marshal_framing, marshal_client, _ = _negotiated()
+    json_framing, json_client, _ = _negotiated(encodings=['json'])
+    for framing, client_framing in [(protocol.Framing(), protocol.Framing()),
+                                    (json_framing, json_client),
+                                    (marshal_framing, marshal_client)]:
+        reader = protocol.FrameReader(client_framing)
+        reader.feed(framing.encode(obj))
+        assert list(reader) == expected
+    # json objects are still marshalled
+    frame = marshal_framing.encode(expected[0])
+    _, flags = protocol.COMPACT_HEADER.unpack_from(frame)
+    assert flags & protocol.FLAG_MARSHAL
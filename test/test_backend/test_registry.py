@@ -0,0 +1,151 @@
+"""
+Tests the worker registry.
+"""
+import threading
+import time
+
+from pyqodeng.core.backend import registry
+from pyqodeng.core.backend import workers
+
+
+class StatefulWorker(object):
+    """ Worker that counts the requests it ran, per document. """
+    instances = 0
+
+    def __init__(self):
+        StatefulWorker.instances += 1
+        self.counts = {}
+        self.closed = []
+        self.stopped = False
+
+    def __call__(self, data):
+        document = workers.current_document()
+        key = document['id'] if document else None
+        self.counts[key] = self.counts.get(key, 0) + 1
+        return self.counts[key]
+
+    def on_document_closed(self, document_id):
+        self.closed.append(document_id)
+        self.counts.pop(document_id, None)
+
+    def shutdown(self):
+        self.stopped = True
+
+
+NAME = 'test.test_backend.test_registry.StatefulWorker'
+
+
+def test_worker_instantiated_once():
+    reg = registry.WorkerRegistry()
+    StatefulWorker.instances = 0
+    worker = reg.get(NAME)
+    assert reg.get(NAME) is worker
+    assert StatefulWorker.instances == 1
+    assert NAME in reg
+
+
+def test_register():
+    reg = registry.WorkerRegistry()
+    reg.register(workers.echo_worker)
+    assert 'pyqodeng.core.backend.workers.echo_worker' in reg
+    worker = reg.register(StatefulWorker, name='stateful')
+    assert reg.get('stateful') is worker
+
+
+def test_preload():
+    reg = registry.WorkerRegistry()
+    reg.preload([NAME, 'pyqodeng.core.backend.workers.unknown_worker'])
+    assert NAME in reg
+    assert len(reg) == 1
+
+
+def test_lifecycle_hooks():
+    reg = registry.WorkerRegistry()
+    worker = reg.get(NAME)
+    reg.get('pyqodeng.core.backend.workers.echo_worker')
+    reg.document_closed('doc')
+    assert worker.closed == ['doc']
+    reg.shutdown()
+    assert worker.stopped
+    assert len(reg) == 0
+
+
+def test_execute_worker_keeps_state():
+    registry.worker_registry.shutdown()
+    document = {'id': 'doc', 'version': 1, 'path': None}
+    assert registry.execute_worker(NAME, {}, document) == 1
+    assert registry.execute_worker(NAME, {}, document) == 2
+    assert registry.execute_worker(NAME, {}) == 1
+    assert workers.current_document() is None
+    registry.worker_registry.document_closed('doc')
+    assert registry.execute_worker(NAME, {}, document) == 1
+    assert registry.execute_worker('unknown.worker', {}) == []
+    registry.worker_registry.shutdown()
+
+
+def generator_worker(data):
+    """ Generator worker that yields ``data`` items. """
+    for i in range(data):
+        yield [i, workers.current_document()['id']]
+
+
+def test_execute_generator_worker(monkeypatch):
+    name = 'test.test_backend.test_registry.generator_worker'
+    document = {'id': 'doc', 'version': 1, 'path': None}
+    # not streamed: all the items are returned at once
+    results = registry.execute_worker(name, 5, document)
+    assert results == [[i, 'doc'] for i in range(5)]
+    # streamed: the first item is sent at once, then by chunks
+    monkeypatch.setattr(registry, 'CHUNK_SIZE', 2)
+    monkeypatch.setattr(registry, 'CHUNK_DELAY', 10)
+    chunks = []
+    assert registry.execute_worker(name, 5, document, chunks.append) == []
+    assert [len(chunk) for chunk in chunks] == [1, 2, 2]
+    assert sum(chunks, []) == [[i, 'doc'] for i in range(5)]
+
+
+def blocking_generator_worker(data):
+    """ Generator worker that blocks after its first items. """
+    for i in range(3):
+        yield i
+    time.sleep(data)
+    yield 3
+
+
+def test_streamed_chunk_delay(monkeypatch):
+    name = 'test.test_backend.test_registry.blocking_generator_worker'
+    monkeypatch.setattr(registry, 'CHUNK_DELAY', 0.05)
+    chunks = []
+
+    def on_chunk(items):
+        chunks.append((time.time(), items))
+
+    start = time.time()
+    assert registry.execute_worker(name, 0.5, None, on_chunk) == []
+    assert [items for _, items in chunks] == [[0], [1, 2], [3]]
+    # the buffered items are not held while the generator is blocked
+    assert chunks[1][0] - start < 0.3
+
+
+def slow_generator_worker(data):
+    """ Generator worker that yields its items slowly. """
+    for i in range(data):
+        time.sleep(0.01)
+        yield i
+
+
+def test_streamed_chunk_flusher(monkeypatch):
+    name = 'test.test_backend.test_registry.slow_generator_worker'
+    monkeypatch.setattr(registry, 'CHUNK_DELAY', 0.005)
+    chunks = []
+
+    def on_chunk(items):
+        chunks.append((threading.current_thread(), items))
+
+    assert registry.execute_worker(name, 30, None, on_chunk) == []
+    assert sum(len(items) for _, items in chunks) == 30
+    assert len(chunks) > 10
+    # the late chunks of the stream are sent by one single thread
+    flushers = set(thread for thread, _ in chunks[1:]
+                   if thread is not threading.current_thread())
+    assert len(flushers) == 1
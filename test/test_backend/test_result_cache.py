@@ -0,0 +1,40 @@
+"""
+Tests the result cache of the server.
+"""
+from pyqodeng.core.backend.cache import ResultCache
+
+
+def test_key():
+    key = ResultCache.key('worker', {'code': 'a', 'path': 'b'}, 'b')
+    assert key == ResultCache.key('worker', {'path': 'b', 'code': 'a'}, 'b')
+    assert key != ResultCache.key('worker', {'code': 'a', 'path': 'b'}, 'c')
+    assert key != ResultCache.key('other', {'code': 'a', 'path': 'b'}, 'b')
+    assert key != ResultCache.key('worker', {'code': 'A', 'path': 'b'}, 'b')
+
+
+def test_get_put():
+    cache = ResultCache()
+    assert cache.get(b'key') == (False, None)
+    cache.put(b'key', [1, 2])
+    assert b'key' in cache
+    assert cache.get(b'key') == (True, [1, 2])
+    assert cache.hits == 1
+    assert cache.misses == 1
+    cache.clear()
+    assert len(cache) == 0
+    assert cache.size == 0
+
+
+def test_lru_eviction():
+    cache = ResultCache(max_size=80)
+    cache.put(b'a', 'x' * 30)
+    cache.put(b'b', 'x' * 30)
+    cache.get(b'a')
+    cache.put(b'c', 'x' * 30)
+    assert b'a' in cache
+    assert b'b' not in cache
+    assert b'c' in cache
+    assert cache.size <= 80
+    # too large to be cached
+    cache.put(b'd', 'x' * 200)
+    assert b'd' not in cache
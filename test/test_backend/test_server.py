@@ -0,0 +1,621 @@
+"""
+Tests the json server using plain python sockets.
+"""
+import json
+import os
+import signal
+import socket
+import struct
+import subprocess
+import sys
+import threading
+import time
+
+import pytest
+
+from pyqodeng.core.backend import async_server
+from pyqodeng.core.backend import protocol
+from pyqodeng.core.backend import registry
+from pyqodeng.core.backend import server
+from pyqodeng.core.backend import workers
+
+
+def _send(sock, obj):
+    msg = json.dumps(obj).encode('utf-8')
+    sock.sendall(struct.pack('=I', len(msg)) + msg)
+
+
+def _recv_bytes(sock, size):
+    data = bytes()
+    while len(data) < size:
+        tmp = sock.recv(size - len(data))
+        assert tmp, 'connection closed by the server'
+        data += tmp
+    return data
+
+
+def _recv(sock):
+    size = struct.unpack('=I', _recv_bytes(sock, 4))[0]
+    return json.loads(_recv_bytes(sock, size).decode('utf-8'))
+
+
+def sleep_worker(data):
+    """ Worker that sleeps during ``data`` seconds. """
+    time.sleep(data)
+    return data
+
+
+def _start_server(*options):
+    test_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    test_socket.bind(('127.0.0.1', 0))
+    port = test_socket.getsockname()[1]
+    test_socket.close()
+    args = server.default_parser().parse_args([str(port)] + list(options))
+    if args.server == 'asyncio':
+        srv = async_server.AsyncJsonServer(args=args)
+    else:
+        srv = server.JsonServer(args=args)
+    thread = threading.Thread(target=srv.serve_forever)
+    thread.daemon = True
+    thread.start()
+    return srv
+
+
+def _stop_server(srv):
+    srv.shutdown()
+    srv.server_close()
+
+
+@pytest.fixture(params=['threading', 'asyncio'])
+def json_server(request):
+    srv = _start_server('--server', request.param)
+    yield srv
+    _stop_server(srv)
+
+
+def _connect(srv):
+    sock = socket.create_connection(('127.0.0.1', srv.port))
+    sock.settimeout(10)
+    return sock
+
+
+def test_persistent_connection(json_server):
+    sock = _connect(json_server)
+    try:
+        # pipeline a few requests on the same connection
+        for i in range(5):
+            _send(sock, {'request_id': str(i),
+                         'worker': 'pyqodeng.core.backend.echo_worker',
+                         'data': i})
+        responses = [_recv(sock) for _ in range(5)]
+    finally:
+        sock.close()
+    assert sorted(r['request_id'] for r in responses) == [
+        str(i) for i in range(5)]
+    for response in responses:
+        assert response['results'] == int(response['request_id'])
+
+
+def test_multiple_connections(json_server):
+    sock1 = _connect(json_server)
+    sock2 = _connect(json_server)
+    try:
+        _send(sock2, {'request_id': 'b',
+                      'worker': 'pyqodeng.core.backend.echo_worker',
+                      'data': 'b'})
+        assert _recv(sock2)['results'] == 'b'
+        _send(sock1, {'request_id': 'a',
+                      'worker': 'pyqodeng.core.backend.echo_worker',
+                      'data': 'a'})
+        assert _recv(sock1)['results'] == 'a'
+    finally:
+        sock1.close()
+        sock2.close()
+
+
+@pytest.mark.parametrize('executor', ['thread', 'process'])
+def test_concurrent_workers(executor):
+    srv = _start_server('--workers', '2', '--executor', executor)
+    sock = _connect(srv)
+    try:
+        _send(sock, {'request_id': 'slow',
+                     'worker': 'test.test_backend.test_server.sleep_worker',
+                     'data': 1})
+        _send(sock, {'request_id': 'fast',
+                     'worker': 'pyqodeng.core.backend.echo_worker',
+                     'data': 'fast'})
+        # the fast request is not blocked by the slow one
+        assert _recv(sock)['request_id'] == 'fast'
+        assert _recv(sock)['request_id'] == 'slow'
+    finally:
+        sock.close()
+        _stop_server(srv)
+
+
+def test_request_queue_priority():
+    requests = server.RequestQueue()
+    requests.put(server.PRIORITY_BACKGROUND, 'checker')
+    requests.put(server.PRIORITY_NORMAL, 'normal')
+    requests.put(server.PRIORITY_INTERACTIVE, 'completion-1')
+    requests.put(server.PRIORITY_INTERACTIVE, 'completion-2')
+    assert len(requests) == 4
+    assert requests.get() == 'completion-1'
+    assert requests.get() == 'completion-2'
+    assert requests.get() == 'normal'
+    assert requests.get() == 'checker'
+    assert len(requests) == 0
+
+
+def test_interactive_slot():
+    srv = _start_server('--workers', '1', '--interactive-slots', '1')
+    sock = _connect(srv)
+    try:
+        # a long background request occupies the regular slot
+        _send(sock, {'request_id': 'checker',
+                     'worker': 'test.test_backend.test_server.sleep_worker',
+                     'data': 1, 'priority': server.PRIORITY_BACKGROUND})
+        _send(sock, {'request_id': 'completion',
+                     'worker': 'pyqodeng.core.backend.echo_worker',
+                     'data': 'completion',
+                     'priority': server.PRIORITY_INTERACTIVE})
+        assert _recv(sock)['request_id'] == 'completion'
+        assert _recv(sock)['request_id'] == 'checker'
+    finally:
+        sock.close()
+        _stop_server(srv)
+
+
+def cancellable_worker(data):
+    """ Worker that runs until it gets cancelled (or 5 seconds elapsed). """
+    for _ in range(500):
+        if workers.is_cancelled():
+            return 'cancelled'
+        time.sleep(0.01)
+    return 'timeout'
+
+
+def test_cancel_running_request(json_server):
+    sock = _connect(json_server)
+    try:
+        _send(sock, {
+            'request_id': 'long',
+            'worker': 'test.test_backend.test_server.cancellable_worker',
+            'data': {}})
+        time.sleep(0.2)
+        _send(sock, {'type': 'cancel', 'request_id': 'long'})
+        response = _recv(sock)
+    finally:
+        sock.close()
+    assert response['request_id'] == 'long'
+    assert response['cancelled']
+    assert response['results'] == 'cancelled'
+
+
+def test_supersede_queued_requests():
+    srv = _start_server('--workers', '1')
+    sock = _connect(srv)
+    try:
+        # occupy the only worker slot
+        _send(sock, {'request_id': 'busy',
+                     'worker': 'test.test_backend.test_server.sleep_worker',
+                     'data': 0.5})
+        time.sleep(0.1)
+        for i in range(3):
+            _send(sock, {'request_id': str(i), 'group': 'checker',
+                         'worker': 'pyqodeng.core.backend.echo_worker',
+                         'data': i})
+        responses = dict((r['request_id'], r) for r in [
+            _recv(sock) for _ in range(4)])
+    finally:
+        sock.close()
+        _stop_server(srv)
+    assert responses['0']['cancelled']
+    assert responses['1']['cancelled']
+    assert 'cancelled' not in responses['2']
+    assert responses['2']['results'] == 2
+
+
+def test_document_requests(json_server):
+    sock = _connect(json_server)
+    request = {'sub': 'import', 'regex': False, 'whole_word': False,
+               'case_sensitive': True}
+    try:
+        _send(sock, {'type': 'document', 'id': 'doc', 'version': 1,
+                     'text': 'import os\n', 'path': None})
+        _send(sock, {'type': 'document', 'id': 'doc', 'base_version': 1,
+                     'version': 2, 'changes': [[10, 0, 'import sys\n']]})
+        _send(sock, {'request_id': 'search',
+                     'worker': 'pyqodeng.core.backend.workers.findall',
+                     'data': request,
+                     'document': {'id': 'doc', 'version': 2,
+                                  'key': 'string'}})
+        assert _recv(sock)['results'] == [[0, 6], [10, 16]]
+        # unknown version: the client is asked to send the full text
+        _send(sock, {'request_id': 'search-2',
+                     'worker': 'pyqodeng.core.backend.workers.findall',
+                     'data': request,
+                     'document': {'id': 'doc', 'version': 5,
+                                  'key': 'string'}})
+        assert _recv(sock)['resync'] == 'doc'
+    finally:
+        sock.close()
+
+
+def test_batch_requests(json_server):
+    sock = _connect(json_server)
+    findall = {'request_id': 'search',
+               'worker': 'pyqodeng.core.backend.workers.findall',
+               'data': {'sub': 'import', 'regex': False, 'whole_word': False,
+                        'case_sensitive': True}}
+    echo = {'request_id': 'echo',
+            'worker': 'pyqodeng.core.backend.echo_worker', 'data': {}}
+    try:
+        _send(sock, {'type': 'document', 'id': 'doc', 'version': 1,
+                     'text': 'import os\n', 'path': '/tmp/foo.py'})
+        _send(sock, {'type': 'batch', 'requests': [findall, echo],
+                     'document': {'id': 'doc', 'version': 1,
+                                  'key': 'string'}})
+        responses = {r['request_id']: r['results']
+                     for r in [_recv(sock), _recv(sock)]}
+        assert responses == {'search': [[0, 6]],
+                             'echo': {'string': 'import os\n'}}
+        # unknown version: each request asks for a resync
+        _send(sock, {'type': 'batch', 'requests': [findall, echo],
+                     'document': {'id': 'doc', 'version': 3,
+                                  'key': 'string'}})
+        responses = [_recv(sock), _recv(sock)]
+        assert sorted(r['request_id'] for r in responses) == [
+            'echo', 'search']
+        assert all(r['resync'] == 'doc' for r in responses)
+    finally:
+        sock.close()
+
+
+def test_streamed_request(json_server, monkeypatch):
+    monkeypatch.setattr(registry, 'CHUNK_SIZE', 2)
+    monkeypatch.setattr(registry, 'CHUNK_DELAY', 10)
+    sock = _connect(json_server)
+    request = {'request_id': 'search',
+               'worker': 'pyqodeng.core.backend.workers.findall_stream',
+               'data': {'string': 'a a a a a', 'sub': 'a', 'regex': False,
+                        'whole_word': False, 'case_sensitive': True}}
+    try:
+        # streamed: chunks, then an empty response
+        _send(sock, dict(request, stream=True))
+        chunks = []
+        response = _recv(sock)
+        while 'chunk' in response:
+            chunks.append(response['chunk'])
+            response = _recv(sock)
+        assert [len(chunk) for chunk in chunks] == [1, 2, 2]
+        assert sum(chunks, []) == [[i, i + 1] for i in range(0, 10, 2)]
+        assert response == {'request_id': 'search', 'results': []}
+        # not streamed: all the items in the response
+        _send(sock, request)
+        assert _recv(sock)['results'] == [[i, i + 1] for i in range(0, 10, 2)]
+    finally:
+        sock.close()
+
+
+def test_negotiated_framing(json_server):
+    sock = _connect(json_server)
+    framing = protocol.Framing()
+    reader = protocol.FrameReader(framing)
+
+    def recv():
+        obj = reader.read_frame()
+        while obj is None:
+            data = sock.recv(4096)
+            assert data, 'connection closed by the server'
+            reader.feed(data)
+            obj = reader.read_frame()
+        return obj
+
+    try:
+        sock.sendall(framing.encode(framing.hello()))
+        reply = recv()
+        assert reply['type'] == 'hello'
+        # any local user can connect to a tcp server
+        assert reply['encoding'] == 'json'
+        framing.configure(reply)
+        framing.compression_threshold = 1024
+        text = 'import os\n' * 10000
+        sock.sendall(framing.encode({
+            'request_id': 'search',
+            'worker': 'pyqodeng.core.backend.workers.findall',
+            'data': {'sub': 'os', 'regex': False, 'whole_word': True,
+                     'case_sensitive': True, 'string': text}}))
+        response = recv()
+    finally:
+        sock.close()
+    assert len(response['results']) == 10000
+
+
+def test_preloaded_workers():
+    registry.worker_registry.shutdown()
+    srv = _start_server(
+        '--preload', 'test.test_backend.test_registry.StatefulWorker')
+    try:
+        assert 'test.test_backend.test_registry.StatefulWorker' in \
+            registry.worker_registry
+    finally:
+        _stop_server(srv)
+    # the workers are released when the server shuts down
+    assert len(registry.worker_registry) == 0
+
+
+def test_keepalive(monkeypatch):
+    monkeypatch.setattr(server, 'HEARTBEAT_DELAY', 1)
+    srv = _start_server()
+    try:
+        sock = _connect(srv)
+        try:
+            for _ in range(6):
+                _send(sock, {'type': 'ping'})
+                time.sleep(0.3)
+            # still alive, the keepalive messages did reset the heartbeat
+            _send(sock, {'request_id': 'echo',
+                         'worker': 'pyqodeng.core.backend.echo_worker',
+                         'data': 'echo'})
+            assert _recv(sock)['results'] == 'echo'
+        finally:
+            sock.close()
+    finally:
+        _stop_server(srv)
+
+
+def test_heartbeat_timeout(monkeypatch):
+    monkeypatch.setattr(server, 'HEARTBEAT_DELAY', 0.5)
+    srv = _start_server()
+    # the server shuts itself down when no message is received
+    srv._heartbeat_thread.join(5)
+    assert not srv._heartbeat_thread.is_alive()
+    srv.server_close()
+
+
+def test_async_heartbeat_timeout(monkeypatch):
+    monkeypatch.setattr(server, 'HEARTBEAT_DELAY', 0.5)
+    srv = _start_server('--server', 'asyncio')
+    # the event loop stops when no message is received
+    assert srv._done.wait(5)
+    srv.server_close()
+
+
+def test_async_many_connections():
+    nb_threads = threading.active_count()
+    srv = _start_server('--server', 'asyncio', '--workers', '4')
+    socks = [_connect(srv) for _ in range(50)]
+    try:
+        for i, sock in enumerate(socks):
+            _send(sock, {'request_id': str(i),
+                         'worker': 'pyqodeng.core.backend.echo_worker',
+                         'data': i})
+        for i, sock in enumerate(socks):
+            response = _recv(sock)
+            assert response == {'request_id': str(i), 'results': i}
+        # no thread per connection: event loop + worker slots
+        assert threading.active_count() - nb_threads < 10
+    finally:
+        for sock in socks:
+            sock.close()
+        _stop_server(srv)
+
+
+@pytest.mark.skipif(not hasattr(socket, 'AF_UNIX'),
+                    reason='unix domain sockets not supported')
+@pytest.mark.parametrize('server_class', [
+    server.JsonServer, async_server.AsyncJsonServer])
+def test_unix_transport(tmpdir, server_class):
+    path = str(tmpdir.join('backend.sock'))
+    args = server.default_parser().parse_args([path, '--transport', 'unix'])
+    srv = server_class(args=args)
+    thread = threading.Thread(target=srv.serve_forever)
+    thread.daemon = True
+    thread.start()
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    sock.settimeout(10)
+    try:
+        sock.connect(path)
+        assert os.stat(path).st_mode & 0o777 == 0o600
+        _send(sock, {'request_id': 'echo',
+                     'worker': 'pyqodeng.core.backend.echo_worker',
+                     'data': 'echo'})
+        assert _recv(sock)['results'] == 'echo'
+    finally:
+        sock.close()
+        _stop_server(srv)
+    assert not os.path.exists(path)
+
+
+@pytest.mark.parametrize('server_type', ['threading', 'asyncio'])
+def test_stdio_transport(server_type):
+    root = os.path.dirname(os.path.dirname(os.path.dirname(
+        os.path.abspath(__file__))))
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join(
+        [root] + [p for p in [env.get('PYTHONPATH')] if p])
+    process = subprocess.Popen(
+        [sys.executable, server.__file__, '-', '--transport', 'stdio',
+         '--server', server_type],
+        stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE, env=env)
+    try:
+        # echo_worker prints a message, it must not end up in the data
+        # channel.
+        for i in range(3):
+            msg = json.dumps({'request_id': str(i),
+                              'worker': 'pyqodeng.core.backend.echo_worker',
+                              'data': i}).encode('utf-8')
+            process.stdin.write(struct.pack('=I', len(msg)) + msg)
+        process.stdin.flush()
+        responses = []
+        for _ in range(3):
+            size = struct.unpack('=I', process.stdout.read(4))[0]
+            responses.append(json.loads(
+                process.stdout.read(size).decode('utf-8')))
+        assert sorted(r['results'] for r in responses) == [0, 1, 2]
+        # the server exits when stdin is closed
+        process.stdin.close()
+        assert process.wait(10) == 0
+        assert b'echo worker running' in process.stderr.read()
+    finally:
+        if process.poll() is None:
+            process.kill()
+
+
+def test_async_server_imported_on_demand():
+    root = os.path.dirname(os.path.dirname(os.path.dirname(
+        os.path.abspath(__file__))))
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join(
+        [root] + [p for p in [env.get('PYTHONPATH')] if p])
+    # the default server does not load asyncio
+    output = subprocess.check_output(
+        [sys.executable, '-c',
+         'import sys; import pyqodeng.core.backend; '
+         'print("pyqodeng.core.backend.async_server" in sys.modules)'],
+        env=env)
+    assert output.strip() == b'False'
+
+
+@pytest.mark.skipif(not hasattr(os, 'fork'), reason='requires fork')
+def test_zygote():
+    root = os.path.dirname(os.path.dirname(os.path.dirname(
+        os.path.abspath(__file__))))
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join(
+        [root] + [p for p in [env.get('PYTHONPATH')] if p])
+    process = subprocess.Popen(
+        [sys.executable, server.__file__, '-', '--zygote'],
+        stdin=subprocess.PIPE, stdout=subprocess.PIPE, env=env)
+    try:
+        assert process.stdout.readline().strip() == b'zygote ready'
+        test_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        test_socket.bind(('127.0.0.1', 0))
+        port = test_socket.getsockname()[1]
+        test_socket.close()
+        process.stdin.write(('%s\n' % json.dumps(
+            {'port': port, 'transport': 'tcp'})).encode('utf-8'))
+        process.stdin.flush()
+        lines = [process.stdout.readline().decode('utf-8').strip()
+                 for _ in range(2)]
+        forked = [l for l in lines if l.startswith('forked ')]
+        assert len(forked) == 1
+        _, pid, forked_port = forked[0].split(' ')
+        assert int(forked_port) == port
+        assert 'started on 127.0.0.1:%d' % port in lines
+        # the forked server works
+        sock = socket.create_connection(('127.0.0.1', port))
+        _send(sock, {'request_id': '0', 'data': 42,
+                     'worker': 'pyqodeng.core.backend.echo_worker'})
+        assert _recv(sock)['results'] == 42
+        sock.close()
+        # the forked servers share the stdio of the zygote
+        process.stdin.write(('%s\n' % json.dumps(
+            {'port': 'spam', 'transport': 'stdio'})).encode('utf-8'))
+        process.stdin.flush()
+        assert any(line.strip() == b'failed spam'
+                   for line in iter(process.stdout.readline, b''))
+        # the zygote reports its exit and exits once stdin is closed
+        os.kill(int(pid), signal.SIGTERM)
+        process.stdin.close()
+        lines = process.stdout.read().decode('utf-8').splitlines()
+        assert [l for l in lines if l.startswith('exited %s ' % pid)]
+        assert process.wait(10) == 0
+    finally:
+        if process.poll() is None:
+            process.kill()
+
+
+_calls = []
+
+
+def counting_worker(data):
+    """ Worker that returns the number of times it has been called. """
+    _calls.append(data)
+    return len(_calls)
+
+
+def test_result_cache():
+    srv = _start_server('--result-cache', '1')
+    sock = _connect(srv)
+    worker = 'test.test_backend.test_server.counting_worker'
+    try:
+        _send(sock, {'request_id': '1', 'worker': worker, 'data': 'a',
+                     'cache': True})
+        first = _recv(sock)['results']
+        # same request: answered from the cache
+        _send(sock, {'request_id': '2', 'worker': worker, 'data': 'a',
+                     'cache': True})
+        assert _recv(sock) == {'request_id': '2', 'results': first}
+        # different data or no opt-in: the worker runs again
+        _send(sock, {'request_id': '3', 'worker': worker, 'data': 'b',
+                     'cache': True})
+        assert _recv(sock)['results'] == first + 1
+        _send(sock, {'request_id': '4', 'worker': worker, 'data': 'a'})
+        assert _recv(sock)['results'] == first + 2
+    finally:
+        sock.close()
+        _stop_server(srv)
+    assert srv.result_cache.hits == 1
+
+
+def test_stats_worker(json_server):
+    sock = _connect(json_server)
+    try:
+        for i in range(3):
+            _send(sock, {'request_id': str(i),
+                         'worker': 'pyqodeng.core.backend.echo_worker',
+                         'data': i})
+            _recv(sock)
+        _send(sock, {'request_id': 'stats',
+                     'worker': 'pyqodeng.core.backend.metrics.stats_worker',
+                     'data': {}})
+        stats = _recv(sock)['results']
+    finally:
+        sock.close()
+    echo = stats['workers']['pyqodeng.core.backend.echo_worker']
+    assert echo['calls'] == 3
+    assert echo['request_bytes'] > 0
+    assert echo['response_bytes'] > 0
+    assert echo['queue']['count'] == 3
+    assert echo['execution']['count'] == 3
+    assert stats['gauges'] == {'queued': 0, 'running': 0, 'in_flight': 0}
+
+
+def test_profiled_request(json_server):
+    sock = _connect(json_server)
+    worker = 'test.test_backend.test_server.counting_worker'
+    try:
+        _send(sock, {'request_id': '1', 'worker': worker, 'data': 'a',
+                     'profile': True})
+        _recv(sock)
+        # not profiled
+        _send(sock, {'request_id': '2', 'worker': worker, 'data': 'b'})
+        _recv(sock)
+        _send(sock, {'request_id': 'profile',
+                     'worker': 'pyqodeng.core.backend.profiler.'
+                               'profile_worker',
+                     'data': {'reset': True}})
+        summary = _recv(sock)['results']
+    finally:
+        sock.close()
+    assert list(summary) == [worker]
+    assert summary[worker]['requests'] == 1
+    assert any(f['function'].endswith('(counting_worker)')
+               for f in summary[worker]['functions'])
+
+
+def test_profile_option(tmpdir):
+    srv = _start_server('--profile', '--profile-dir', str(tmpdir))
+    sock = _connect(srv)
+    try:
+        _send(sock, {'request_id': '1',
+                     'worker': 'pyqodeng.core.backend.echo_worker',
+                     'data': 'a'})
+        _recv(sock)
+    finally:
+        sock.close()
+        _stop_server(srv)
+    # written when the server shuts down
+    assert tmpdir.join('pyqodeng.core.backend.echo_worker.prof').check()
@@ -1,4 +1,10 @@
+import collections
+import re
+import threading
+import time
+
 import pytest
+from pyqodeng.core.backend import registry
 from pyqodeng.core.backend import workers
 
 
@@ -46,6 +52,78 @@ def test_code_completion_worker():
                 break
     assert found
 
+
+def test_word_index():
+    index = workers.WordIndex(workers.DocumentWordsProvider.separators)
+    index.update('foo bar foo\nspam_eggs 42')
+    assert index.completions() == [
+        {'name': 'foo', 'count': 2}, {'name': 'bar', 'count': 1},
+        {'name': 'spam_eggs', 'count': 1}]
+    completions = index.completions()
+    index.update('foo bar foo\nspam_eggs 42')
+    assert index.completions() is completions
+    index.update('foo baz foo\nspam_eggs 42')
+    assert index.completions() == [
+        {'name': 'foo', 'count': 2}, {'name': 'baz', 'count': 1},
+        {'name': 'spam_eggs', 'count': 1}]
+    index.update('fooo baz foo\nspam_eggs 42')
+    assert index.completions() == [
+        {'name': 'baz', 'count': 1}, {'name': 'foo', 'count': 1},
+        {'name': 'fooo', 'count': 1}, {'name': 'spam_eggs', 'count': 1}]
+    # the previous results are not modified
+    assert completions[0] == {'name': 'foo', 'count': 2}
+
+
+def test_word_index_random_edits():
+    import random
+    rand = random.Random(0)
+    separators = workers.DocumentWordsProvider.separators
+    alphabet = 'abc_ (.\n1'
+    index = workers.WordIndex(separators)
+    index.BLOCK_SIZE = 8
+    text = ''
+    for _ in range(500):
+        position = rand.randint(0, len(text))
+        removed = rand.randint(0, min(5, len(text) - position))
+        added = ''.join(rand.choice(alphabet)
+                        for _ in range(rand.randint(0, 5)))
+        text = text[:position] + added + text[position + removed:]
+        index.update(text)
+        counts = collections.Counter(
+            word for word in re.split('[ (.\n]', text)
+            if word.replace('_', '').isalpha())
+        assert index.completions() == [
+            {'name': word, 'count': counts[word]}
+            for word in sorted(counts, key=lambda w: (-counts[w], w))]
+
+
+def test_document_words_provider():
+    provider = workers.DocumentWordsProvider()
+    # no document: nothing is indexed
+    assert provider.complete('foo bar foo', 0, 0, None, 'utf-8', '') == [
+        {'name': 'foo', 'count': 2}, {'name': 'bar', 'count': 1}]
+    assert not provider._indexes
+    try:
+        workers._thread_data.document = {'id': 'a', 'version': 1,
+                                         'path': None}
+        assert provider.complete('foo bar', 0, 0, None, 'utf-8', '') == [
+            {'name': 'bar', 'count': 1}, {'name': 'foo', 'count': 1}]
+        assert provider.complete(
+            'foo bar eggs foo', 0, 0, None, 'utf-8', '') == [
+            {'name': 'foo', 'count': 2}, {'name': 'bar', 'count': 1},
+            {'name': 'eggs', 'count': 1}]
+        # another unsaved document has its own index
+        workers._thread_data.document = {'id': 'b', 'version': 1,
+                                         'path': None}
+        assert provider.complete('spam', 0, 0, None, 'utf-8', '') == [
+            {'name': 'spam', 'count': 1}]
+        assert list(provider._indexes) == ['a', 'b']
+    finally:
+        workers._thread_data.document = None
+    provider.on_document_closed('a')
+    assert list(provider._indexes) == ['b']
+
+
 with open('test/files/foo.py', 'r') as f:
     foo_py = f.read()
 
@@ -114,3 +192,105 @@ with open('test/files/foo.py', 'r') as f:
 def test_find_all(data, nb_expected):
     results = workers.findall(data)
     assert len(results) == nb_expected
+
+
+class CountingParser(object):
+    """ Artifact factory that counts the parses. """
+    def __init__(self, delay=0):
+        self.calls = 0
+        self.delay = delay
+
+    def __call__(self, text):
+        self.calls += 1
+        time.sleep(self.delay)
+        return text.split()
+
+
+def test_artifact_cache_reuse():
+    cache = workers.ArtifactCache()
+    parse = CountingParser()
+    document = {'id': 'doc', 'version': 1, 'path': ''}
+    tree = cache.get('words', parse, 'a b', document)
+    assert tree == ['a', 'b']
+    assert cache.get('words', parse, 'a b', document) is tree
+    assert parse.calls == 1
+    # another artifact of the same revision
+    assert cache.get('upper', str.upper, 'a b', document) == 'A B'
+    assert parse.calls == 1
+
+
+def test_artifact_cache_new_revision():
+    cache = workers.ArtifactCache()
+    parse = CountingParser()
+    cache.get('words', parse, 'a b', {'id': 'doc', 'version': 1})
+    assert cache.get('words', parse, 'a b c',
+                     {'id': 'doc', 'version': 2}) == ['a', 'b', 'c']
+    assert parse.calls == 2
+    # a late request for the previous revision is not cached and does not
+    # evict the newer artifacts
+    assert cache.get('words', parse, 'a b',
+                     {'id': 'doc', 'version': 1}) == ['a', 'b']
+    cache.get('words', parse, 'a b c', {'id': 'doc', 'version': 2})
+    assert parse.calls == 3
+    cache.discard('doc')
+    cache.get('words', parse, 'a b c', {'id': 'doc', 'version': 2})
+    assert parse.calls == 4
+
+
+def test_artifact_cache_text_key():
+    cache = workers.ArtifactCache(max_documents=2)
+    parse = CountingParser()
+    for text in ('a', 'b', 'a', 'c', 'a'):
+        cache.get('words', parse, text)
+    assert parse.calls == 3
+    assert len(cache) == 2
+    cache.get('words', parse, 'b')
+    assert parse.calls == 4
+
+
+def test_artifact_cache_error():
+    cache = workers.ArtifactCache()
+
+    def fail(text):
+        raise SyntaxError(text)
+
+    with pytest.raises(SyntaxError):
+        cache.get('words', fail, 'a b', {'id': 'doc', 'version': 1})
+    assert cache.get('words', str.split, 'a b',
+                     {'id': 'doc', 'version': 1}) == ['a', 'b']
+
+
+def test_artifact_cache_concurrent():
+    cache = workers.ArtifactCache()
+    parse = CountingParser(delay=0.1)
+    document = {'id': 'doc', 'version': 1}
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(
+        cache.get('words', parse, 'a b', document))) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert parse.calls == 1
+    assert len(results) == 4
+    assert all(result is results[0] for result in results)
+
+
+def test_document_artifact():
+    parse = CountingParser()
+
+    def worker(data):
+        return workers.document_artifact('words', parse, data)
+
+    document = {'id': 'test_document_artifact', 'version': 1, 'path': ''}
+    registry.worker_registry.register(worker, 'test_document_artifact')
+    try:
+        for _ in range(2):
+            assert registry.execute_worker(
+                'test_document_artifact', 'a b', document) == ['a', 'b']
+        assert parse.calls == 1
+        registry.worker_registry.document_closed(document['id'])
+        registry.execute_worker('test_document_artifact', 'a b', document)
+        assert parse.calls == 2
+    finally:
+        workers.artifact_cache.discard(document['id'])
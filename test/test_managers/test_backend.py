@@ -77,3 +77,123 @@ def test_frozen_server():
         backend_manager.send_request(
             backend.echo_worker, 'some data', on_receive=_on_receive)
     backend_manager.start('server.exe')
+
+
+@cwd_at('test')
+def test_backend_pool():
+    """
+    Checks that editors started with a pool size share the pool processes
+    and that the requests of a document always go to the same process.
+    """
+    from pyqodeng.core.managers.backend import BackendPool
+    server = os.path.join(os.getcwd(), 'server.py')
+    editors = [CodeEdit() for _ in range(4)]
+    for editor, path in zip(editors, ['a.py', 'b.py', 'c.py', 'a.py']):
+        editor.file._path = os.path.join(os.getcwd(), path)
+        editor.backend.start(server, pool_size=2)
+    pool = BackendPool.get(server)
+    assert len(pool.backends) == 2
+    assert BackendPool.process_count() <= BackendPool.MAX_PROCESSES
+    assert editors[0].backend._process is editors[3].backend._process
+    results = []
+
+    def on_receive(data):
+        results.append(data)
+
+    for editor in editors:
+        editor.backend.send_request(backend.echo_worker, 'some data',
+                                    on_receive=on_receive)
+    QTest.qWait(1000)
+    assert results == ['some data'] * 4
+    for editor in editors:
+        editor.backend.stop()
+    assert BackendPool.process_count() == 0
+    for editor in editors:
+        editor.close()
+        del editor
+
+
+@cwd_at('test')
+@pytest.mark.parametrize('zygote', [False, True])
+def test_prespawn(zygote):
+    """
+    Checks that an editor started after a prespawn gets the spare backend
+    and that a new spare backend is started for the next editor.
+    """
+    server = os.path.join(os.getcwd(), 'server.py')
+    BackendManager.prespawn(server, zygote=zygote)
+    spare = BackendManager._SPARES[(server, sys.executable, (), 'tcp')][0][0]
+    QTest.qWait(1000)
+    editor = CodeEdit()
+    editor.backend.start(server)
+    assert editor.backend._process is spare
+    results = []
+
+    def on_receive(data):
+        results.append(data)
+
+    editor.backend.send_request(backend.echo_worker, 'some data',
+                                on_receive=on_receive)
+    QTest.qWait(1000)
+    assert results == ['some data']
+    assert BackendManager._SPARES[(server, sys.executable, (), 'tcp')]
+    editor.backend.stop()
+    assert not editor.backend.running
+    BackendManager.stop_prespawned()
+    assert not BackendManager._SPARES
+    editor.close()
+    del editor
+
+
+@cwd_at('test')
+def test_request_timeout():
+    """
+    Checks that a request that is not answered in time is cancelled and
+    that a request with a fallback is then run in process.
+    """
+    from pyqodeng.core.backend.workers import findall
+    server = os.path.join(os.getcwd(), 'server.py')
+    editor = CodeEdit()
+    editor.backend.start(server)
+    QTest.qWait(1000)
+    events = []
+
+    def on_receive(data):
+        events.append(('results', data))
+
+    def on_timeout():
+        events.append('timeout')
+
+    # keeps the worker slot busy
+    editor.backend.send_request('time.sleep', 1, on_receive=on_receive,
+                                timeout=200, on_timeout=on_timeout)
+    editor.backend.send_request(
+        findall, {'string': 'foo bar foo', 'sub': 'foo', 'regex': False,
+                  'whole_word': False, 'case_sensitive': True},
+        on_receive=on_receive, timeout=200, fallback=True)
+    QTest.qWait(500)
+    assert events == ['timeout', ('results', [(0, 3), (8, 11)])]
+    metrics = editor.backend.metrics['workers']
+    assert metrics['time.sleep']['timeouts'] == 1
+    assert metrics['pyqodeng.core.backend.workers.findall']['fallbacks'] == 1
+    editor.backend.stop()
+    editor.close()
+    del editor
+
+
+def test_fallback_conditions():
+    """
+    Checks that the streamed requests and the requests on large documents
+    are never run in process.
+    """
+    editor = CodeEdit()
+    editor.setPlainText('foo\n', 'text/plain', 'utf-8')
+    assert editor.backend._can_fall_back('string', None)
+    assert editor.backend._can_fall_back(None, None)
+    assert not editor.backend._can_fall_back('string', lambda items: None)
+    editor.setPlainText('foo\n' * BackendManager.FALLBACK_MAX_SIZE,
+                        'text/plain', 'utf-8')
+    assert not editor.backend._can_fall_back('string', None)
+    assert editor.backend._can_fall_back(None, None)
+    editor.close()
+    del editor
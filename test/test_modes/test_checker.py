@@ -77,6 +77,24 @@ def test_work_finished(editor):
     mode._on_work_finished([('desc', i % 3, 10 + i) for i in range(40)])
 
 
+@editor_open(__file__)
+def test_work_chunk(editor):
+    mode = get_mode(editor)
+    mode._job_runner.cancel_requests()
+    mode.clear_messages()
+    mode._finished = False
+    mode._on_work_chunk([('desc', i % 3, 10 + i) for i in range(25)])
+    QTest.qWait(50)
+    assert len(mode._messages) == 25
+    # the analysis is still running
+    assert not mode._finished
+    mode._on_work_finished([('desc', 0, 50)])
+    while not mode._finished:
+        QTest.qWait(100)
+    assert len(mode._messages) == 26
+    mode.clear_messages()
+
+
 i = 0
 
 
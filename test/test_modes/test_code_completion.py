@@ -61,6 +61,9 @@ def test_properties(editor):
     assert mode.show_tooltips is False
     mode.case_sensitive = True
     assert mode.case_sensitive is True
+    mode.concurrent_providers = True
+    assert mode.concurrent_providers is True
+    mode.concurrent_providers = False
     mode.trigger_key = 1
 
 
@@ -191,6 +194,112 @@ def test_show_completion_with_icon(editor):
                              'icon': ':/pyqode-icons/rc/edit-undo.png'}])
 
 
+@ensure_empty
+def test_session_covers(editor):
+    mode = get_mode(editor)
+    mode._completions = [{'name': 'alpha'}, {'name': 'alpine'}]
+    mode._completions_total = mode._completions_received = 2
+    mode._session = (3, 0, 'al', True)
+    # same word, refined prefix
+    assert mode._session_covers(3, 0, 'alp')
+    assert mode._session_covers(3, 0, 'AL')
+    # shorter prefix or another word
+    assert not mode._session_covers(3, 0, 'a')
+    assert not mode._session_covers(3, 4, 'alp')
+    assert not mode._session_covers(2, 0, 'alp')
+    # the backend did not send all the matching completions
+    mode._completions_total = 10
+    assert not mode._session_covers(3, 0, 'alp')
+    mode._completions_total = 2
+    mode._late_truncated = True
+    assert not mode._session_covers(3, 0, 'alp')
+    mode._late_truncated = False
+    # unfiltered completions
+    mode._session = (3, 0, 'al', False)
+    assert mode._session_covers(3, 0, 'a')
+    mode._session = None
+    assert not mode._session_covers(3, 0, 'alp')
+    mode._completions = []
+    mode._completions_total = mode._completions_received = 0
+
+
+@ensure_empty
+@ensure_visible
+def test_session_requests_once(editor, monkeypatch):
+    mode = get_mode(editor)
+    requests = []
+
+    def send_request(worker, args=None, on_receive=None, **kwargs):
+        requests.append((args, on_receive))
+
+    monkeypatch.setattr(editor.backend, 'send_request', send_request)
+    TextHelper(editor).goto_line(4)
+    QTest.keyClicks(editor, 'al')
+    assert len(requests) == 1
+    args, on_receive = requests[0]
+    on_receive([(args['line'], args['column'], args['request_id']),
+                [{'name': 'alpha'}, {'name': 'alphabet'}, {'name': 'beta'}]])
+    QTest.keyClicks(editor, 'p')
+    assert len(requests) == 1
+    # the popup is closed but the user keeps typing the same word: the
+    # completions are filtered locally
+    QTest.keyPress(editor, QtCore.Qt.Key_Escape)
+    QTest.keyClicks(editor, 'hab')
+    assert len(requests) == 1
+    # another word needs new completions
+    QTest.keyClicks(editor, ' b')
+    assert len(requests) == 2
+    mode._session = None
+
+
+@ensure_empty
+@ensure_visible
+def test_scroll_during_late_completions(editor, monkeypatch):
+    mode = get_mode(editor)
+    mode.concurrent_providers = True
+    mode.max_completions = 20
+    requests = []
+
+    def send_request(worker, args=None, on_receive=None, **kwargs):
+        requests.append((args, on_receive, kwargs))
+
+    monkeypatch.setattr(editor.backend, 'send_request', send_request)
+    TextHelper(editor).goto_line(4)
+    cursor = editor.textCursor()
+    cursor.insertText('al')
+    editor.setTextCursor(cursor)
+    mode.request_completion()
+    assert len(requests) == 1
+    args, _, kwargs = requests[0]
+    context = (args['line'], args['column'], args['request_id'], 40)
+    kwargs['on_chunk']([[context, [{'name': 'al%d' % i}
+                                   for i in range(20)]]])
+    assert mode._is_popup_visible()
+    # scrolling to the end of the popup requests the next completions
+    # while a late provider is still running
+    scroll_bar = mode._completer.popup().verticalScrollBar()
+    scroll_bar.setValue(scroll_bar.maximum())
+    assert len(requests) == 2
+    page_args, on_page, page_kwargs = requests[1]
+    assert page_args['offset'] == 20
+    assert not page_kwargs['supersede']
+    # the completions of the late provider are still shown
+    kwargs['on_chunk']([[context[:3], [{'name': 'alpha'}]]])
+    on_page([[context, [{'name': 'al%d' % i} for i in range(20, 40)]]])
+    names = [completion['name'] for completion in mode._completions]
+    assert 'alpha' in names
+    assert len(names) == 41
+    assert not mode._has_missing_completions()
+    # a page of a previous request is dropped
+    on_page([[(context[0], context[1], context[2] - 1, 40),
+              [{'name': 'alstale'}]]])
+    assert len(mode._completions) == 41
+    mode._hide_popup()
+    mode.concurrent_providers = False
+    mode.max_completions = None
+    mode._session = None
+
+
 @pytest.mark.parametrize('case', [
     QtCore.Qt.CaseSensitive, QtCore.Qt.CaseInsensitive])
 def test_subsequence_completer(case):